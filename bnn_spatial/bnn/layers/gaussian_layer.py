@@ -7,10 +7,45 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn.init as init
+from torch.utils.checkpoint import checkpoint
+
+
+def coeff_field(X_RBF, coeffs):
+    """
+    Evaluate spatially varying (pre-softplus) hyperparameters from their coefficients, at each location.
+
+    :param X_RBF: torch.Tensor, size (batch_size, rbf_dim), embedding layer output
+    :param coeffs: tuple, either the full coefficient tensor of size (rbf_dim, *param_shape), or the rank-r CP
+        factors of a weight coefficient tensor, of sizes (rbf_dim, r), (input_dim, r) and (output_dim, r)
+    :return: torch.Tensor, size (batch_size, *param_shape), hyperparameter values
+    """
+    if len(coeffs) == 3:
+        return torch.einsum('br,ir,or->bio', X_RBF @ coeffs[0], coeffs[1], coeffs[2])
+    return torch.tensordot(X_RBF, coeffs[0], dims=([1], [0]))
+
+
+def _parameter_chunk(X, X_RBF, Z, n_rho, *coeffs):
+    """
+    Compute X @ W(x) for a chunk of locations, with W(x) = mu(x) + std(x) * Z and one prior per parameter.
+
+    :param X: torch.Tensor, size (n_samples or 1, chunk_size, input_dim), layer input at the chunk locations
+    :param X_RBF: torch.Tensor, size (chunk_size, rbf_dim), embedding layer output at the chunk locations
+    :param Z: torch.Tensor, size (n_samples, input_dim, output_dim), standard normal weights shared across locations
+    :param n_rho: int, number of std dev coefficient tensors at the start of coeffs (1, or 3 if factorised)
+    :param coeffs: torch.Tensor, std dev coefficients, followed by (optional) mean coefficients (see coeff_field)
+    :return: torch.Tensor, size (n_samples, chunk_size, output_dim), output without NTK scaling or bias
+    """
+    std = F.softplus(coeff_field(X_RBF, coeffs[:n_rho]))  # (chunk_size, input_dim, output_dim)
+    out = (X.unsqueeze(-2) @ (std.unsqueeze(0) * Z.unsqueeze(1))).squeeze(-2)
+    if len(coeffs) > n_rho:
+        mu = coeff_field(X_RBF, coeffs[n_rho:])
+        out = out + (X.transpose(0, 1) @ mu).transpose(0, 1)
+    return out
 
 
 class GaussianLayer(nn.Module):
-    def __init__(self, input_dim, output_dim, rbf_dim=None, prior_per='layer', fit_means=True, nonstationary=False):
+    def __init__(self, input_dim, output_dim, rbf_dim=None, prior_per='layer', fit_means=True, nonstationary=False,
+                 rank=None):
         """
         Implementation of BNN prior layer with Gaussian prior over parameters.
 
@@ -20,6 +55,9 @@ class GaussianLayer(nn.Module):
         :param prior_per: str, indicates either one prior per `layer` or `parameter`
         :param fit_means: bool, specify if means are fitted as parameters (set to zero otherwise)
         :param nonstationary: bool, specify if spatial dependence is incorporated into hyperparameters
+        :param rank: int, (optional) rank of CP factorisation of the weight coefficient tensors (nonstationary case,
+            one prior per parameter), i.e. coeffs[k, i, o] = sum_r U[k, r] V[i, r] T[o, r], stored as
+            W_rho_coeffs_rbf, W_rho_coeffs_in, W_rho_coeffs_out (and likewise for W_mu_coeffs)
         """
         super().__init__()
         self.input_dim = input_dim
@@ -27,9 +65,13 @@ class GaussianLayer(nn.Module):
         self.nonstationary = nonstationary
         self.prior_per = prior_per
         self.fit_means = fit_means
+        self.memory_budget = 2**28  # bytes per chunk of per-location weights (nonstationary, prior per parameter)
 
         if nonstationary and rbf_dim is None:
             raise Exception('Must specify number of RBFs for nonstationary case.')
+        if rank is not None and not (nonstationary and prior_per == 'parameter'):
+            raise Exception('Factorised coefficients require the nonstationary case with one prior per parameter.')
+        self.rank = rank
 
         # Set dimensions of optimised parameters
         if prior_per == 'layer':
@@ -46,7 +88,20 @@ class GaussianLayer(nn.Module):
             raise ValueError("Accepted values for prior_per: `parameter` or `layer`")
 
         # Define optimised hyperparameters and require gradient (make autograd record operations)
-        if self.nonstationary:
+        if self.nonstationary and rank is not None:
+            # Note: factors scaled so that the coefficients have unit variance, as in the full case, and the mean
+            #       coefficients are zero with nonzero input/output factors (all-zero factors would get zero gradients)
+            if fit_means:
+                self.W_mu_coeffs_rbf = nn.Parameter(torch.zeros(rbf_dim, rank), requires_grad=True)
+                self.W_mu_coeffs_in = nn.Parameter(torch.randn(input_dim, rank), requires_grad=True)
+                self.W_mu_coeffs_out = nn.Parameter(torch.randn(output_dim, rank), requires_grad=True)
+                self.b_mu_coeffs = nn.Parameter(torch.zeros(self.b_shape), requires_grad=True)
+            scale = rank ** (-1 / 6)
+            self.W_rho_coeffs_rbf = nn.Parameter(scale * torch.randn(rbf_dim, rank), requires_grad=True)
+            self.W_rho_coeffs_in = nn.Parameter(scale * torch.randn(input_dim, rank), requires_grad=True)
+            self.W_rho_coeffs_out = nn.Parameter(scale * torch.randn(output_dim, rank), requires_grad=True)
+            self.b_rho_coeffs = nn.Parameter(torch.randn(self.b_shape), requires_grad=True)
+        elif self.nonstationary:
             if fit_means:
                 self.W_mu_coeffs = nn.Parameter(torch.zeros(self.W_shape), requires_grad=True)
                 self.b_mu_coeffs = nn.Parameter(torch.zeros(self.b_shape), requires_grad=True)
@@ -63,7 +118,17 @@ class GaussianLayer(nn.Module):
         """
         Reset parameters to values sampled from std normal distribution.
         """
-        if self.nonstationary:
+        if self.nonstationary and self.rank is not None:
+            for factor in self._W_coeffs('rho'):
+                init.normal_(factor, std=self.rank ** (-1 / 6))
+            init.normal_(self.b_rho_coeffs)
+            if self.fit_means:
+                U, V, T = self._W_coeffs('mu')
+                init.zeros_(U)
+                init.normal_(V)
+                init.normal_(T)
+                init.zeros_(self.b_mu_coeffs)
+        elif self.nonstationary:
             init.normal_(self.W_rho_coeffs)
             init.normal_(self.b_rho_coeffs)
             if self.fit_means:
@@ -76,6 +141,17 @@ class GaussianLayer(nn.Module):
                 init.zeros_(self.W_mu)
                 init.zeros_(self.b_mu)
 
+    def _W_coeffs(self, kind):
+        """
+        Obtain the weight coefficient tensors (nonstationary case), full or factorised.
+
+        :param kind: str, `rho` (std dev) or `mu` (mean)
+        :return: tuple of torch.Tensor, coefficient tensor, or its CP factors (see coeff_field)
+        """
+        if self.rank is not None:
+            return tuple(getattr(self, 'W_{}_coeffs_{}'.format(kind, k)) for k in ('rbf', 'in', 'out'))
+        return (getattr(self, 'W_{}_coeffs'.format(kind)),)
+
     def forward(self, X, X_RBF=None):
         """
         Performs forward pass through layer given input data.
@@ -84,15 +160,15 @@ class GaussianLayer(nn.Module):
         :return: torch.Tensor, size (batch_size, output_dim), output data
         """
         if self.nonstationary:
-            X = X.to(self.W_rho_coeffs.device)
+            X = X.to(self.b_rho_coeffs.device)
             if X_RBF is None:
-                X_RBF = X.detach().clone()
+                X_RBF = X.detach()  # shares storage, read-only
             else:
-                X_RBF = X_RBF.to(self.W_rho_coeffs.device)
-            W_std = F.softplus(torch.tensordot(X_RBF, self.W_rho_coeffs, dims=([1],[0])))  # [batch_size, W_shape]
+                X_RBF = X_RBF.to(self.b_rho_coeffs.device)
+            W_std = F.softplus(coeff_field(X_RBF, self._W_coeffs('rho')))  # [batch_size, W_shape]
             b_std = F.softplus(torch.tensordot(X_RBF, self.b_rho_coeffs, dims=([1],[0])))  # [batch_size, b_shape]
             if self.fit_means:
-                W_mu = torch.tensordot(X_RBF, self.W_mu_coeffs, dims=([1],[0]))  # [batch_size, W_shape]
+                W_mu = coeff_field(X_RBF, self._W_coeffs('mu'))  # [batch_size, W_shape]
                 b_mu = torch.tensordot(X_RBF, self.b_mu_coeffs, dims=([1],[0]))  # [batch_size, b_shape]
             else:
                 W_mu = 0.
@@ -127,48 +203,54 @@ class GaussianLayer(nn.Module):
             W = W / math.sqrt(self.input_dim)  # NTK
             return X @ W + b
 
-    def sample_predict(self, X, n_samples, X_RBF=None):
+    def sample_predict(self, X, n_samples, X_RBF=None, local_reparam=False):
         """
         Perform predictions using n_samples different sampled network parameters.
 
+        Note: with local_reparam, the (Gaussian) outputs are sampled directly at each input, with mean X @ W_mu and
+        variance X^2 @ W_std^2, instead of sampling weights. The distribution at any single input is unchanged, but
+        outputs at different inputs are no longer coupled through shared weights (stationary case only).
+
         :param X: torch.Tensor, size (batch_size, input_dim) or (n_samples, batch_size, input_dim), input data
         :param n_samples: int, number of network samples
         :param X_RBF: torch.Tensor, contains embedding layer output (RBF values in each neuron)
+        :param local_reparam: bool, specify if outputs are sampled with the local reparameterisation
         :return: torch.Tensor, size (n_samples, batch_size, output_dim), output data
         """
         if self.nonstationary:
-            X = X.to(self.W_rho_coeffs.device)
-
-            # Resize input X appropriately
+            X = X.to(self.b_rho_coeffs.device)
             if len(X.shape) == 2:
-                X_RBF = X.detach().clone()
-                X = X[None, :, None, :].repeat(n_samples, 1, 1, 1)
+                X_RBF = X.detach()  # shares storage, read-only
             else:
-                X_RBF = X_RBF.to(self.W_rho_coeffs.device)
-                X = X.unsqueeze(2)
+                X_RBF = X_RBF.to(self.b_rho_coeffs.device)
+
+            # Standard normal weights shared across locations, W(x) = mu(x) + std(x) * Z for each network sample
+            Z = torch.randn((n_samples, self.input_dim, self.output_dim), device=X.device)
+            Zb = torch.randn((n_samples, 1, self.output_dim), device=X.device)
 
             if self.prior_per == 'layer':
-                W_std = F.softplus(X_RBF @ self.W_rho_coeffs).squeeze()[None, :, None, None]
-                b_std = F.softplus(X_RBF @ self.b_rho_coeffs).squeeze()[None, :, None]
+                # Scalar mu(x) and std(x), so X @ W(x) = mu(x) sum(X) + std(x) (X @ Z) and no per-location weights
+                W_std = F.softplus(X_RBF @ self.W_rho_coeffs)  # (batch_size, 1)
+                b_std = F.softplus(X_RBF @ self.b_rho_coeffs)  # (batch_size, 1)
+                XW = W_std * (X @ Z)  # (n_samples, batch_size, output_dim)
+                if self.fit_means:
+                    XW = XW + (X_RBF @ self.W_mu_coeffs) * X.sum(-1, keepdim=True)
+                    b_mu = X_RBF @ self.b_mu_coeffs
+                else:
+                    b_mu = 0.
             elif self.prior_per == 'parameter':
-                W_std = F.softplus(torch.tensordot(X_RBF, self.W_rho_coeffs, dims=([1],[0]))).unsqueeze(0)
-                b_std = F.softplus(torch.tensordot(X_RBF, self.b_rho_coeffs, dims=([1],[0]))).unsqueeze(0)
+                XW = self._parameter_product(X, X_RBF, Z)
+                b_std = F.softplus(torch.tensordot(X_RBF, self.b_rho_coeffs, dims=([1],[0])))  # (batch_size, output_dim)
+                if self.fit_means:
+                    b_mu = torch.tensordot(X_RBF, self.b_mu_coeffs, dims=([1],[0]))
+                else:
+                    b_mu = 0.
 
-            if self.fit_means:
-                if self.prior_per == 'layer':
-                    W_mu = (X_RBF @ self.W_mu_coeffs).squeeze()[None, :, None, None]
-                    b_mu = (X_RBF @ self.b_mu_coeffs).squeeze()[None, :, None]
-                elif self.prior_per == 'parameter':
-                    W_mu = torch.tensordot(X_RBF, self.W_mu_coeffs, dims=([1],[0])).unsqueeze(0)
-                    b_mu = torch.tensordot(X_RBF, self.b_mu_coeffs, dims=([1],[0])).unsqueeze(0)
-            else:
-                W_mu = 0.
-                b_mu = 0.
-
-            Ws = W_mu + W_std * torch.randn((n_samples, 1, self.input_dim, self.output_dim), device=W_std.device)
-            bs = b_mu + b_std * torch.randn((n_samples, 1, self.output_dim), device=b_std.device)
-            Ws = Ws / math.sqrt(self.input_dim)  # NTK
-            return (X @ Ws).squeeze() + bs.squeeze()
+            bs = b_mu + b_std * Zb
+            XW = XW / math.sqrt(self.input_dim)  # NTK
+            return XW.squeeze() + bs.squeeze()
+        elif local_reparam:
+            return self._local_reparam_predict(X.to(self.W_rho.device), n_samples)
         else:
             X = X.to(self.W_rho.device)
             if self.fit_means:
@@ -183,3 +265,56 @@ class GaussianLayer(nn.Module):
                                                              device=self.b_rho.device)
             Ws = Ws / math.sqrt(self.input_dim)  # NTK
             return X @ Ws + bs
+
+    def _local_reparam_predict(self, X, n_samples):
+        """
+        Sample outputs of a stationary layer directly from their Gaussian distribution at each input.
+
+        :param X: torch.Tensor, size (batch_size, input_dim) or (n_samples, batch_size, input_dim), input data
+        :param n_samples: int, number of network samples
+        :return: torch.Tensor, size (n_samples, batch_size, output_dim), output data
+        """
+        W_var = F.softplus(self.W_rho) ** 2
+        if self.prior_per == 'layer':
+            var = W_var * (X ** 2).sum(-1, keepdim=True)
+        else:
+            var = (X ** 2) @ W_var
+        var = var / self.input_dim + F.softplus(self.b_rho) ** 2  # NTK
+        Z = torch.randn((n_samples, X.shape[-2], self.output_dim), device=X.device)
+        out = torch.sqrt(var) * Z
+        if self.fit_means:
+            if self.prior_per == 'layer':
+                XW_mu = self.W_mu * X.sum(-1, keepdim=True)
+            else:
+                XW_mu = X @ self.W_mu
+            out = out + XW_mu / math.sqrt(self.input_dim) + self.b_mu
+        return out
+
+    def _parameter_product(self, X, X_RBF, Z):
+        """
+        Compute X @ W(x) with one prior per parameter, in chunks of locations that fit within self.memory_budget.
+
+        Note: per-location weights are only formed one chunk at a time, and each chunk is recomputed in the backward
+        pass (checkpointing) rather than stored, so peak memory does not grow with batch_size * input_dim * output_dim.
+
+        :param X: torch.Tensor, size (batch_size, input_dim) or (n_samples, batch_size, input_dim), input data
+        :param X_RBF: torch.Tensor, size (batch_size, rbf_dim), embedding layer output
+        :param Z: torch.Tensor, size (n_samples, input_dim, output_dim), standard normal weights
+        :return: torch.Tensor, size (n_samples, batch_size, output_dim), output without NTK scaling or bias
+        """
+        X = X if len(X.shape) == 3 else X.unsqueeze(0)
+        n_loc = X_RBF.shape[0]
+        if self.memory_budget is None:
+            rows = n_loc
+        else:
+            per_loc = Z.shape[0] * self.input_dim * self.output_dim * Z.element_size()
+            rows = max(1, int(self.memory_budget // per_loc))
+        coeffs = self._W_coeffs('rho') + (self._W_coeffs('mu') if self.fit_means else ())
+        use_checkpoint = rows < n_loc and torch.is_grad_enabled() and coeffs[0].requires_grad
+
+        out = []
+        for start in range(0, n_loc, rows):
+            stop = min(start + rows, n_loc)
+            args = (X[:, start:stop], X_RBF[start:stop], Z, 1 if self.rank is None else 3) + coeffs
+            out.append(checkpoint(_parameter_chunk, *args) if use_checkpoint else _parameter_chunk(*args))
+        return torch.cat(out, dim=1)
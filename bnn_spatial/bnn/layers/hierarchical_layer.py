@@ -26,6 +26,7 @@ class HierarchicalLayer(nn.Module):
         self.input_dim = input_dim
         self.output_dim = output_dim
         self.nonstationary = False
+        self.prior_per = prior_per
         self.fit_means = fit_means
 
         # Set dimensions of optimised parameters
@@ -80,129 +81,91 @@ class HierarchicalLayer(nn.Module):
                 init.zeros_(self.W_mu)
                 init.zeros_(self.b_mu)
 
-    def _resample_std(self, X_RBF):
+    def gamma_params(self, X_RBF=None):
         """
-        Obtain std deviations from resampled inverse-gamma variances.
+        Obtain (positive) shape and rate hyperparameters of the Gamma distributions over inverse variances.
 
-        :param X_RBF: torch.Tensor, embedding layer output (for nonstationary case)
-        :return: tuple (torch.Tensor, torch.Tensor), weight std dev, bias std dev
+        :param X_RBF: torch.Tensor, size (batch_size, rbf_dim), embedding layer output (for nonstationary case)
+        :return: tuple of torch.Tensor, weight shape, weight rate, bias shape, bias rate, each of size (batch_size, 1)
+            in the nonstationary case, or the size of the corresponding parameter (1 if one prior per layer) otherwise
         """
-        # Positivity constraints
         if self.nonstationary:
-            W_shape = F.softplus(X_RBF @ self.W_shape_coeffs).squeeze()
-            W_rate = F.softplus(X_RBF @ self.W_rate_coeffs).squeeze()
-            b_shape = F.softplus(X_RBF @ self.b_shape_coeffs).squeeze()
-            b_rate = F.softplus(X_RBF @ self.b_rate_coeffs).squeeze()
-        else:
-            W_shape = F.softplus(self.W_shape)
-            W_rate = F.softplus(self.W_rate)
-            b_shape = F.softplus(self.b_shape)
-            b_rate = F.softplus(self.b_rate)
+            return (F.softplus(X_RBF @ self.W_shape_coeffs), F.softplus(X_RBF @ self.W_rate_coeffs),
+                    F.softplus(X_RBF @ self.b_shape_coeffs), F.softplus(X_RBF @ self.b_rate_coeffs))
+        return F.softplus(self.W_shape), F.softplus(self.W_rate), F.softplus(self.b_shape), F.softplus(self.b_rate)
 
-        # Resample variances (sample from Gamma then invert)
-        W_gamma_dist = dist.Gamma(W_shape, W_rate)
-        b_gamma_dist = dist.Gamma(b_shape, b_rate)
+    def _resample_std(self, X_RBF=None, n_samples=1):
+        """
+        Obtain std deviations from resampled inverse-gamma variances, for each of n_samples networks.
 
-        # Note: rsample() is reparametrised sample, which stores gradients
-        inv_W_var = W_gamma_dist.rsample()
-        inv_b_var = b_gamma_dist.rsample()
+        :param X_RBF: torch.Tensor, embedding layer output (for nonstationary case)
+        :param n_samples: int, number of network samples
+        :return: tuple (torch.Tensor, torch.Tensor), weight std dev, bias std dev, each with leading dim n_samples
+        """
+        W_shape, W_rate, b_shape, b_rate = self.gamma_params(X_RBF)
 
-        # Note: self.eps added in denominator to avoid division by zero
-        W_std = 1. / (torch.sqrt(inv_W_var) + 1e-10)
-        b_std = 1. / (torch.sqrt(inv_b_var) + 1e-10)
+        # Resample variances (sample from Gamma then invert), weights and biases in one reparametrised draw
+        shape = torch.cat([W_shape.reshape(-1), b_shape.reshape(-1)])
+        rate = torch.cat([W_rate.reshape(-1), b_rate.reshape(-1)])
+        inv_var = dist.Gamma(shape, rate, validate_args=False).rsample((n_samples,))
 
-        return W_std, b_std
+        # Note: 1e-10 added in denominator to avoid division by zero
+        std = 1. / (torch.sqrt(inv_var) + 1e-10)
+        W_std, b_std = torch.split(std, [W_shape.numel(), b_shape.numel()], dim=1)
+        return W_std.reshape((n_samples,) + W_shape.shape), b_std.reshape((n_samples,) + b_shape.shape)
 
     def forward(self, X, X_RBF=None):
         """
         Performs forward pass through layer given input data.
 
         :param X: torch.Tensor, size (batch_size, input_dim), input data
+        :param X_RBF: torch.Tensor, size (batch_size, rbf_dim), embedding layer output (defaults to X if None)
         :return: torch.Tensor, size (batch_size, output_dim), output data
         """
-        if self.nonstationary:
-            X = X.to(self.W_rho_coeffs.device)
-            if X_RBF is None:
-                X_RBF = X.detach().clone()
-            else:
-                X_RBF = X_RBF.to(self.W_rho_coeffs.device)
-            W_std, b_std = self._resample_std(X_RBF)  # b_std has shape [batch_size, 1]
-            W_std = W_std.unsqueeze(2)  # need shape [batch_size, 1, 1]
-            if self.fit_means:
-                W_mu = (X_RBF @ self.W_mu_coeffs).unsqueeze(2)  # [batch_size, 1, 1]
-                b_mu = (X_RBF @ self.b_mu_coeffs)  # [batch_size, 1]
-            else:
-                W_mu = 0.
-                b_mu = 0.
-            Zw = torch.randn((1, self.input_dim, self.output_dim), device=W_std.device)
-            Zb = torch.randn((1, self.output_dim), device=b_std.device)
-            W = W_mu + W_std * Zw
-            W = W / math.sqrt(self.input_dim)  # NTK
-            b = b_mu + b_std * Zb
-
-            # Rearrange tensors for broadcasting to work properly
-            if len(X.shape) < len(W.shape):
-                X = X.unsqueeze(1)
-            fwd = (X @ W).squeeze() + b.squeeze()
-            # X @ W is [batch_size, 1, input_dim] * [batch_size, input_dim, output_dim] = [batch_size, 1, output_dim]
-            return fwd
-        else:
-            X = X.to(self.W_rho.device)
-            if self.fit_means:
-                W_mu = self.W_mu
-                b_mu = self.b_mu
-            else:
-                W_mu = 0.
-                b_mu = 0.
-            W = W_mu + F.softplus(self.W_rho) * torch.randn((self.input_dim, self.output_dim), device=self.W_rho.device)
-            b = b_mu + F.softplus(self.b_rho) * torch.randn(self.output_dim, device=self.b_rho.device)
-            W = W / math.sqrt(self.input_dim)  # NTK
-            return X @ W + b
+        fwd = self.sample_predict(X, 1, X_RBF)
+        return fwd if self.nonstationary else fwd[0]
 
-    def sample_predict(self, X, n_samples, X_RBF=None):
+    def sample_predict(self, X, n_samples, X_RBF=None, stds=None):
         """
         Perform predictions using n_samples different sampled network parameters.
 
         :param X: torch.Tensor, size (batch_size, input_dim) or (n_samples, batch_size, input_dim), input data
         :param n_samples: int, number of network samples
-        :param X_RBF: torch.Tensor, contains embedding layer output (RBF values in each neuron)
+        :param X_RBF: torch.Tensor, contains embedding layer output (defaults to X if None, nonstationary case)
+        :param stds: tuple (torch.Tensor, torch.Tensor), weight and bias std devs from self._resample_std (or drawn
+            jointly for all layers by the network), resampled here if None
         :return: torch.Tensor, size (n_samples, batch_size, output_dim), output data
         """
+        X = X.to(self.W_shape_coeffs.device if self.nonstationary else self.W_shape.device)
         if self.nonstationary:
-            X = X.to(self.W_rho_coeffs.device)
-
-            # Resize input X appropriately
-            if len(X.shape) == 2:
-                X_RBF = X.detach().clone()
-                X = X[None, :, None, :].repeat(n_samples, 1, 1, 1)
+            if X_RBF is None:
+                X_RBF = X.detach()  # shares storage, read-only
             else:
-                X_RBF = X_RBF.to(self.W_rho_coeffs.device)
-                X = X.unsqueeze(2)
+                X_RBF = X_RBF.to(X.device)
+        W_std, b_std = self._resample_std(X_RBF, n_samples) if stds is None else stds
 
-            W_std, b_std = self._resample_std(X_RBF)
-            W_std = W_std.squeeze()[None, :, None, None]
-            b_std = b_std.squeeze()[None, :, None]
+        if self.nonstationary:
+            # Std devs of size (n_samples, batch_size, 1), and X @ W(x) = mu(x) sum(X) + std(x) (X @ Z)
+            Z = torch.randn((n_samples, self.input_dim, self.output_dim), device=X.device)
+            XW = W_std * (X @ Z)
             if self.fit_means:
-                W_mu = (X_RBF @ self.W_mu_coeffs).squeeze()[None, :, None, None]
-                b_mu = (X_RBF @ self.b_mu_coeffs).squeeze()[None, :, None]
+                XW = XW + (X_RBF @ self.W_mu_coeffs) * X.sum(-1, keepdim=True)
+                b_mu = X_RBF @ self.b_mu_coeffs
             else:
-                W_mu = 0.
                 b_mu = 0.
-            Ws = W_mu + W_std * torch.randn((n_samples, 1, self.input_dim, self.output_dim), device=W_std.device)
-            bs = b_mu + b_std * torch.randn((n_samples, 1, self.output_dim), device=b_std.device)
-            Ws = Ws / math.sqrt(self.input_dim)  # NTK
-            return (X @ Ws).squeeze() + bs.squeeze()
+            bs = b_mu + b_std * torch.randn((n_samples, 1, self.output_dim), device=X.device)
+            XW = XW / math.sqrt(self.input_dim)  # NTK
+            return XW.squeeze() + bs.squeeze()
         else:
-            X = X.to(self.W_rho.device)
             if self.fit_means:
                 W_mu = self.W_mu
                 b_mu = self.b_mu
             else:
                 W_mu = 0.
                 b_mu = 0.
-            Ws = W_mu + F.softplus(self.W_rho) * torch.randn((n_samples, self.input_dim, self.output_dim),
-                                                             device=self.W_rho.device)
-            bs = b_mu + F.softplus(self.b_rho) * torch.randn((n_samples, 1, self.output_dim),
-                                                             device=self.b_rho.device)
+            W_std = W_std.reshape(n_samples, self.input_dim if self.prior_per == 'parameter' else 1, -1)
+            b_std = b_std.reshape(n_samples, 1, -1)
+            Ws = W_mu + W_std * torch.randn((n_samples, self.input_dim, self.output_dim), device=X.device)
+            bs = b_mu + b_std * torch.randn((n_samples, 1, self.output_dim), device=X.device)
             Ws = Ws / math.sqrt(self.input_dim)  # NTK
             return X @ Ws + bs
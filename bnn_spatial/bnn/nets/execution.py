@@ -0,0 +1,99 @@
+"""
+Optional compiled execution (torch.compile or TorchScript) of network forward passes and function sampling
+"""
+
+import warnings
+import torch
+
+
+def _compile_errors():
+    """
+    Exception types raised by torch.compile when it fails to compile a function.
+
+    :return: tuple, exception types (empty if torch.compile is unavailable)
+    """
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+    except ImportError:
+        return ()
+    return (TorchDynamoException,)
+
+class CompiledExecution(object):
+    """
+    Mixin for networks with a static layer plan, providing compiled versions of forward (and sample_functions).
+
+    Subclasses implement _forward_eager (and optionally _sample_functions_eager), call self.set_execution('eager') at
+    the end of __init__, and route forward/sample_functions through self._run.
+    """
+
+    def set_execution(self, mode='eager', example_input=None, **compile_kwargs):
+        """
+        Select how forward and sample_functions are executed.
+
+        Note: compiled functions share parameters with the network, so in-place updates (e.g. SGHMC steps or
+        load_state_dict) are seen by them. Call set_execution again if parameter tensors are replaced.
+
+        :param mode: str, `eager` (Python), `compile` (torch.compile, PyTorch >= 2.0), or `script` (TorchScript
+            trace of forward only, which fixes the control flow seen with example_input)
+        :param example_input: torch.Tensor, size (batch_size, input_dim), example input used to trace forward
+        :param compile_kwargs: keyword arguments passed on to torch.compile (e.g. mode='reduce-overhead')
+        :return: str, execution mode in use (`eager` if compilation is unavailable or failed, with a warning)
+        """
+        self._compiled = {}
+        self._compiled_ok = set()  # compiled methods whose first call (compilation) succeeded
+        if mode == 'compile':
+            if hasattr(torch, 'compile'):
+                self._compiled['forward'] = torch.compile(self._forward_eager, **compile_kwargs)
+                if hasattr(self, '_sample_functions_eager'):
+                    self._compiled['sample_functions'] = torch.compile(self._sample_functions_eager,
+                                                                       **compile_kwargs)
+            else:
+                warnings.warn('torch.compile requires PyTorch >= 2.0, using eager execution')
+                mode = 'eager'
+        elif mode == 'script':
+            if example_input is None:
+                raise ValueError('Execution mode `script` requires example_input')
+            try:
+                self._compiled['forward'] = torch.jit.trace(self, example_input, check_trace=False)
+            except Exception as e:
+                warnings.warn('TorchScript tracing failed ({}), using eager execution'.format(e))
+                mode = 'eager'
+        elif mode != 'eager':
+            raise ValueError("Accepted values: `eager`, `compile`, or `script`")
+        self.execution_mode = mode
+        return mode
+
+    def _run(self, name, *args):
+        """
+        Call the compiled version of a method if there is one.
+
+        Note: torch.compile compiles on the first call, so only a compilation failure in that call (a TorchDynamo
+        error, while the same call succeeds in eager mode) reverts to eager execution; any other error propagates.
+
+        :param name: str, method name (`forward` or `sample_functions`)
+        :param args: arguments of the method
+        :return: output of the method
+        """
+        eager_fn = getattr(self, '_{}_eager'.format(name))
+        compiled_fn = self._compiled.get(name)
+        if compiled_fn is None:
+            return eager_fn(*args)
+        if self.execution_mode != 'compile' or name in self._compiled_ok:
+            return compiled_fn(*args)
+        try:
+            out = compiled_fn(*args)
+        except _compile_errors() as e:
+            out = eager_fn(*args)  # errors of the network itself are raised here
+            warnings.warn('Compiling {} failed ({}), reverting to eager execution'.format(name, e))
+            self.set_execution('eager')
+            return out
+        self._compiled_ok.add(name)
+        return out
+
+    def __getstate__(self):
+        # Compiled functions are not picklable, so copies (and saved networks) revert to eager execution
+        state = self.__dict__.copy()
+        state['_compiled'] = {}
+        state['_compiled_ok'] = set()
+        state['execution_mode'] = 'eager'
+        return state
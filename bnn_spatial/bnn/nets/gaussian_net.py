@@ -6,16 +6,16 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
-from copy import deepcopy
 
 from ..activation_fns import *
 from ..layers.gaussian_layer import GaussianLayer
 from ..layers.embedding_layer import EmbeddingLayer
+from .execution import CompiledExecution
 
 
-class GaussianNet(nn.Module):
+class GaussianNet(CompiledExecution, nn.Module):
     def __init__(self, input_dim, output_dim, hidden_dims, activation_fn, domain=None, prior_per='layer',
-                 fit_means=False, rbf_ls=1, nonstationary=False):
+                 fit_means=False, rbf_ls=1, nonstationary=False, rank=None):
         """
         Implementation of BNN prior with Gaussian prior over parameters.
 
@@ -28,6 +28,8 @@ class GaussianNet(nn.Module):
         :param fit_means: bool, specify if means are fitted as parameters (set to zero otherwise)
         :param rbf_ls: float, lengthscale for embedding layer RBFs
         :param nonstationary: bool, specify if spatial dependence is incorporated into hyperparameters
+        :param rank: int, (optional) rank of factorised weight coefficients in layers after the embedding layer
+            (nonstationary case, one prior per parameter), see GaussianLayer
         """
         super().__init__()
         self.input_dim = input_dim
@@ -69,7 +71,8 @@ class GaussianNet(nn.Module):
                                                                         rbf_dim=rbf_dim,
                                                                         prior_per=prior_per,
                                                                         fit_means=fit_means,
-                                                                        nonstationary=nonstationary))
+                                                                        nonstationary=nonstationary,
+                                                                        rank=rank))
 
         # Initialise output layer
         self.layers.add_module('output', GaussianLayer(input_dim=hidden_dims[-1],
@@ -77,7 +80,23 @@ class GaussianNet(nn.Module):
                                                        rbf_dim=rbf_dim,
                                                        prior_per=prior_per,
                                                        fit_means=fit_means,
-                                                       nonstationary=nonstationary))
+                                                       nonstationary=nonstationary,
+                                                       rank=rank))
+
+        # Execution mode (see set_execution)
+        self.set_execution('eager')
+
+    @property
+    def _plan(self):
+        """
+        Layers as a static sequence: (embedding layer or None, tuple of hidden layers, output layer).
+
+        Note: read from the registered layers at call time, so it always matches them (e.g. in DataParallel replicas,
+        copies, or after layers are replaced).
+        """
+        layers = list(self.layers)
+        embedding = layers.pop(0) if isinstance(layers[0], EmbeddingLayer) else None
+        return embedding, tuple(layers[:-1]), layers[-1]
 
     def reset_parameters(self):
         """
@@ -94,20 +113,19 @@ class GaussianNet(nn.Module):
         :param X: torch.Tensor, size (batch_size, input_dim), input data
         :return: torch.Tensor, size (batch_size, output_dim), output data
         """
-        named_layers = self.layers.named_modules()
+        return self._run('forward', X)
+
+    def _forward_eager(self, X):
+        embedding, hidden_layers, output_layer = self._plan
 
         # Propagate input through each layer
         X_RBF = None
-        for name, layer in list(named_layers):
-            if 'embedding' in name:
-                X = layer(X)
-                X_RBF = deepcopy(X)
-            elif 'hidden' in name:
-                X = self.activation_fn(layer(X, X_RBF))
-            elif 'output' in name:
-                X = layer(X, X_RBF)
-
-        return X
+        if embedding is not None:
+            X = embedding(X)
+            X_RBF = X  # shared by all layers, read-only (no copy)
+        for layer in hidden_layers:
+            X = self.activation_fn(layer(X, X_RBF))
+        return output_layer(X, X_RBF)
 
     def sample_functions(self, X, n_samples):
         """
@@ -117,18 +135,35 @@ class GaussianNet(nn.Module):
         :param n_samples: int, number of network samples
         :return: torch.Tensor, size (batch_size, n_samples, output_dim), output data
         """
-        named_layers = self.layers.named_modules()
+        return self._run('sample_functions', X, n_samples)
+
+    def sample_marginals(self, X, n_samples):
+        """
+        Draw the network output at each input separately, using the local reparameterisation in stationary layers (the
+        outputs of each layer are sampled directly at each input, rather than its weights).
+
+        Note: the draws have the exact distribution of the network output at each input (pointwise means, std devs,
+        quantiles), but are independent across inputs, so they are NOT function samples. Use sample_functions wherever
+        samples are compared jointly across inputs (e.g. the Wasserstein distance in stage 1). Cheaper than
+        sample_functions when batch_size < layer width.
+
+        :param X: torch.Tensor, size (batch_size, input_dim), input data
+        :param n_samples: int, number of draws at each input
+        :return: torch.Tensor, size (batch_size, n_samples, output_dim), pointwise output draws
+        """
+        return self._sample_functions_eager(X, n_samples, local_reparam=True)
+
+    def _sample_functions_eager(self, X, n_samples, local_reparam=False):
+        embedding, hidden_layers, output_layer = self._plan
 
         # Propagate input through each layer
         X_RBF = None
-        for name, layer in list(named_layers):
-            if 'embedding' in name:
-                X = layer(X)
-                X_RBF = deepcopy(X)
-            if 'hidden' in name:
-                X = self.activation_fn(layer.sample_predict(X, n_samples, X_RBF))
-            elif 'output' in name:
-                X = layer.sample_predict(X, n_samples, X_RBF)
+        if embedding is not None:
+            X = embedding(X)
+            X_RBF = X  # shared by all layers, read-only (no copy)
+        for layer in hidden_layers:
+            X = self.activation_fn(layer.sample_predict(X, n_samples, X_RBF, local_reparam))
+        X = output_layer.sample_predict(X, n_samples, X_RBF, local_reparam)
 
         # Return network output, with size (batch_size, n_samples, output_dim) after resizing
         X = torch.transpose(X, 0, 1)  # need to rearrange in this manner for compatibility with wasserstein_mapper.py
@@ -4,16 +4,17 @@ BNN with GPi-H prior parameterisation
 
 import torch
 import torch.nn as nn
+import torch.distributions as dist
 import torch.nn.functional as F
 import numpy as np
-from copy import deepcopy
 
 from ..activation_fns import *
 from ..layers.hierarchical_layer import HierarchicalLayer
 from ..layers.embedding_layer import EmbeddingLayer
+from .execution import CompiledExecution
 
 
-class HierarchicalNet(nn.Module):
+class HierarchicalNet(CompiledExecution, nn.Module):
     def __init__(self, input_dim, output_dim, hidden_dims, activation_fn,
                  domain=None, prior_per='layer', fit_means=False, rbf_ls=1):
         """
@@ -72,6 +73,9 @@ class HierarchicalNet(nn.Module):
                                               prior_per=prior_per,
                                               fit_means=fit_means)
 
+        # Execution mode (see set_execution)
+        self.set_execution('eager')
+
     def reset_parameters(self):
         """
         Reset optimised hyperparameters in each non-deterministic layer.
@@ -80,6 +84,39 @@ class HierarchicalNet(nn.Module):
             if isinstance(m, HierarchicalLayer):
                 m.reset_parameters()
 
+    @property
+    def _plan(self):
+        """
+        Layers as a static sequence: (embedding layer or None, tuple of hidden layers, output layer).
+
+        Note: read from the registered layers at call time, so it always matches them (e.g. in DataParallel replicas,
+        copies, or after layers are replaced).
+        """
+        layers = list(self.layers)
+        embedding = layers.pop(0) if isinstance(layers[0], EmbeddingLayer) else None
+        return embedding, tuple(layers), self.output_layer
+
+    def _resample_stds(self, layers, X_RBF, n_samples):
+        """
+        Draw weight and bias std devs of all layers for n_samples networks, in one reparametrised Gamma draw.
+
+        :param layers: list, HierarchicalLayer objects (in order)
+        :param X_RBF: torch.Tensor, embedding layer output (for nonstationary case)
+        :param n_samples: int, number of network samples
+        :return: list of tuples (torch.Tensor, torch.Tensor), weight and bias std devs for each layer
+        """
+        params = [layer.gamma_params(X_RBF) for layer in layers]
+        shapes = [p.shape for ps in params for p in ps[0::2]]  # weight and bias shape hyperparameters of each layer
+        shape = torch.cat([p.reshape(-1) for ps in params for p in ps[0::2]])
+        rate = torch.cat([p.reshape(-1) for ps in params for p in ps[1::2]])
+        inv_var = dist.Gamma(shape, rate, validate_args=False).rsample((n_samples,))
+
+        # Note: 1e-10 added in denominator to avoid division by zero
+        std = 1. / (torch.sqrt(inv_var) + 1e-10)
+        stds = [s.reshape((n_samples,) + sh) for s, sh in zip(torch.split(std, [sh.numel() for sh in shapes], dim=1),
+                                                               shapes)]
+        return list(zip(stds[0::2], stds[1::2]))
+
     def forward(self, X):
         """
         Performs forward pass through the whole network given input data X.
@@ -87,38 +124,52 @@ class HierarchicalNet(nn.Module):
         :param X: torch.Tensor, size (batch_size, input_dim), input data
         :return: torch.Tensor, size (batch_size, output_dim), output data
         """
-        # Apply RBFs to network input
-        embedding_layer = list(self.layers)[0]
-        X = embedding_layer(X)
-        X_RBF = deepcopy(X)
+        return self._run('forward', X)
+
+    def _forward_eager(self, X):
+        embedding, hidden_layers, output_layer = self._plan
+
+        # Apply RBFs to network input (if using embedding layer)
+        X_RBF = None
+        if embedding is not None:
+            X = embedding(X)
+            X_RBF = X  # shared by all layers, read-only (no copy)
 
         # Propagate input through hidden layers, applying activations
-        for layer in list(self.layers)[1:]:
+        for layer in hidden_layers:
             X = self.activation_fn(layer(X, X_RBF))
 
         # Return network output (from output layer)
-        X = self.output_layer(X, X_RBF)
-        return X
+        return output_layer(X, X_RBF)
 
     def sample_functions(self, X, n_samples):
         """
         Performs predictions with BNN at points X, for n_samples different parameter samples (i.e. different BNNs).
 
+        Note: the inverse-gamma variances of all layers are drawn together, in a single batched Gamma draw.
+
         :param X: torch.Tensor, size (batch_size, input_dim), input data
         :param n_samples: int, number of network samples
         :return: torch.Tensor, size (batch_size, n_samples, output_dim), output data
         """
-        # Apply RBFs to network input
-        embedding_layer = list(self.layers)[0]
-        X = embedding_layer(X)
-        X_RBF = deepcopy(X)
+        return self._run('sample_functions', X, n_samples)
+
+    def _sample_functions_eager(self, X, n_samples):
+        embedding, hidden_layers, output_layer = self._plan
+
+        # Apply RBFs to network input (if using embedding layer)
+        X_RBF = None
+        if embedding is not None:
+            X = embedding(X)
+            X_RBF = X  # shared by all layers, read-only (no copy)
+        stds = self._resample_stds(hidden_layers + (output_layer,), X_RBF, n_samples)
 
         # Propagate input through hidden layers, applying activations
-        for layer in list(self.layers)[1:]:
-            X = self.activation_fn(layer.sample_predict(X, n_samples, X_RBF))
+        for layer, layer_stds in zip(hidden_layers, stds):
+            X = self.activation_fn(layer.sample_predict(X, n_samples, X_RBF, layer_stds))
 
         # Return network output, with size (batch_size, n_samples, output_dim) after resizing
-        X = self.output_layer.sample_predict(X, n_samples, X_RBF)
+        X = output_layer.sample_predict(X, n_samples, X_RBF, stds[-1])
         X = torch.transpose(X, 0, 1)  # need to rearrange in this manner for compatibility with wasserstein_mapper.py
         return X
 
@@ -9,9 +9,10 @@ import torch.nn.functional as F
 from ..activation_fns import *
 from ..layers.layer import BlankLayer
 from ..layers.embedding_layer import EmbeddingLayer
+from .execution import CompiledExecution
 
 
-class BlankNet(nn.Module):
+class BlankNet(CompiledExecution, nn.Module):
     def __init__(self, output_dim, hidden_dims, activation_fn, input_dim=None):
         """
         Neural network to be initialised for usage with SGHMC.
@@ -49,6 +50,18 @@ class BlankNet(nn.Module):
         # Output layer
         self.layers.add_module('output', BlankLayer(hidden_dims[-1], output_dim))
 
+        # Execution mode (see set_execution)
+        self.set_execution('eager')
+
+    @property
+    def _plan(self):
+        """
+        Layers as a static sequence: (tuple of hidden layers, output layer), read from the registered layers at call
+        time, so it always matches them (e.g. in DataParallel replicas, copies, or after layers are replaced).
+        """
+        layers = list(self.layers)
+        return tuple(layers[:-1]), layers[-1]
+
     def reset_parameters(self):
         """
         Reset parameters in each layer to values sampled from std normal distribution.
@@ -64,10 +77,10 @@ class BlankNet(nn.Module):
         :param X: torch.Tensor, size (batch_size, input_dim), input data
         :return: torch.Tensor, size (batch_size, output_dim), output data
         """
-        for layer in list(self.layers)[:-1]:
-            X = self.activation_fn(layer(X))
-
-        output_layer = list(self.layers)[-1]
-        X = output_layer(X)
+        return self._run('forward', X)
 
-        return X
+    def _forward_eager(self, X):
+        hidden_layers, output_layer = self._plan
+        for layer in hidden_layers:
+            X = self.activation_fn(layer(X))
+        return output_layer(X)
@@ -6,9 +6,22 @@ import torch
 import numpy as np
 import torch.linalg as la
 import scipy.spatial as sps
+from . import kernels
 
 # Ran into problems using scipy's distance_matrix on GPU (25/08)
 
+def _fusable(sq_dist, params):
+    """
+    Check whether a fused (in-place) kernel evaluator may be used, i.e. autograd does not need intermediate values.
+
+    :param sq_dist: torch.Tensor, squared distance tile
+    :param params: dict, kernel hyperparameters
+    :return: bool, whether the fused evaluator is safe to use
+    """
+    if sq_dist.requires_grad:
+        return False
+    return not any(torch.is_tensor(v) and v.requires_grad for v in params.values())
+
 class Zero(torch.nn.Module):
     def forward(self, X):
         """
@@ -28,44 +41,57 @@ class Kernel(torch.nn.Module):
         :param lengthscale: float, lengthscale parameter (affects average number of upcrossings of level zero)
         """
         super().__init__()
-        self.leng = torch.tensor([lengthscale], dtype=torch.double)
-        self.ampl = torch.tensor([variance], dtype=torch.double)
+        # Note: reshaped to 1D, so that per-dimension lengthscales (lists or tensors) are accepted as well as scalars
+        self.leng = torch.as_tensor(lengthscale, dtype=torch.double).reshape(-1)
+        self.ampl = torch.as_tensor(variance, dtype=torch.double).reshape(-1)
 
-    def square_dist(self, X, X2=None):
+        # Settings for tiled evaluation of large covariance matrices (see K_tiled)
+        self.memory_budget = None  # bytes per tile, None for no tiling
+        self.compute_dtype = torch.float64  # precision used to compute each tile
+
+    def square_dist(self, X, X2=None, dtype=torch.float64):
         """
         Compute squared distance matrix.
 
         :param X: torch.Tensor, first set of input points
         :param X2: torch.Tensor, second set of input points
+        :param dtype: torch.dtype, precision of calculations (float64 unless reduced precision is requested)
         :return: torch.Tensor, squared distances between X and X2
         """
         if X2 is None:
-            X2 = X.clone()
+            X2 = X
 
         # Increase precision of calculations
-        X = X.to(dtype=torch.float64)
-        X2 = X2.to(dtype=torch.float64)
+        X = X.to(dtype=dtype)
+        X2 = X2.to(dtype=dtype)
+
+        # Centre the points in reduced precision, to limit cancellation in the expanded expression below
+        if dtype != torch.float64:
+            centre = X2.mean(0, keepdim=True)
+            X = X - centre
+            X2 = X2 - centre
 
         # Compute squared Euclidean norm at each point
         Xs = (X**2).sum(1)
         X2s = (X2**2).sum(1)
 
-        # Compute distance matrix based on expanded expression
-        dist = -2 * torch.matmul(X, X2.t())
-        dist += Xs.view(-1, 1) + X2s.view(1, -1)
-        return torch.clamp(dist, min=0)  # avoid negative values, due to numerical error
+        # Compute distance matrix based on expanded expression (single n x m allocation)
+        dist = Xs.view(-1, 1) + X2s.view(1, -1)
+        dist.addmm_(X, X2.t(), alpha=-2)
+        return dist.clamp_(min=0)  # avoid negative values, due to numerical error
 
-    def euclid_dist(self, X, X2=None, manual=True):
+    def euclid_dist(self, X, X2=None, manual=True, dtype=torch.float64):
         """
         Compute Euclidean distance matrix (sqrt of above).
 
         :param X: torch.Tensor, first set of input points
         :param X2: torch.Tensor, second set of input points
         :param manual: bool, specify if distance matrix is computed using manually built function
+        :param dtype: torch.dtype, precision of calculations
         :return: torch.Tensor, Euclidean distances between X and X2
         """
         if manual:
-            return torch.sqrt(self.square_dist(X, X2))
+            return self.square_dist(X, X2, dtype=dtype).sqrt_()
         device = X.device
         if X2 is None:
             X2 = X
@@ -80,15 +106,72 @@ class Kernel(torch.nn.Module):
         :return: torch.Tensor, displacements between points in X
         """
         if X2 is None:
-            X2 = X.clone()
-
-        disp1 = X[:, 0].reshape(-1, 1) - X2[:, 0]  # displacements for first coordinate
-        disp2 = X[:, 1].reshape(-1, 1) - X2[:, 1]  # displacements for second coordinate
-        disp = torch.stack([disp1, disp2], dim=2)  # last index [:, :, i] for each displacement matrix
-        disp = torch.unsqueeze(disp, dim=3)  # add extra dimension onto the end
+            X2 = X
 
         # Output displacement array with shape (|X|, |X2|, 2, 1)
-        return disp
+        return (X[:, None, :2] - X2[None, :, :2]).unsqueeze(3)
+
+    def _block_rows(self, n_cols, memory_budget, dtype):
+        """
+        Number of covariance matrix rows per tile that fit within the memory budget.
+
+        :param n_cols: int, number of columns of the covariance matrix
+        :param memory_budget: int, bytes available per tile
+        :param dtype: torch.dtype, precision of calculations
+        :return: int, number of rows per tile
+        """
+        itemsize = torch.tensor([], dtype=dtype).element_size()
+        n_temporaries = 4  # distances, plus temporaries created by the covariance function
+        return max(1, int(memory_budget // (n_cols * itemsize * n_temporaries)))
+
+    def K_blocks(self, X, X2=None, memory_budget=None, dtype=None):
+        """
+        Iterate over row blocks of the covariance matrix, computed within a memory budget.
+
+        :param X: torch.Tensor, first set of input points
+        :param X2: torch.Tensor, second set of input points
+        :param memory_budget: int, bytes per tile (default: self.memory_budget, None for a single block)
+        :param dtype: torch.dtype, precision of calculations (default: self.compute_dtype)
+        :return: generator, yields (start row, stop row, covariance block)
+        """
+        if X2 is None:
+            X2 = X
+        memory_budget = self.memory_budget if memory_budget is None else memory_budget
+        dtype = self.compute_dtype if dtype is None else dtype
+
+        n = X.shape[0]
+        rows = n if memory_budget is None else self._block_rows(X2.shape[0], memory_budget, dtype)
+        for start in range(0, n, rows):
+            stop = min(start + rows, n)
+            yield start, stop, self.K(X[start:stop], X2, dtype=dtype)
+
+    def K_tiled(self, X, X2=None, memory_budget=None, out=None, dtype=None):
+        """
+        Compute covariance matrix in row blocks, writing into a preallocated output buffer.
+
+        Note: tiles may be computed in float32 (dtype) and accumulated into the float64 buffer (out).
+
+        :param X: torch.Tensor, first set of input points
+        :param X2: torch.Tensor, second set of input points
+        :param memory_budget: int, bytes per tile (default: self.memory_budget, None for a single block)
+        :param out: torch.Tensor, (optional) preallocated buffer of size (|X|, |X2|)
+        :param dtype: torch.dtype, precision of calculations (default: self.compute_dtype)
+        :return: torch.Tensor, covariance matrix between X and X2
+        """
+        if X2 is None:
+            X2 = X
+        memory_budget = self.memory_budget if memory_budget is None else memory_budget
+        dtype = self.compute_dtype if dtype is None else dtype
+
+        # Without tiling or an output buffer, compute the covariance matrix directly
+        if memory_budget is None and out is None and dtype == torch.float64:
+            return self.K(X, X2)
+
+        if out is None:
+            out = torch.empty(X.shape[0], X2.shape[0], dtype=torch.float64, device=X.device)
+        for start, stop, block in self.K_blocks(X, X2, memory_budget=memory_budget, dtype=dtype):
+            out[start:stop].copy_(block)
+        return out
 
 class Isotropic(Kernel):
     def __init__(self, cov, **params):
@@ -102,17 +185,35 @@ class Isotropic(Kernel):
         self.cov = cov
         self.params = params
 
-    def K(self, X, X2=None):
+    def K(self, X, X2=None, dtype=torch.float64):
         """
         Compute covariance matrix using isotropic kernel.
 
         :param X: torch.Tensor, first set of input points
         :param X2: torch.Tensor, second set of input points
+        :param dtype: torch.dtype, precision of calculations
         :return: torch.Tensor, covariance matrix for X
         """
-        r = self.euclid_dist(X, X2)
+        # Overwrite the squared distances with covariances where possible, avoiding further temporaries
+        fused = kernels.FUSED.get(self.cov)
+        if fused is not None:
+            sq_dist = self.square_dist(X, X2, dtype=dtype)
+            if _fusable(sq_dist, self.params):
+                return fused(sq_dist, **self.params)
+            return self.cov(sq_dist.sqrt_(), **self.params)
+        r = self.euclid_dist(X, X2, dtype=dtype)
         return self.cov(r, **self.params)
 
+    def K_diag(self, X, dtype=torch.float64):
+        """
+        Compute diagonal of covariance matrix (prior variances) using isotropic kernel.
+
+        :param X: torch.Tensor, input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, size (|X|), variances at X
+        """
+        return self.cov(torch.zeros(X.shape[0], dtype=dtype, device=X.device), **self.params)
+
     def K2(self, X, X2=None):
         return self.euclid_dist(X, X2)
 
@@ -130,52 +231,218 @@ class Nonstationary(Kernel):
         self.x0 = x0
         self.params = params
 
-    def K(self, X, X2=None):
+    def K(self, X, X2=None, chunk_size=None, dtype=torch.float64):
         """
         Compute covariance matrix using nonstationary kernel.
 
+        Note: each Sigma_i = exp(d_i) I is isotropic, where d_i is the distance of point i from x0, so the average
+        (Sigma_i + Sigma_j) / 2 = s_ij I with s_ij = (exp(d_i) + exp(d_j)) / 2. Hence Q_ij = |x_i - x_j|^2 / s_ij, and
+        the determinant prefactor |Sigma_i|^(1/4) |Sigma_j|^(1/4) |(Sigma_i + Sigma_j) / 2|^(-1/2) reduces to
+        sqrt(exp(d_i) exp(d_j)) / s_ij, so no per-pair matrices are needed.
+
         :param X: torch.Tensor, first set of input points
         :param X2: torch.Tensor, second set of input points
+        :param chunk_size: int, (optional) number of rows of the covariance matrix computed at a time
+        :param dtype: torch.dtype, precision of calculations
         :return: torch.Tensor, covariance matrix for X
         """
-        # Compute displacement matrix, and distances from x0
         if X2 is None:
-            X2 = X.clone()
-        disp = self.disp_mx(X, X2).float()
-        x0_dist1 = torch.sqrt((X[:, 0] - self.x0[0]) ** 2 + (X[:, 1] - self.x0[1]) ** 2).cpu().numpy()
-        x0_dist2 = torch.sqrt((X2[:, 0] - self.x0[0]) ** 2 + (X2[:, 1] - self.x0[1]) ** 2).cpu().numpy()
+            X2 = X
+        X = X.to(dtype=dtype)
+        X2 = X2.to(dtype=dtype, device=X.device)
+
+        # Scale exp(d_i) of each Sigma_i, from distances to x0
+        x0 = torch.tensor(self.x0, dtype=dtype, device=X.device)
+        e1 = torch.exp(torch.norm(X - x0, dim=1)).reshape(-1, 1)
+        e2 = torch.exp(torch.norm(X2 - x0, dim=1)).reshape(1, -1)
 
-        # Compute number of spatial points in each input set
+        # Compute covariance matrix in blocks of rows, to limit the size of intermediate arrays
         n1 = X.shape[0]
-        n2 = X2.shape[0]
-
-        # Compute Sigma_i matrix, shape (2, 2), for each spatial point
-        s11 = s22 = np.exp(x0_dist1)
-        s21 = s12 = np.zeros(n1)
-        s11_2 = s22_2 = np.exp(x0_dist2)
-        s21_2 = s12_2 = np.zeros(n2)
-
-        # Arrange Sigma_i matrices into arrays, shapes (n1, 2, 2) and (n2, 2, 2)
-        Sigma_all = torch.permute(torch.Tensor([[s11, s12], [s21, s22]]), dims=(2, 0, 1)).to(disp.device)
-        Sigma2_all = torch.permute(torch.Tensor([[s11_2, s12_2], [s21_2, s22_2]]), dims=(2, 0, 1)).to(disp.device)
-
-        # Restrict values to be non-negative, to handle numerical error
-        Sigma_all = torch.clamp(Sigma_all, min=0)
-        Sigma2_all = torch.clamp(Sigma2_all, min=0)
-
-        # Compute arrays needed for each pairwise covariance calculations, shape (n1, n2, 2, 2)
-        Sigma_i = torch.tile(torch.unsqueeze(Sigma_all, dim=1), dims=(1, n2, 1, 1))
-        Sigma_j = torch.tile(torch.unsqueeze(Sigma2_all, dim=0), dims=(n1, 1, 1, 1))
-        Sigma_i_plus_j_on_2 = torch.clamp((Sigma_i + Sigma_j) / 2, min=0)
-
-        # The below is an efficient way of constructing Q in (6)
-        disp_T = torch.permute(disp, dims=(0, 1, 3, 2))  # transpose last two dimensions
-        if disp.shape[1] != Sigma_i_plus_j_on_2.shape[1] or disp.shape[0] != Sigma_i_plus_j_on_2.shape[0]:
-            print(disp.shape)
-            print(Sigma_i_plus_j_on_2.shape)
-        Q = torch.squeeze(disp_T @ la.inv(Sigma_i_plus_j_on_2) @ disp)
-
-        # Compute covariance matrix for X
-        logdet = 0.25 * torch.logdet(Sigma_i) + 0.25 * torch.logdet(Sigma_j) - 0.5 * torch.logdet(Sigma_i_plus_j_on_2)
-        return torch.exp(logdet) * self.cov(torch.sqrt(Q), **self.params)
+        if chunk_size is None:
+            chunk_size = n1
+        cov = torch.empty(n1, X2.shape[0], dtype=dtype, device=X.device)
+        for start in range(0, n1, chunk_size):
+            stop = min(start + chunk_size, n1)
+            s = 0.5 * (e1[start:stop] + e2)
+            Q = self.square_dist(X[start:stop], X2, dtype=dtype).div_(s)
+            fused = kernels.FUSED.get(self.cov)
+            if fused is not None and _fusable(Q, self.params):
+                k = fused(Q, **self.params)
+            else:
+                k = self.cov(torch.sqrt(Q), **self.params)
+            cov[start:stop] = torch.sqrt(e1[start:stop] * e2).div_(s) * k
+        return cov
+
+    def K_diag(self, X, dtype=torch.float64):
+        """
+        Compute diagonal of covariance matrix (prior variances) using nonstationary kernel.
+
+        Note: the determinant prefactor equals one when x_i = x_j, so the variance is the isotropic one at distance zero.
+
+        :param X: torch.Tensor, input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, size (|X|), variances at X
+        """
+        return self.cov(torch.zeros(X.shape[0], dtype=dtype, device=X.device), **self.params)
+
+class Anisotropic(Kernel):
+    def __init__(self, cov, **params):
+        """
+        Stationary kernel with a separate lengthscale for each input dimension (automatic relevance determination).
+
+        :param cov: isotropic kernel function, applied to distances between inputs scaled by their lengthscales
+        :param params: dict, key-value pairs with values for ampl, leng (one value per input dimension), [power, alpha]
+        """
+        super().__init__(params['ampl'], params['leng'])
+        self.cov = cov
+        self.params = params
+
+    def _scaled(self, X, dtype):
+        """
+        Divide each input dimension by its lengthscale.
+
+        :param X: torch.Tensor, input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, scaled input points
+        """
+        leng = torch.as_tensor(self.params['leng'], dtype=dtype, device=X.device).reshape(1, -1)
+        return X.to(dtype=dtype) / leng
+
+    def _unit_params(self):
+        """
+        Kernel function parameters with unit lengthscale (lengthscales are absorbed into the scaled inputs).
+        """
+        return dict(self.params, leng=1.)
+
+    def K(self, X, X2=None, dtype=torch.float64):
+        """
+        Compute covariance matrix using anisotropic kernel.
+
+        :param X: torch.Tensor, first set of input points
+        :param X2: torch.Tensor, second set of input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, covariance matrix for X
+        """
+        X2 = X if X2 is None else X2
+        sq_dist = self.square_dist(self._scaled(X, dtype), self._scaled(X2, dtype), dtype=dtype)
+        params = self._unit_params()
+        fused = kernels.FUSED.get(self.cov)
+        if fused is not None and _fusable(sq_dist, params):
+            return fused(sq_dist, **params)
+        return self.cov(sq_dist.sqrt_(), **params)
+
+    def K_diag(self, X, dtype=torch.float64):
+        """
+        Compute diagonal of covariance matrix (prior variances) using anisotropic kernel.
+
+        :param X: torch.Tensor, input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, size (|X|), variances at X
+        """
+        return self.cov(torch.zeros(X.shape[0], dtype=dtype, device=X.device), **self._unit_params())
+
+class Composite(Kernel):
+    """
+    Parent class for kernels combining component kernels, which hold the hyperparameters.
+    """
+
+    @property
+    def params(self):
+        """
+        Hyperparameters of the component kernels, named with the component index as prefix (e.g. `k0_leng`).
+
+        :return: dict, key-value pairs of component hyperparameters
+        """
+        return {'k{}_{}'.format(i, name): v for i, kern in enumerate(self.kerns) for name, v in kern.params.items()}
+
+    @params.setter
+    def params(self, params):
+        """
+        Update hyperparameters of the component kernels, given with the component index as prefix (e.g. `k0_leng`).
+
+        :param params: dict, key-value pairs of component hyperparameters
+        """
+        updates = [{} for _ in self.kerns]
+        for key, v in params.items():
+            prefix, _, name = key.partition('_')
+            if not (prefix[:1] == 'k' and prefix[1:].isdigit() and int(prefix[1:]) < len(self.kerns) and name):
+                raise ValueError('Hyperparameters of composite kernels are named by component, e.g. k0_leng')
+            updates[int(prefix[1:])][name] = v
+        for kern, update in zip(self.kerns, updates):
+            if update:
+                kern.params = dict(kern.params, **update)
+
+class Sum(Composite):
+    def __init__(self, *kerns):
+        """
+        Sum of kernels (hyperparameters are held by the component kernels).
+
+        :param kerns: instances of Kern child, component kernels
+        """
+        super().__init__(sum(float(k.params['ampl']) for k in kerns), float('nan'))
+        self.kerns = torch.nn.ModuleList(kerns)
 
+    def K(self, X, X2=None, dtype=torch.float64):
+        """
+        Compute covariance matrix as the sum of component covariance matrices (accumulated in place).
+
+        :param X: torch.Tensor, first set of input points
+        :param X2: torch.Tensor, second set of input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, covariance matrix for X
+        """
+        cov = self.kerns[0].K(X, X2, dtype=dtype)
+        for kern in self.kerns[1:]:
+            cov.add_(kern.K(X, X2, dtype=dtype))
+        return cov
+
+    def K_diag(self, X, dtype=torch.float64):
+        """
+        Compute diagonal of covariance matrix (prior variances) as the sum of component variances.
+
+        :param X: torch.Tensor, input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, size (|X|), variances at X
+        """
+        return sum(kern.K_diag(X, dtype=dtype) for kern in self.kerns)
+
+class Product(Composite):
+    def __init__(self, *kerns):
+        """
+        Product of kernels (hyperparameters are held by the component kernels).
+
+        :param kerns: instances of Kern child, component kernels
+        """
+        ampl = 1.
+        for k in kerns:
+            ampl *= float(k.params['ampl'])
+        super().__init__(ampl, float('nan'))
+        self.kerns = torch.nn.ModuleList(kerns)
+
+    def K(self, X, X2=None, dtype=torch.float64):
+        """
+        Compute covariance matrix as the elementwise product of component covariance matrices (accumulated in place).
+
+        :param X: torch.Tensor, first set of input points
+        :param X2: torch.Tensor, second set of input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, covariance matrix for X
+        """
+        cov = self.kerns[0].K(X, X2, dtype=dtype)
+        for kern in self.kerns[1:]:
+            factor = kern.K(X, X2, dtype=dtype)
+            cov = cov * factor if cov.requires_grad or factor.requires_grad else cov.mul_(factor)
+        return cov
+
+    def K_diag(self, X, dtype=torch.float64):
+        """
+        Compute diagonal of covariance matrix (prior variances) as the product of component variances.
+
+        :param X: torch.Tensor, input points
+        :param dtype: torch.dtype, precision of calculations
+        :return: torch.Tensor, size (|X|), variances at X
+        """
+        var = self.kerns[0].K_diag(X, dtype=dtype)
+        for kern in self.kerns[1:]:
+            var = var * kern.K_diag(X, dtype=dtype)
+        return var
@@ -0,0 +1,98 @@
+"""
+Circulant embedding GP sampler for stationary isotropic kernels on regular grids
+"""
+
+import torch
+from .kronecker import product_grid
+from .rng import standard_normal
+
+
+def regular_grid(X, rtol=1e-5):
+    """
+    Detect whether the rows of X form a regular (equally spaced) 1D or 2D grid.
+
+    :param X: torch.Tensor, size (n_inputs, input_dim), input points
+    :param rtol: float, relative tolerance when comparing grid spacings
+    :return: tuple (list, str) containing the sorted axis coordinates and the order, or None if X is not such a grid
+    """
+    if len(X.shape) == 1 or X.shape[1] == 1:
+        x = X.reshape(-1)
+        if x.shape[0] < 2 or not torch.all(x[1:] > x[:-1]):
+            return None
+        structure = [x], 'xy'
+    else:
+        structure = product_grid(X)
+        if structure is None:
+            return None
+
+    for x in structure[0]:
+        h = x[1:] - x[:-1]
+        if not torch.allclose(h, h.mean().expand_as(h), rtol=rtol, atol=0.):
+            return None
+    return structure
+
+def _circulant_eigenvalues(kern, axes, m_sizes):
+    """
+    Compute the eigenvalues of the covariance matrix on the periodic embedding grid.
+
+    :param kern: instance of Isotropic, stationary kernel
+    :param axes: list, 1D tensors of grid coordinates (outer axis first)
+    :param m_sizes: list, embedding grid size for each axis
+    :return: torch.Tensor, eigenvalues arranged on the embedding grid
+    """
+    lags_sq = 0.
+    for dd, (x, m) in enumerate(zip(axes, m_sizes)):
+        h = (x[-1] - x[0]) / (x.shape[0] - 1)
+        k = torch.arange(m, dtype=torch.float64, device=x.device)
+        lag = torch.minimum(k, m - k) * h  # wrap-around distances on the torus
+        shape = [1] * len(axes)
+        shape[dd] = m
+        lags_sq = lags_sq + (lag ** 2).reshape(shape)
+    c = kern.cov(torch.sqrt(lags_sq), **kern.params)  # first row of the block circulant matrix
+    return torch.fft.fftn(c).real
+
+def circulant_sample(kern, axes, n_samples, order='xy', max_doublings=3, tol=1e-10, generator=None):
+    """
+    Draw exact zero-mean GP samples on a regular grid in O(n log n) using circulant embedding.
+
+    The grid is embedded in a periodic grid of size 2(n_i - 1) per axis (doubled until the embedding is nonnegative
+    definite), and each complex FFT of scaled white noise gives two independent real samples.
+
+    :param kern: instance of Isotropic, stationary kernel
+    :param axes: list, 1D tensors of equally spaced grid coordinates for each input dimension
+    :param n_samples: int, number of sampled functions
+    :param order: str, `xy` (first coordinate changes fastest) or `ij` (second coordinate changes fastest)
+    :param max_doublings: int, number of times the embedding size may be doubled
+    :param tol: float, relative tolerance for negative eigenvalues (clipped to zero)
+    :param generator: torch.Generator, (optional) random number generator used instead of the global one
+    :return: torch.Tensor, size (n_inputs, n_samples) with samples in columns, or None if no valid embedding is found
+    """
+    axes = [x.to(dtype=torch.float64) for x in axes]
+    if order == 'xy':
+        axes = axes[::-1]  # outer (slowest changing) axis first
+    n_sizes = [x.shape[0] for x in axes]
+    m_sizes = [max(2 * (n - 1), 1) for n in n_sizes]
+
+    # Enlarge the embedding until all eigenvalues are (numerically) nonnegative
+    for _ in range(max_doublings + 1):
+        lam = _circulant_eigenvalues(kern, axes, m_sizes)
+        if lam.min() >= -tol * lam.max():
+            break
+        m_sizes = [2 * m for m in m_sizes]
+    else:
+        return None
+
+    # Scale complex white noise by sqrt(eigenvalues / m), then transform back to the grid
+    m_total = lam.numel()
+    scale = torch.sqrt(torch.clamp(lam, min=0.) / m_total)
+    n_complex = (n_samples + 1) // 2
+    shape = [n_complex] + m_sizes
+    Z = torch.complex(standard_normal(shape, device=lam.device, generator=generator),
+                      standard_normal(shape, device=lam.device, generator=generator))
+    F = torch.fft.fftn(scale * Z, dim=list(range(1, len(m_sizes) + 1)))
+
+    # Restrict to the original grid; real and imaginary parts are independent samples
+    index = [slice(None)] + [slice(0, n) for n in n_sizes]
+    F = F[tuple(index)].reshape(n_complex, -1)
+    samples = torch.cat([F.real, F.imag], dim=0)[:n_samples]
+    return samples.T
@@ -0,0 +1,89 @@
+"""
+Random Fourier feature approximation of stationary GP priors
+"""
+
+import math
+import torch
+import torch.distributions as dist
+from . import kernels
+from .rng import standard_normal
+
+
+def spectral_frequencies(kern, n_features, input_dim, dtype=torch.float64, device='cpu', generator=None):
+    """
+    Draw frequencies from the spectral density of an isotropic kernel (Bochner's theorem).
+
+    Note: for the squared exponential kernel the spectral density is N(0, I/leng^2), and for the Matern 3/2 kernel it
+    is a multivariate Student-t with 3 degrees of freedom and scale matrix I/leng^2.
+
+    :param kern: instance of Isotropic, stationary kernel with RBF (power = 2) or Matern32 covariance function
+    :param n_features: int, number of frequencies
+    :param input_dim: int, number of input dimensions
+    :param dtype: torch.dtype, data type of frequencies
+    :param device: str or torch.device, device of frequencies
+    :param generator: torch.Generator, (optional) random number generator used instead of the global one
+    :return: torch.Tensor, size (n_features, input_dim), sampled frequencies
+    """
+    leng = float(kern.params['leng'])
+    Z = standard_normal((n_features, input_dim), dtype=dtype, device=device, generator=generator)
+    if kern.cov is kernels.RBF:
+        if kern.params.get('power', 2) != 2:
+            raise NotImplementedError('Random Fourier features require power = 2 for the power exponential kernel.')
+        return Z / leng
+    elif kern.cov is kernels.Matern32:
+        nu = 1.5
+        if generator is None:
+            chi2 = dist.Gamma(torch.tensor(nu, dtype=dtype), torch.tensor(0.5, dtype=dtype)).sample((n_features, 1))
+        else:  # torch.distributions does not take a generator; chi-squared with 3 dof is a sum of 3 squared normals
+            chi2 = (standard_normal((n_features, 3), dtype=dtype, generator=generator) ** 2).sum(1, keepdim=True)
+        return Z / leng * torch.sqrt(2 * nu / chi2.to(device))
+    else:
+        raise NotImplementedError('Random Fourier features are only implemented for the RBF and Matern32 kernels.')
+
+def rff_features(kern, X, n_features=1024, omega=None, generator=None):
+    """
+    Compute the random Fourier feature map, with Phi @ Phi.T approximating the covariance matrix for X.
+
+    :param kern: instance of Isotropic, stationary kernel with RBF (power = 2) or Matern32 covariance function
+    :param X: torch.Tensor, size (n_inputs, input_dim), input points
+    :param n_features: int, number of frequencies (the feature map has 2 * n_features columns)
+    :param omega: torch.Tensor, size (n_features, input_dim), (optional) frequencies to reuse
+    :param generator: torch.Generator, (optional) random number generator used instead of the global one
+    :return: torch.Tensor, size (n_inputs, 2 * n_features), feature map
+    """
+    if omega is None:
+        omega = spectral_frequencies(kern, n_features, X.shape[1], dtype=X.dtype, device=X.device,
+                                     generator=generator)
+    proj = X @ omega.T  # size (n_inputs, n_features)
+    scale = math.sqrt(float(kern.params['ampl']) / omega.shape[0])
+    return scale * torch.cat([torch.cos(proj), torch.sin(proj)], dim=1)
+
+def sample_functions_rff(kern, X, n_samples, n_features=1024, generator=None):
+    """
+    Produce approximate samples from the zero-mean GP prior, at cost O(n_inputs * n_features * n_samples).
+
+    :param kern: instance of Isotropic, stationary kernel with RBF (power = 2) or Matern32 covariance function
+    :param X: torch.Tensor, size (n_inputs, input_dim), inputs at which to generate samples
+    :param n_samples: int, number of sampled functions
+    :param n_features: int, number of frequencies
+    :param generator: torch.Generator, (optional) random number generator used instead of the global one
+    :return: torch.Tensor, size (n_inputs, n_samples), with samples in columns
+    """
+    Phi = rff_features(kern, X, n_features, generator=generator)
+    V = standard_normal((Phi.shape[1], n_samples), dtype=Phi.dtype, device=Phi.device, generator=generator)
+    return Phi @ V
+
+def rff_error(kern, X, n_features=1024):
+    """
+    Compare the random Fourier feature covariance with the exact covariance matrix for X.
+
+    :param kern: instance of Isotropic, stationary kernel with RBF (power = 2) or Matern32 covariance function
+    :param X: torch.Tensor, size (n_inputs, input_dim), input points (keep moderate, exact matrix is formed)
+    :param n_features: int, number of frequencies
+    :return: tuple, maximum absolute error, relative Frobenius error
+    """
+    X = X.to(dtype=torch.float64)
+    K = kern.K(X)
+    Phi = rff_features(kern, X, n_features)
+    diff = Phi @ Phi.T - K
+    return diff.abs().max().item(), (torch.norm(diff) / torch.norm(K)).item()
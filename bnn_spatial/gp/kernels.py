@@ -1,5 +1,5 @@
 """
-Gaussian process kernel functions
+Gaussian process kernel functions, with fused evaluators working in place on squared distance tiles
 """
 
 import torch
@@ -22,7 +22,7 @@ def RBF(dist, ampl, leng, power=2):
 
     # Adjust lengthscale for squared exponential case
     if power == 2:
-        leng *= np.sqrt(2)
+        leng = leng * np.sqrt(2)  # not in-place, leng may be a caller's (autograd) tensor
 
     return ampl * torch.exp(-1 * (dist / leng) ** power)
 
@@ -35,3 +35,111 @@ def Matern32(dist, ampl, leng):
     """
     return ampl * (1. + np.sqrt(3.) * dist / leng) * torch.exp(-np.sqrt(3.) * dist / leng)
 
+def Matern12(dist, ampl, leng):
+    """
+    Matern 1/2 kernel, aka exponential kernel.
+
+    :param ampl: float, amplitude parameter
+    :param leng: float, lengthscale parameter
+    """
+    return ampl * torch.exp(-dist / leng)
+
+def Matern52(dist, ampl, leng):
+    """
+    Matern 5/2 kernel.
+
+    :param ampl: float, amplitude parameter
+    :param leng: float, lengthscale parameter
+    """
+    s = np.sqrt(5.) * dist / leng
+    return ampl * (1. + s + s ** 2 / 3.) * torch.exp(-s)
+
+def RationalQuadratic(dist, ampl, leng, alpha=1.):
+    """
+    Rational quadratic kernel (scale mixture of squared exponential kernels).
+
+    :param ampl: float, amplitude parameter
+    :param leng: float, lengthscale parameter
+    :param alpha: float, shape parameter (tends to the squared exponential kernel as alpha grows)
+    """
+    return ampl * (1. + dist ** 2 / (2 * alpha * leng ** 2)) ** (-alpha)
+
+# Fused evaluators: each takes a squared distance tile and overwrites it with the covariance, so no separate distance
+# matrix (or chain of temporaries) is stored. They must not be used when autograd needs the intermediate values.
+
+def fused_RBF(sq_dist, ampl, leng, power=2):
+    """
+    Power exponential kernel, evaluated in place on squared distances.
+
+    :param sq_dist: torch.Tensor, squared distances (overwritten)
+    :return: torch.Tensor, covariances (same storage as sq_dist)
+    """
+    if power <= 0 or power > 2:
+        raise Exception('Require values 0 < power <= 2 for power exponential kernel.')
+    if power == 2:
+        return sq_dist.mul_(-1. / (2 * leng ** 2)).exp_().mul_(ampl)
+    return sq_dist.pow_(power / 2).mul_(-1. / leng ** power).exp_().mul_(ampl)
+
+def fused_Matern12(sq_dist, ampl, leng):
+    """
+    Matern 1/2 kernel, evaluated in place on squared distances.
+
+    :param sq_dist: torch.Tensor, squared distances (overwritten)
+    :return: torch.Tensor, covariances (same storage as sq_dist)
+    """
+    return sq_dist.sqrt_().mul_(-1. / leng).exp_().mul_(ampl)
+
+def fused_Matern32(sq_dist, ampl, leng):
+    """
+    Matern 3/2 kernel, evaluated in place on squared distances.
+
+    :param sq_dist: torch.Tensor, squared distances (overwritten)
+    :return: torch.Tensor, covariances (same storage as sq_dist)
+    """
+    s = sq_dist.sqrt_().mul_(np.sqrt(3.) / leng)
+    e = torch.neg(s).exp_()  # one temporary tile
+    return s.add_(1.).mul_(e).mul_(ampl)
+
+def fused_Matern52(sq_dist, ampl, leng):
+    """
+    Matern 5/2 kernel, evaluated in place on squared distances.
+
+    :param sq_dist: torch.Tensor, squared distances (overwritten)
+    :return: torch.Tensor, covariances (same storage as sq_dist)
+    """
+    s = sq_dist.sqrt_().mul_(np.sqrt(5.) / leng)
+    e = torch.neg(s).exp_()  # two temporary tiles
+    return s.mul_(s.div(3.).add_(1.)).add_(1.).mul_(e).mul_(ampl)  # (1 + s + s^2 / 3) exp(-s)
+
+def fused_RationalQuadratic(sq_dist, ampl, leng, alpha=1.):
+    """
+    Rational quadratic kernel, evaluated in place on squared distances.
+
+    :param sq_dist: torch.Tensor, squared distances (overwritten)
+    :return: torch.Tensor, covariances (same storage as sq_dist)
+    """
+    return sq_dist.div_(2 * alpha * leng ** 2).add_(1.).pow_(-alpha).mul_(ampl)
+
+# Registry of kernel functions by name, and their fused evaluators
+KERNELS = {'rbf': RBF,
+           'matern12': Matern12,
+           'matern32': Matern32,
+           'matern52': Matern52,
+           'rq': RationalQuadratic}
+FUSED = {RBF: fused_RBF,
+         Matern12: fused_Matern12,
+         Matern32: fused_Matern32,
+         Matern52: fused_Matern52,
+         RationalQuadratic: fused_RationalQuadratic}
+
+def get_kernel(name):
+    """
+    Look up a kernel function by name.
+
+    :param name: str, one of the keys of KERNELS (case insensitive)
+    :return: kernel function
+    """
+    try:
+        return KERNELS[name.lower()]
+    except KeyError:
+        raise ValueError('Unknown kernel {}, choose from {}'.format(name, ', '.join(KERNELS)))
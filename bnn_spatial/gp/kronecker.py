@@ -0,0 +1,111 @@
+"""
+Kronecker-structured GP algebra for separable kernels on regular (Cartesian product) grids
+"""
+
+import torch
+from . import base
+from . import kernels
+from .rng import standard_normal
+
+
+def product_grid(X):
+    """
+    Detect whether the rows of X form a 2D Cartesian product grid.
+
+    Note: order `xy` means the first coordinate changes fastest (as in GridGenerator and np.meshgrid with default
+    Cartesian indexing), and order `ij` means the second coordinate changes fastest.
+
+    :param X: torch.Tensor, size (n_inputs, 2), input points
+    :return: tuple (list, str) containing the sorted axis coordinates and the order, or None if X is not a grid
+    """
+    if len(X.shape) != 2 or X.shape[1] != 2:
+        return None
+    x1 = torch.unique(X[:, 0], sorted=True)
+    x2 = torch.unique(X[:, 1], sorted=True)
+    n1, n2 = x1.shape[0], x2.shape[0]
+    if n1 * n2 != X.shape[0] or n1 == 1 or n2 == 1:
+        return None
+
+    if torch.equal(X[:, 0], x1.repeat(n2)) and torch.equal(X[:, 1], x2.repeat_interleave(n1)):
+        return [x1, x2], 'xy'
+    if torch.equal(X[:, 0], x1.repeat_interleave(n2)) and torch.equal(X[:, 1], x2.repeat(n1)):
+        return [x1, x2], 'ij'
+    return None
+
+def is_separable(kern):
+    """
+    Check whether the kernel factorises over input dimensions (only the squared exponential kernel qualifies).
+
+    :param kern: instance of Kern child, covariance function or kernel
+    :return: bool, whether kernel is separable
+    """
+    return isinstance(kern, base.Isotropic) and kern.cov is kernels.RBF and kern.params.get('power', 2) == 2
+
+def kron_factors(kern, axes):
+    """
+    Compute the per-axis covariance matrices, with K = K_2 kron K_1 (order `xy`) or K_1 kron K_2 (order `ij`).
+
+    :param kern: instance of Isotropic, separable kernel
+    :param axes: list, contains 1D tensors of grid coordinates for each input dimension
+    :return: list, per-axis covariance matrices (the amplitude is absorbed into the first factor)
+    """
+    ampl = float(kern.params['ampl'])
+    factors = [kern.K(x.reshape(-1, 1)) for x in axes]
+    factors[1:] = [K / ampl for K in factors[1:]]
+    return factors
+
+def _outer_inner(factors, order):
+    """
+    Arrange factors as (outer, inner), where the inner (fastest changing) index belongs to the last mode.
+    """
+    return (factors[1], factors[0]) if order == 'xy' else (factors[0], factors[1])
+
+def kron_sample(L_factors, n_samples, order='xy', generator=None):
+    """
+    Draw zero-mean samples with covariance given by the Kronecker product of L_i @ L_i.T.
+
+    :param L_factors: list, lower Cholesky factors of the per-axis covariance matrices
+    :param n_samples: int, number of sampled functions
+    :param order: str, `xy` or `ij`, ordering of grid points
+    :param generator: torch.Generator, (optional) random number generator used instead of the global one
+    :return: torch.Tensor, size (n1 * n2, n_samples), with samples in columns
+    """
+    L_out, L_in = _outer_inner(L_factors, order)
+    Z = standard_normal((n_samples, L_out.shape[0], L_in.shape[0]), dtype=L_out.dtype, device=L_out.device,
+                        generator=generator)
+    F = L_out @ Z @ L_in.T  # (L_out kron L_in) vec(Z), computed mode by mode
+    return F.reshape(n_samples, -1).T
+
+def kron_eigh(factors, order='xy'):
+    """
+    Eigendecompose the per-axis covariance matrices, arranged as (outer, inner) factors.
+
+    :param factors: list, per-axis covariance matrices
+    :param order: str, `xy` or `ij`, ordering of grid points
+    :return: tuple, eigenvalues and eigenvectors of the outer factor, then of the inner factor
+    """
+    K_out, K_in = _outer_inner(factors, order)
+    e_out, Q_out = torch.linalg.eigh(K_out)
+    e_in, Q_in = torch.linalg.eigh(K_in)
+    return e_out, Q_out, e_in, Q_in
+
+def kron_solve(factors, B, sn2, order='xy', eig=None):
+    """
+    Solve (K + sn2 * I) A = B, where K is the Kronecker product of the given factors, using eigendecompositions.
+
+    :param factors: list, per-axis covariance matrices
+    :param B: torch.Tensor, size (n1 * n2, n_cols), right hand side
+    :param sn2: float, measurement error variance (must be positive for a stable solve)
+    :param order: str, `xy` or `ij`, ordering of grid points
+    :param eig: tuple, (optional) precomputed output of kron_eigh, to reuse across solves
+    :return: torch.Tensor, size (n1 * n2, n_cols), solution
+    """
+    e_out, Q_out, e_in, Q_in = kron_eigh(factors, order) if eig is None else eig
+    n_out, n_in = Q_out.shape[0], Q_in.shape[0]
+
+    # Rotate into the joint eigenbasis, scale by inverse eigenvalues, and rotate back
+    Bm = B.T.reshape(-1, n_out, n_in).to(dtype=Q_out.dtype)
+    Bm = Q_out.T @ Bm @ Q_in
+    Bm = Bm / (e_out.reshape(-1, 1) * e_in.reshape(1, -1) + sn2)
+    Bm = Q_out @ Bm @ Q_in.T
+    return Bm.reshape(B.shape[1], -1).T
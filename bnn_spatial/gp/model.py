@@ -5,66 +5,376 @@ Gaussian process prior and posterior
 import torch
 import numpy as np
 from . import base
-from copy import deepcopy
+from . import fourier
+from . import kronecker
+from . import circulant
+from .rng import standard_normal
 from torch.distributions.multivariate_normal import MultivariateNormal
 
 
+def params_key(params):
+    """
+    Hashable summary of kernel hyperparameters (floats or tensors of any size), for use in cache keys.
+
+    :param params: dict, kernel hyperparameters
+    :return: tuple, sorted (name, tuple of values) pairs
+    """
+    return tuple(sorted((k, tuple(torch.as_tensor(v).detach().flatten().tolist())) for k, v in params.items()))
+
+def solve_lower(L, B):
+    """
+    Solve L A = B for lower triangular L (compatible with older PyTorch versions).
+
+    :param L: torch.Tensor, lower triangular matrix
+    :param B: torch.Tensor, right hand side
+    :return: torch.Tensor, solution A
+    """
+    if hasattr(torch.linalg, 'solve_triangular'):
+        return torch.linalg.solve_triangular(L, B, upper=False)
+    return torch.triangular_solve(B, L, upper=False).solution
+
+def solve_upper(U, B):
+    """
+    Solve U A = B for upper triangular U (compatible with older PyTorch versions).
+
+    :param U: torch.Tensor, upper triangular matrix
+    :param B: torch.Tensor, right hand side
+    :return: torch.Tensor, solution A
+    """
+    if hasattr(torch.linalg, 'solve_triangular'):
+        return torch.linalg.solve_triangular(U, B, upper=True)
+    return torch.triangular_solve(B, U, upper=True).solution
+
+class Posterior(object):
+    def __init__(self, kern, X, Y, sn2, L=None, kron=None, compute_dtype=None):
+        """
+        Fitted GP posterior, caching the factorisation of the training covariance matrix and the weights alpha.
+
+        Note: alpha = (K_tt + sn2 * I)^{-1} Y is computed once, so each prediction only needs cross-covariances.
+
+        :param kern: instance of Kern child, covariance function or kernel
+        :param X: torch.Tensor, training inputs
+        :param Y: torch.Tensor, training targets
+        :param sn2: float, measurement error variance
+        :param L: torch.Tensor, lower Cholesky factor of K_tt + sn2 * I (dense case)
+        :param kron: tuple, per-axis covariance matrices and grid order (Kronecker case, product grid of inputs)
+        :param compute_dtype: torch.dtype, (optional) precision of cross-covariance tiles (default: kernel setting)
+        """
+        self.kern = kern
+        self.X = X
+        self.sn2 = sn2
+        self.L = L
+        self.kron = kron
+        self.compute_dtype = compute_dtype
+        self.eig = None
+        if kron is not None:
+            self.eig = kronecker.kron_eigh(*kron)
+        self.alpha = self.solve(Y.to(dtype=torch.float64)).to(dtype=torch.float64)
+
+    def solve(self, B):
+        """
+        Solve (K_tt + sn2 * I) A = B using the cached factorisation.
+
+        :param B: torch.Tensor, size (n_train, n_cols), right hand side
+        :return: torch.Tensor, size (n_train, n_cols), solution
+        """
+        if self.kron is not None:
+            factors, order = self.kron
+            return kronecker.kron_solve(factors, B, self.sn2, order=order, eig=self.eig)
+        return torch.cholesky_solve(B.to(dtype=self.L.dtype), self.L)
+
+    def _reduction(self, K_ts, full_cov=True):
+        """
+        Compute K_st (K_tt + sn2 * I)^{-1} K_ts, the reduction in covariance after conditioning on data.
+
+        :param K_ts: torch.Tensor, size (n_train, n_test), cross-covariance matrix
+        :param full_cov: bool, specify if the full matrix (True) or only its diagonal (False) is computed
+        :return: torch.Tensor, size (n_test, n_test) or (n_test), covariance reduction
+        """
+        if self.kron is not None:
+            A = self.solve(K_ts)
+            return K_ts.T @ A if full_cov else (K_ts * A).sum(0)
+        V = solve_lower(self.L, K_ts.to(dtype=self.L.dtype))
+        return V.T @ V if full_cov else (V ** 2).sum(0)
+
+    def mean(self, Xnew):
+        """
+        Compute predictive mean at the specified inputs.
+
+        :param Xnew: torch.Tensor, test inputs
+        :return: torch.Tensor, size (n_test, 1), predictive mean
+        """
+        return self.kern.K_tiled(Xnew, self.X, dtype=self.compute_dtype) @ self.alpha
+
+    def predict(self, Xnew, full_cov=True, noisy_targets=False, chunk_size=None):
+        """
+        Compute predictive mean and covariance matrix (or marginal variances) at the specified inputs.
+
+        :param Xnew: torch.Tensor, test inputs
+        :param full_cov: bool, specify if the full covariance matrix (True) or marginal variances (False) are returned
+        :param noisy_targets: bool, specify if predictive covariances are computed for noisy targets
+        :param chunk_size: int, (optional) number of test points processed at a time when full_cov is False
+        :return: tuple, predictive mean (n_test, 1), predictive covariance (n_test, n_test) or variances (n_test, 1)
+        """
+        if not full_cov:
+            return self._predict_diag(Xnew, noisy_targets=noisy_targets, chunk_size=chunk_size)
+
+        K_st = self.kern.K_tiled(Xnew, self.X, dtype=self.compute_dtype)
+        fmean = K_st @ self.alpha
+        fvar = self.kern.K_tiled(Xnew, dtype=self.compute_dtype) - self._reduction(K_st.T, full_cov=True)
+        if noisy_targets:
+            fvar += torch.eye(Xnew.shape[0], dtype=fvar.dtype, device=fvar.device) * self.sn2
+        return fmean, fvar
+
+    def _predict_diag(self, Xnew, noisy_targets=False, chunk_size=None):
+        """
+        Compute predictive mean and marginal variances, never forming an (n_test, n_test) matrix.
+
+        Note: the variance at each test point is k(x, x) minus the column-wise sum of squares of V = L^{-1} K_ts, so
+        memory is O(n_train * chunk_size) rather than O(n_test^2).
+
+        :param Xnew: torch.Tensor, test inputs
+        :param noisy_targets: bool, specify if predictive variances are computed for noisy targets
+        :param chunk_size: int, (optional) number of test points processed at a time (default: all at once)
+        :return: tuple, predictive mean (n_test, 1), predictive variances (n_test, 1)
+        """
+        n_test = Xnew.shape[0]
+        if chunk_size is None:
+            chunk_size = n_test
+        fmean = torch.empty(n_test, 1, dtype=torch.float64, device=Xnew.device)
+        fvar = torch.empty(n_test, 1, dtype=torch.float64, device=Xnew.device)
+        for start in range(0, n_test, chunk_size):
+            stop = min(start + chunk_size, n_test)
+            K_st = self.kern.K_tiled(Xnew[start:stop], self.X, dtype=self.compute_dtype)
+            fmean[start:stop] = K_st @ self.alpha
+            var = self.kern.K_diag(Xnew[start:stop]) - self._reduction(K_st.T, full_cov=False)
+            fvar[start:stop] = var.reshape(-1, 1)
+        if noisy_targets:
+            fvar += self.sn2
+        return fmean, fvar
+
+    def predict_batched(self, Xnew_batches, full_cov=False, noisy_targets=False, chunk_size=None):
+        """
+        Compute predictions for several batches of test inputs, reusing the cached factorisation.
+
+        :param Xnew_batches: iterable, contains torch.Tensor batches of test inputs
+        :param full_cov: bool, specify if the full covariance matrix (True) or marginal variances (False) are returned
+        :param noisy_targets: bool, specify if predictive covariances are computed for noisy targets
+        :param chunk_size: int, (optional) number of test points processed at a time when full_cov is False
+        :return: list, contains (predictive mean, predictive covariance or variances) for each batch
+        """
+        return [self.predict(Xnew, full_cov=full_cov, noisy_targets=noisy_targets, chunk_size=chunk_size)
+                for Xnew in Xnew_batches]
+
+
 class GP(torch.nn.Module):
-    def __init__(self, kern, jitter=1e-8):
+    def __init__(self, kern, jitter=1e-8, method='cholesky', n_features=1024, precision='double', mixed_tol=1e-4,
+                 mixed_jitter=1e-6):
         """
         Implementation of GP prior, and posterior after incorporating data.
 
         :param kern: instance of Kern child, covariance function or kernel
         :param jitter: float, jitter added to prevent non-PD error in Cholesky decompositions
+        :param method: str, backend for prior samples, `cholesky` (exact), `rff` (random Fourier features), or
+            `kronecker` (exact, for separable kernels on product grids), or `circulant` (exact, for isotropic kernels on
+            regular grids); the last two fall back to `cholesky` when their structure is not present
+        :param n_features: int, number of random Fourier features (for method `rff`)
+        :param precision: str, `double` (float64 throughout) or `mixed` (float32 kernel matrices and Cholesky factors
+            for sample_functions and predict_f, falling back to float64 when the float32 factor is inaccurate)
+        :param mixed_tol: float, maximum relative residual |L L^T Z - K Z| / |K Z| accepted for float32 factors
+        :param mixed_jitter: float, jitter added to float32 matrices (float32 needs more than float64)
         """
         super(GP, self).__init__()
         self.mean_function = base.Zero()  # always use zero mean
         self.kern = kern
         self.jitter = jitter
+        self.method = method
+        self.n_features = n_features
+        self.precision = precision
+        self.mixed_tol = mixed_tol
+        self.mixed_jitter = mixed_jitter
+        self.precision_stats = {'n_float32': 0, 'n_fallback': 0, 'last_residual': None}
         self.X, self.Y, self.sn2 = None, None, None  # to be initialised with assign_data
         self.data_assigned = False  # status of whether data assigned
+        self._posterior = None  # fitted posterior, cached until the data or kernel change
+        self._jitter_cache = {}  # successful jitter multipliers, see cholesky_factor
+        self.jitter_stats = {'last_jitter': None, 'max_jitter': 0., 'n_factorisations': 0, 'n_failed': 0}
 
     def round_vals(self, X, decimals=0):
         b = 10 ** decimals
         return torch.round(X * b) / b
 
-    def cholesky_factor(self, matrix, jitter_level):
+    def cholesky_factor(self, matrix, jitter_level, tag='prior'):
         """
         Compute lower Cholesky factor of given matrix, adding jitter for stability (prevent non-PD error).
 
+        Note: each call first tries jitter_level itself. The jitter multiplier that last succeeded is cached per (tag,
+        kernel params, matrix size), and is the next try if jitter_level fails, so repeated factorisations of similar
+        ill-conditioned matrices (e.g. every stage 1 outer iteration) skip the doubling from jitter_level. The cached
+        value is overwritten by every success, so it falls back to 1 once jitter_level suffices again. The jitter
+        actually added is recorded in self.jitter_stats.
+
         :param matrix: torch.Tensor, matrix subject to Cholesky decomposition
         :param jitter_level: float, jitter added for numerical stability
+        :param tag: str, label for the kind of matrix (e.g. `prior`, `train`, `posterior`), part of the cache key
         :return: torch.Tensor, lower Cholesky factor of input matrix
         """
+        key = (tag, params_key(self.kern.params), matrix.shape[0])
         jitter = torch.eye(matrix.shape[0], dtype=matrix.dtype, device=matrix.device) * jitter_level
-        multiplier = 1.
+        cached = self._jitter_cache.get(key, 1.)
+        multiplier = 1.  # always try jitter_level first, so one ill-conditioned matrix does not inflate later jitter
+        n_attempts = 1
         while True:
-            try:
-                L = torch.linalg.cholesky(matrix + multiplier * jitter)  # try to compute lower Cholesky factor
+            L, info = torch.linalg.cholesky_ex(matrix + multiplier * jitter)  # try to compute lower Cholesky factor
+            if info == 0:
                 break
-            except RuntimeError:
-                multiplier *= 2.
-                if float(multiplier) == float("inf"):
-                    raise RuntimeError("increase to inf jitter")
+            multiplier = cached if multiplier < cached else 2. * multiplier  # cached multiplier, then doubling
+            n_attempts += 1
+            if float(multiplier) == float("inf"):
+                raise RuntimeError("increase to inf jitter")
+        self._jitter_cache[key] = multiplier
+
+        # Record how much jitter was needed
+        self.jitter_stats['last_jitter'] = multiplier * jitter_level
+        self.jitter_stats['max_jitter'] = max(self.jitter_stats['max_jitter'], multiplier * jitter_level)
+        self.jitter_stats['n_factorisations'] += 1
+        self.jitter_stats['n_failed'] += n_attempts - 1
+        return L
+
+    def cholesky_factor_batched(self, matrices, jitter_level, tag='prior'):
+        """
+        Compute lower Cholesky factors of a batch of matrices, adding jitter only to those that need it.
+
+        :param matrices: torch.Tensor, size (B, n, n), matrices subject to Cholesky decomposition
+        :param jitter_level: float, jitter added for numerical stability
+        :param tag: str, label for the kind of matrix, part of the jitter cache key (see cholesky_factor)
+        :return: torch.Tensor, size (B, n, n), lower Cholesky factors
+        """
+        key = (tag, params_key(self.kern.params), matrices.shape[-1])
+        jitter = torch.eye(matrices.shape[-1], dtype=matrices.dtype, device=matrices.device) * jitter_level
+        cached = self._jitter_cache.get(key, 1.)
+        multiplier = 1.  # always try jitter_level first (see cholesky_factor)
+        L = torch.empty_like(matrices)
+        todo = torch.arange(matrices.shape[0], device=matrices.device)  # matrices not yet factorised
+        n_failed = 0
+        while True:
+            L_todo, info = torch.linalg.cholesky_ex(matrices[todo] + multiplier * jitter)  # one batched call
+            ok = info == 0
+            L[todo[ok]] = L_todo[ok]
+            todo = todo[~ok]
+            if todo.numel() == 0:
+                break
+            multiplier = cached if multiplier < cached else 2. * multiplier  # cached multiplier, then doubling
+            n_failed += todo.numel()
+            if float(multiplier) == float("inf"):
+                raise RuntimeError("increase to inf jitter")
+        self._jitter_cache[key] = multiplier
+
+        # Record how much jitter was needed
+        self.jitter_stats['last_jitter'] = multiplier * jitter_level
+        self.jitter_stats['max_jitter'] = max(self.jitter_stats['max_jitter'], multiplier * jitter_level)
+        self.jitter_stats['n_factorisations'] += matrices.shape[0]
+        self.jitter_stats['n_failed'] += n_failed
+        return L
+
+    def cholesky_mixed(self, matrix, generator=None):
+        """
+        Attempt a float32 Cholesky factorisation, checking its accuracy with random probe vectors.
+
+        :param matrix: torch.Tensor, symmetric PD matrix (any precision)
+        :param generator: torch.Generator, (optional) random number generator for the probe vectors
+        :return: torch.Tensor, float32 lower Cholesky factor, or None if it fails or its residual exceeds mixed_tol
+        """
+        matrix = matrix.to(dtype=torch.float32)
+        jitter = torch.eye(matrix.shape[0], dtype=matrix.dtype, device=matrix.device) * self.mixed_jitter
+        L, info = torch.linalg.cholesky_ex(matrix + jitter)
+        residual = float('inf')
+        if info == 0:
+            Z = standard_normal((matrix.shape[0], 4), dtype=matrix.dtype, device=matrix.device, generator=generator)
+            KZ = matrix @ Z
+            residual = (torch.norm(L @ (L.T @ Z) - KZ) / torch.norm(KZ)).item()
+        self.precision_stats['last_residual'] = residual
+        if not residual <= self.mixed_tol:  # also catches NaN residuals
+            self.precision_stats['n_fallback'] += 1
+            return None
+        self.precision_stats['n_float32'] += 1
         return L
 
-    def sample_functions(self, X, n_samples):
+    def sample_functions(self, X, n_samples, grid=None, generator=None):
         """
         Produce samples from the prior latent functions.
 
         :param X: torch.Tensor, size (n_inputs, input_dim), inputs at which to generate samples
         :param n_samples: int, number of sampled functions
+        :param grid: list, (optional) 1D tensors of axis coordinates, if X is known to be the product grid of these
+            axes with the first coordinate changing fastest (otherwise the grid structure is detected from X)
+        :param generator: torch.Generator, (optional) random number generator used instead of the global one (e.g. by
+            a background thread, so that its draws do not interleave with those of the main thread)
         :return: torch.Tensor, size (n_inputs, n_samples), with samples in columns
         """
         # X = X.reshape((-1, self.kern.input_dim))
         mu = self.mean_function(X)  # compute mean vector for inputs X
-        var = self.kern.K(X)  # compute covariance matrix for inputs X
-        L = self.cholesky_factor(var, jitter_level=self.jitter)  # lower Cholesky factor of cov matrix
+
+        # Approximate samples using random Fourier features (stationary kernels only)
+        if self.method == 'rff':
+            return mu + fourier.sample_functions_rff(self.kern, X, n_samples, n_features=self.n_features,
+                                                     generator=generator)
+
+        # Exact samples using Kronecker structure, with one small Cholesky factor per axis (separable kernels only)
+        if self.method == 'kronecker' and kronecker.is_separable(self.kern):
+            structure = kronecker.product_grid(X) if grid is None else (grid, 'xy')
+            if structure is not None:
+                axes, order = structure
+                L_factors = [self.cholesky_factor(K, jitter_level=self.jitter, tag='kron{}'.format(dd))
+                             for dd, K in enumerate(kronecker.kron_factors(self.kern, axes))]
+                return mu + kronecker.kron_sample(L_factors, n_samples, order=order, generator=generator)
+
+        # Exact samples using FFTs of a circulant embedding (isotropic kernels on regular grids)
+        if self.method == 'circulant' and isinstance(self.kern, base.Isotropic):
+            structure = circulant.regular_grid(X) if grid is None else (grid, 'xy')
+            if structure is not None:
+                axes, order = structure
+                samples = circulant.circulant_sample(self.kern, axes, n_samples, order=order,
+                                                     generator=generator)
+                if samples is not None:
+                    return mu + samples.to(device=X.device)
+
+        # Try float32 first in mixed precision mode, falling back to float64 if the factor is inaccurate
+        L = None
+        if self.precision == 'mixed':
+            L = self.cholesky_mixed(self.kern.K(X, dtype=torch.float32), generator=generator)
+        if L is None:
+            var = self.kern.K(X)  # compute covariance matrix for inputs X
+            L = self.cholesky_factor(var, jitter_level=self.jitter)  # lower Cholesky factor of cov matrix
 
         # Populate (n_inputs, n_samples) tensor with random numbers drawn from standard normal
-        V = torch.randn(L.shape[0], n_samples, dtype=L.dtype, device=L.device)
+        V = standard_normal((L.shape[0], n_samples), dtype=L.dtype, device=L.device, generator=generator)
 
         # Generate output using Cholesky factor for sampling
+        return mu + torch.matmul(L, V).to(dtype=torch.float64)
+
+    def sample_functions_batched(self, X_batch, n_samples, generator=None):
+        """
+        Produce samples from the prior latent functions for a batch of measurement sets, using one batched Cholesky.
+
+        Note: useful to precompute the targets for several stage 1 outer iterations at once, when the measurement set
+        changes every iteration (e.g. random input locations). With a sampling method other than `cholesky`, or in
+        mixed precision mode, the measurement sets are sampled one at a time with sample_functions instead.
+
+        :param X_batch: torch.Tensor, size (B, n_inputs, input_dim), stack of measurement sets
+        :param n_samples: int, number of sampled functions per measurement set
+        :param generator: torch.Generator, (optional) random number generator used instead of the global one
+        :return: torch.Tensor, size (B, n_inputs, n_samples), with samples in columns for each measurement set
+        """
+        if self.method != 'cholesky' or self.precision == 'mixed':
+            return torch.stack([self.sample_functions(X, n_samples, generator=generator) for X in X_batch])
+
+        mu = torch.stack([self.mean_function(X) for X in X_batch])  # compute mean vectors for inputs X_batch
+        K = torch.stack([self.kern.K(X) for X in X_batch])  # size (B, n_inputs, n_inputs)
+        L = self.cholesky_factor_batched(K, jitter_level=self.jitter)
+
+        # Populate (B, n_inputs, n_samples) tensor with random numbers drawn from standard normal
+        V = standard_normal((L.shape[0], L.shape[1], n_samples), dtype=L.dtype, device=L.device, generator=generator)
         return mu + torch.matmul(L, V)
 
     def assign_data(self, X, Y, sn2=0):
@@ -79,6 +389,7 @@ class GP(torch.nn.Module):
         self.Y = Y.cpu()
         self.sn2 = sn2
         self.data_assigned = True
+        self._posterior = None
 
     def update_kernel(self, **params):
         """
@@ -89,14 +400,54 @@ class GP(torch.nn.Module):
         if 'sn2' in params.keys():
             self.sn2 = params.pop('sn2')
         self.kern.params = params
+        self._posterior = None
+
+    def posterior(self):
+        """
+        Obtain the fitted posterior, factorising the training covariance matrix only if the data or kernel changed.
 
-    def predict_f(self, Xnew, noisy_targets=False):
+        :return: instance of Posterior
         """
-        Compute the predictive mean vector and covariance matrix for the specified inputs.
+        # Throw exception if data not assigned
+        if not self.data_assigned:
+            raise Exception('Assign data first')
+
+        if self._posterior is None:
+            # Use Kronecker algebra if the training inputs form a product grid (separable kernels only)
+            structure = None
+            if self.method == 'kronecker' and kronecker.is_separable(self.kern) and self.sn2 > 0:
+                structure = kronecker.product_grid(self.X)
+            if structure is not None:
+                axes, order = structure
+                kron = (kronecker.kron_factors(self.kern, axes), order)
+                self._posterior = Posterior(self.kern, self.X, self.Y, self.sn2, kron=kron)
+            else:
+                # Try float32 first in mixed precision mode, falling back to float64 if the factor is inaccurate
+                L = None
+                if self.precision == 'mixed':
+                    K_tt = self.kern.K(self.X, dtype=torch.float32)
+                    K_tt += torch.eye(self.X.shape[0], dtype=K_tt.dtype, device=K_tt.device) * self.sn2
+                    L = self.cholesky_mixed(K_tt)
+                if L is not None:
+                    self._posterior = Posterior(self.kern, self.X, self.Y, self.sn2, L=L, compute_dtype=torch.float32)
+                else:
+                    K_tt = self.kern.K(self.X)
+                    K_tt += torch.eye(self.X.shape[0], dtype=K_tt.dtype, device=K_tt.device) * self.sn2
+                    L = self.cholesky_factor(K_tt, jitter_level=self.jitter, tag='train')
+                    self._posterior = Posterior(self.kern, self.X, self.Y, self.sn2, L=L)
+        return self._posterior
+
+    def predict_f(self, Xnew, noisy_targets=False, full_cov=True, chunk_size=None):
+        """
+        Compute the predictive mean vector and covariance matrix (or marginal variances) for the specified inputs.
+
+        Note: use full_cov=False when only predictive means and SDs are needed; this avoids the O(n_test^2) matrix K_ss.
 
         :param Xnew: torch.Tensor, test inputs at which to perform predictions
         :param noisy_targets: bool, specify if predictive covariances are computed for noisy targets
-        :return: tuple, predictive mean, predictive covariance matrix
+        :param full_cov: bool, specify if the full covariance matrix (True) or marginal variances (False) are returned
+        :param chunk_size: int, (optional) number of test points processed at a time when full_cov is False
+        :return: tuple, predictive mean (n_test, 1), predictive covariance matrix (n_test, n_test) or variances (n_test, 1)
         """
         # Throw exception if data not assigned
         if not self.data_assigned:
@@ -105,26 +456,8 @@ class GP(torch.nn.Module):
         # Ensure devices match
         Xnew = Xnew.to(self.X.device)
 
-        # Compute covariance matrices for test/training inputs (s for test, t for train)
-        K_st = self.kern.K(Xnew, self.X)
-        K_ts = K_st.T
-        K_ss = self.kern.K(Xnew)
-        K_tt = self.kern.K(self.X) + torch.eye(self.X.shape[0], dtype=self.X.dtype, device=self.X.device) * self.sn2
-
-        # Compute predictive mean
-        L = self.cholesky_factor(K_tt, jitter_level=self.jitter).to(dtype=self.Y.dtype)
-        A0 = torch.linalg.solve(L, self.Y)
-        A1 = torch.linalg.solve(L.T, A0).to(dtype=K_st.dtype)
-        fmean = torch.mm(K_st, A1)
-
-        # Compute predictive variance
-        L = L.to(dtype=K_ts.dtype)
-        V = torch.linalg.solve(L, K_ts)
-        if noisy_targets:
-            K_ss += torch.eye(Xnew.shape[0], dtype=self.X.dtype, device=self.X.device) * self.sn2
-        fvar = K_ss - torch.mm(V.T, V)
-
-        return fmean, fvar
+        # Predictions only need cross-covariances, given the cached training factorisation
+        return self.posterior().predict(Xnew, full_cov=full_cov, noisy_targets=noisy_targets, chunk_size=chunk_size)
 
     def predict_f_samples(self, Xnew, n_samples, noisy_targets=False):
         """
@@ -139,41 +472,166 @@ class GP(torch.nn.Module):
         if not self.data_assigned:
             raise Exception('Assign data first')
 
-        mu, var = self.predict_f(Xnew, noisy_targets=noisy_targets)  # compute mean vector and covariance matrix
-        L = self.cholesky_factor(var, jitter_level=self.jitter)  # lower Cholesky factor of cov matrix
+        mu, var = self.predict_f(Xnew, noisy_targets=noisy_targets, full_cov=True)  # joint sampling needs full matrix
+        L = self.cholesky_factor(var, jitter_level=self.jitter, tag='posterior')  # lower Cholesky factor of cov matrix
         V = torch.randn(L.shape[0], n_samples, dtype=L.dtype, device=L.device)  # sample using Cholesky factor
 
         return mu + torch.matmul(L, V)
 
-    def marginal_loglik(self, **params):
+    def _batched_cov(self, ampl, leng, **extra):
         """
-        Compute marginal log likelihood with model fit and complexity terms.
+        Compute training covariance matrices for a batch of (ampl, leng) settings.
 
-        :param params: dict, key-value pairs with values for ampl, leng, [sn2, power]
-        :return: tuple, log likelihood, model fit, complexity
+        :param ampl: torch.Tensor, size (B), amplitude parameters
+        :param leng: torch.Tensor, size (B), lengthscale parameters
+        :param extra: dict, remaining kernel parameters (e.g. power), default taken from the kernel
+        :return: torch.Tensor, size (B, n_train, n_train), covariance matrices
+        """
+        params = {k: v for k, v in self.kern.params.items() if k not in ('ampl', 'leng')}
+        params.update(extra)
+
+        # Isotropic kernels broadcast over the batch, so the distance matrix is computed once
+        if isinstance(self.kern, base.Isotropic):
+            r = self.kern.euclid_dist(self.X).unsqueeze(0)
+            return self.kern.cov(r, ampl=ampl.reshape(-1, 1, 1), leng=leng.reshape(-1, 1, 1), **params)
+
+        # Otherwise evaluate the kernel for each setting in turn
+        kern_params = self.kern.params
+        try:
+            K = []
+            for a, l in zip(ampl, leng):
+                self.kern.params = dict(params, ampl=a, leng=l)
+                K.append(self.kern.K(self.X))
+        finally:
+            self.kern.params = kern_params
+        return torch.stack(K)
+
+    def _loglik_terms(self, ampl, leng, sn2, **extra):
+        """
+        Compute model fit and complexity terms of the log marginal likelihood for a batch of hyperparameters.
+
+        Note: a failed Cholesky factorisation (matrix not numerically PD) gives a log likelihood of -inf.
+
+        :param ampl: torch.Tensor, size (B), amplitude parameters
+        :param leng: torch.Tensor, size (B), lengthscale parameters
+        :param sn2: torch.Tensor, size (B), measurement error variances
+        :param extra: dict, remaining kernel parameters (e.g. power)
+        :return: tuple, log likelihood, model fit, complexity, each of size (B)
+        """
+        Y = torch.as_tensor(self.Y).to(dtype=torch.float64, device=self.X.device).reshape(-1, 1)
+        n_train = Y.shape[0]
+        K = self._batched_cov(ampl, leng, **extra)
+        eye = torch.eye(n_train, dtype=K.dtype, device=K.device)
+        K = K + (sn2.reshape(-1, 1, 1) + self.jitter) * eye  # training set covariance matrices
+        L, info = torch.linalg.cholesky_ex(K)  # one batched factorisation, no exceptions on failure
+        ok = info == 0
+        L = torch.where(ok.reshape(-1, 1, 1), L, eye)  # keep gradients finite for failed factorisations
+        A1 = torch.cholesky_solve(Y.expand(K.shape[0], n_train, 1), L)
+
+        modelfit = -0.5 * (Y * A1).sum((1, 2))  # model fit term
+        complexity = torch.log(torch.diagonal(L, dim1=1, dim2=2)).sum(1)  # complexity penalty term
+        loglik = modelfit - complexity - 0.5 * n_train * np.log(2 * np.pi)  # log likelihood
+        loglik = torch.where(ok, loglik, torch.full_like(loglik, -float('inf')))
+        return loglik, modelfit, complexity
+
+    def log_marginal_likelihood(self, log_hyper):
+        """
+        Compute the log marginal likelihood as a differentiable function of log-hyperparameters.
+
+        :param log_hyper: torch.Tensor, size (3) or (B, 3), columns log ampl, log leng, log sn2 (batch evaluated with
+            one batched Cholesky decomposition)
+        :return: torch.Tensor, size () or (B), log likelihood
         """
         # Throw exception if data not assigned
         if not self.data_assigned:
             raise Exception('Assign data first')
 
-        # Set kernel hyperparameters
-        kern = deepcopy(self.kern)
-        if 'sn2' in params.keys():
-            sn2 = params.pop('sn2')
-        else:
-            sn2 = self.sn2
-        kern.params = params
+        batched = log_hyper.dim() == 2
+        log_hyper = log_hyper.reshape(-1, 3).to(dtype=torch.float64, device=self.X.device)
+        ampl, leng, sn2 = log_hyper.exp().unbind(1)
+        loglik, _, _ = self._loglik_terms(ampl, leng, sn2)
+        return loglik if batched else loglik[0]
+
+    def fit_hyperparameters(self, init=None, n_candidates=64, n_restarts=3, spread=1., batch_size=16,
+                            max_iter=100, update=True, generator=None):
+        """
+        Maximum likelihood estimation of ampl, leng and sn2, using batched screening followed by L-BFGS refinement.
+
+        Note: candidates are drawn around the initial values in log space and scored in batches without gradients; the
+        best n_restarts are then refined with L-BFGS using autograd gradients.
+
+        :param init: dict, initial values for ampl, leng, sn2 (default: current kernel parameters and sn2)
+        :param n_candidates: int, number of candidate settings scored in the screening step
+        :param n_restarts: int, number of best candidates refined with L-BFGS
+        :param spread: float, standard deviation of candidates around the initial values (in log space)
+        :param batch_size: int, number of candidates per batched Cholesky decomposition
+        :param max_iter: int, maximum number of L-BFGS iterations per restart
+        :param update: bool, specify if the GP is updated with the optimised hyperparameters
+        :param generator: torch.Generator, (optional) random number generator for the candidates, used instead of the
+            global one (e.g. for reproducible fits)
+        :return: dict, optimised ampl, leng, sn2 and the corresponding log likelihood
+        """
+        # Throw exception if data not assigned
+        if not self.data_assigned:
+            raise Exception('Assign data first')
 
-        n_train = self.X.shape[0]  # compute training set size
-        err_cov = sn2 * np.eye(n_train)  # compute measurement error covariance matrix
+        if init is None:
+            init = {'ampl': self.kern.params['ampl'], 'leng': self.kern.params['leng'], 'sn2': self.sn2}
+        log_init = torch.log(torch.tensor([float(init['ampl']), float(init['leng']), float(init['sn2'])],
+                                          dtype=torch.float64, device=self.X.device))
+
+        # Screen candidate settings (including the initial values) in batches
+        candidates = log_init + spread * standard_normal((n_candidates, 3), dtype=torch.float64, device=self.X.device,
+                                                         generator=generator)
+        candidates = torch.cat([log_init.reshape(1, -1), candidates])
+        with torch.no_grad():
+            scores = torch.cat([self.log_marginal_likelihood(candidates[start:start + batch_size])
+                                for start in range(0, candidates.shape[0], batch_size)])
+        order = torch.argsort(scores, descending=True)[:n_restarts]
+
+        # Refine the best candidates with L-BFGS
+        best_log, best_loglik = None, -float('inf')
+        for idx in order:
+            if not torch.isfinite(scores[idx]):
+                continue
+            log_hyper = candidates[idx].clone().requires_grad_(True)
+            optimiser = torch.optim.LBFGS([log_hyper], max_iter=max_iter, line_search_fn='strong_wolfe')
+
+            def closure():
+                optimiser.zero_grad()
+                loss = -self.log_marginal_likelihood(log_hyper)
+                loss.backward()
+                return loss
+
+            optimiser.step(closure)
+            with torch.no_grad():
+                loglik = self.log_marginal_likelihood(log_hyper).item()
+            if loglik > best_loglik:
+                best_log, best_loglik = log_hyper.detach(), loglik
+
+        if best_log is None:
+            raise RuntimeError('No candidate hyperparameters gave a finite log likelihood')
+        ampl, leng, sn2 = best_log.exp().tolist()
+        if update:
+            self.update_kernel(**dict(self.kern.params, ampl=ampl, leng=leng, sn2=sn2))
+        return {'ampl': ampl, 'leng': leng, 'sn2': sn2, 'loglik': best_loglik}
 
-        K_tt = kern.K(X=self.X) + err_cov  # training set covariance matrix
-        L = self.cholesky_factor(K_tt, jitter_level=self.jitter)  # lower Cholesky factor of cov matrix
-        A0 = np.linalg.solve(L, self.Y)
-        A1 = np.linalg.solve(L.T, A0)
+    def marginal_loglik(self, **params):
+        """
+        Compute marginal log likelihood with model fit and complexity terms.
 
-        modelfit = np.round(-0.5 * self.Y.T @ A1, 6).item()  # model fit term
-        complexity = np.round(sum(np.log(np.diag(L))), 6)  # complexity penalty term
-        loglik = np.round(modelfit - complexity - 0.5 * n_train * np.log(2 * np.pi), 6).item()  # log likelihood
+        :param params: dict, key-value pairs with values for ampl, leng, [sn2, power]
+        :return: tuple, log likelihood, model fit, complexity
+        """
+        # Throw exception if data not assigned
+        if not self.data_assigned:
+            raise Exception('Assign data first')
 
-        return loglik, modelfit, complexity
+        sn2 = params.pop('sn2', self.sn2)
+        as_batch = lambda v: torch.tensor([float(v)], dtype=torch.float64, device=self.X.device)
+        with torch.no_grad():
+            loglik, modelfit, complexity = self._loglik_terms(as_batch(params.pop('ampl')),
+                                                              as_batch(params.pop('leng')),
+                                                              as_batch(sn2),
+                                                              **params)
+        return loglik.item(), modelfit.item(), complexity.item()
@@ -0,0 +1,23 @@
+"""
+Standard normal draws from the global random number generator or a dedicated one
+"""
+
+import torch
+
+
+def standard_normal(size, dtype=torch.float64, device='cpu', generator=None):
+    """
+    Draw standard normal random numbers, from the global random number generator unless a generator is given.
+
+    Note: a torch.Generator belongs to one device, so with a generator the numbers are drawn on its device and then
+    moved to the requested device.
+
+    :param size: tuple, size of output tensor
+    :param dtype: torch.dtype, data type of output tensor
+    :param device: str or torch.device, device of output tensor
+    :param generator: torch.Generator, (optional) dedicated random number generator
+    :return: torch.Tensor, standard normal random numbers
+    """
+    if generator is None:
+        return torch.randn(size, dtype=dtype, device=device)
+    return torch.randn(size, dtype=dtype, device=generator.device, generator=generator).to(device)
@@ -0,0 +1,272 @@
+"""
+Inducing-point (sparse) GP posterior for large observation sets
+"""
+
+import numpy as np
+import torch
+from .model import solve_lower, solve_upper
+
+
+class SparseGP(torch.nn.Module):
+    def __init__(self, kern, Z=None, n_inducing=256, approx='fitc', jitter=1e-6):
+        """
+        Sparse GP using m inducing inputs, with fitting, prediction and sampling at cost O(n * m^2).
+
+        Note: the approximations follow Quinonero-Candela & Rasmussen (2005). With Q = K_fu K_uu^{-1} K_uf, the training
+        covariance is approximated by Q + Lambda, where Lambda = sn2 * I for `sor` and `dtc`, and
+        Lambda = sn2 * I + diag(K_ff - Q) for `fitc`. The `vfe` option (Titsias, 2009) uses the `dtc` posterior and
+        subtracts the trace term tr(K_ff - Q) / (2 sn2) from the log marginal likelihood (a lower bound).
+
+        :param kern: instance of Kern child, covariance function or kernel
+        :param Z: torch.Tensor, size (m, input_dim), (optional) inducing inputs (default: random subset of training inputs)
+        :param n_inducing: int, number of inducing inputs, if Z is not specified
+        :param approx: str, `sor`, `dtc`, `fitc` or `vfe`, sparse approximation
+        :param jitter: float, jitter added to K_uu for numerical stability
+        """
+        super(SparseGP, self).__init__()
+        if approx not in ('sor', 'dtc', 'fitc', 'vfe'):
+            raise ValueError('Sparse approximation must be one of sor, dtc, fitc or vfe.')
+        self.kern = kern
+        self.Z = Z
+        self.n_inducing = n_inducing
+        self.approx = approx
+        self.jitter = jitter
+        self.X, self.Y, self.sn2 = None, None, None  # to be initialised with assign_data
+        self.data_assigned = False  # status of whether data assigned
+        self._cache = None  # fitted terms, cached until the data or kernel change
+
+    def assign_data(self, X, Y, sn2):
+        """
+        Assign data to condition upon, selecting inducing inputs from X if none were specified.
+
+        :param X: torch.Tensor, training inputs
+        :param Y: torch.Tensor, corresponding training targets
+        :param sn2: float, measurement error variance (could be initial estimate)
+        """
+        self.X = X.cpu().to(dtype=torch.float64)
+        self.Y = torch.as_tensor(Y).cpu().to(dtype=torch.float64).reshape(-1, 1)
+        self.sn2 = sn2
+        if self.Z is None:
+            idxs = torch.randperm(self.X.shape[0])[:min(self.n_inducing, self.X.shape[0])]
+            self.Z = self.X[idxs]
+        self.Z = self.Z.to(dtype=torch.float64, device=self.X.device)
+        self.data_assigned = True
+        self._cache = None
+
+    def update_kernel(self, **params):
+        """
+        For updating GP kernel following optimisation.
+
+        :param params: dict, key-value pairs with values for ampl, leng, [sn2, power]
+        """
+        if 'sn2' in params.keys():
+            self.sn2 = params.pop('sn2')
+        self.kern.params = params
+        self._cache = None
+
+    def _fit_terms(self, ampl=None, leng=None, sn2=None):
+        """
+        Compute the factorisations shared by the likelihood, predictions and samples.
+
+        :param ampl: torch.Tensor, (optional) amplitude parameter, overriding the kernel value
+        :param leng: torch.Tensor, (optional) lengthscale parameter, overriding the kernel value
+        :param sn2: torch.Tensor, (optional) measurement error variance, overriding self.sn2
+        :return: dict, containing L_uu, V = L_uu^{-1} K_uf, Lambda diagonal, L_A, b and the trace residual
+        """
+        kern_params = self.kern.params
+        params = dict(kern_params)
+        if ampl is not None:
+            params['ampl'] = ampl
+        if leng is not None:
+            params['leng'] = leng
+        sn2 = self.sn2 if sn2 is None else sn2
+
+        try:
+            self.kern.params = params
+            K_uu = self.kern.K(self.Z)
+            K_uf = self.kern.K(self.Z, self.X)
+            K_ff_diag = self.kern.K_diag(self.X)
+        finally:
+            self.kern.params = kern_params
+
+        m = self.Z.shape[0]
+        eye = torch.eye(m, dtype=K_uu.dtype, device=K_uu.device)
+        L_uu = torch.linalg.cholesky(K_uu + self.jitter * eye)
+        V = solve_lower(L_uu, K_uf)  # size (m, n)
+        resid = K_ff_diag - (V ** 2).sum(0)  # diag(K_ff - Q), nonnegative up to rounding
+
+        if self.approx == 'fitc':
+            lam = sn2 + resid.clamp(min=0)
+        else:
+            lam = sn2 * torch.ones_like(resid)
+
+        # A = I + V Lambda^{-1} V^T, so (Q + Lambda)^{-1} follows from the Woodbury identity
+        V_scaled = V / lam.sqrt()
+        L_A = torch.linalg.cholesky(eye + V_scaled @ V_scaled.T)
+        b = solve_lower(L_A, V @ (self.Y / lam.reshape(-1, 1)))
+
+        return {'L_uu': L_uu, 'V': V, 'lam': lam, 'L_A': L_A, 'b': b, 'resid': resid, 'sn2': sn2}
+
+    def _fitted(self):
+        """
+        Obtain the cached fitted terms, recomputing them only if the data or kernel changed.
+
+        :return: dict, fitted terms (see _fit_terms)
+        """
+        # Throw exception if data not assigned
+        if not self.data_assigned:
+            raise Exception('Assign data first')
+
+        if self._cache is None:
+            with torch.no_grad():
+                self._cache = self._fit_terms()
+        return self._cache
+
+    def log_marginal_likelihood(self, log_hyper=None):
+        """
+        Compute the (approximate) log marginal likelihood, differentiable with respect to log-hyperparameters.
+
+        :param log_hyper: torch.Tensor, size (3), (optional) log ampl, log leng, log sn2 (default: current values)
+        :return: torch.Tensor, log likelihood
+        """
+        # Throw exception if data not assigned
+        if not self.data_assigned:
+            raise Exception('Assign data first')
+
+        if log_hyper is None:
+            terms = self._fit_terms()
+        else:
+            ampl, leng, sn2 = log_hyper.to(dtype=torch.float64).exp().unbind(0)
+            terms = self._fit_terms(ampl=ampl, leng=leng, sn2=sn2)
+
+        n_train = self.X.shape[0]
+        Y = self.Y.reshape(-1)
+        modelfit = -0.5 * ((Y ** 2 / terms['lam']).sum() - (terms['b'] ** 2).sum())  # model fit term
+        complexity = torch.log(torch.diagonal(terms['L_A'])).sum() + 0.5 * torch.log(terms['lam']).sum()
+        loglik = modelfit - complexity - 0.5 * n_train * np.log(2 * np.pi)
+        if self.approx == 'vfe':
+            loglik = loglik - 0.5 * terms['resid'].sum() / terms['sn2']  # trace term of the variational bound
+        return loglik
+
+    def fit_hyperparameters(self, init=None, max_iter=100, update=True):
+        """
+        Maximum likelihood (or variational bound) estimation of ampl, leng and sn2 with L-BFGS in log space.
+
+        :param init: dict, initial values for ampl, leng, sn2 (default: current kernel parameters and sn2)
+        :param max_iter: int, maximum number of L-BFGS iterations
+        :param update: bool, specify if the GP is updated with the optimised hyperparameters
+        :return: dict, optimised ampl, leng, sn2 and the corresponding log likelihood
+        """
+        # Throw exception if data not assigned
+        if not self.data_assigned:
+            raise Exception('Assign data first')
+
+        if init is None:
+            init = {'ampl': self.kern.params['ampl'], 'leng': self.kern.params['leng'], 'sn2': self.sn2}
+        log_hyper = torch.log(torch.tensor([float(init['ampl']), float(init['leng']), float(init['sn2'])],
+                                           dtype=torch.float64)).requires_grad_(True)
+        optimiser = torch.optim.LBFGS([log_hyper], max_iter=max_iter, line_search_fn='strong_wolfe')
+
+        def closure():
+            optimiser.zero_grad()
+            loss = -self.log_marginal_likelihood(log_hyper)
+            loss.backward()
+            return loss
+
+        optimiser.step(closure)
+        with torch.no_grad():
+            loglik = self.log_marginal_likelihood(log_hyper).item()
+        ampl, leng, sn2 = log_hyper.detach().exp().tolist()
+        if update:
+            self.update_kernel(**dict(self.kern.params, ampl=ampl, leng=leng, sn2=sn2))
+        return {'ampl': ampl, 'leng': leng, 'sn2': sn2, 'loglik': loglik}
+
+    def _test_terms(self, Xnew):
+        """
+        Compute W = L_uu^{-1} K_u* and C = L_A^{-1} W for test inputs.
+
+        :param Xnew: torch.Tensor, test inputs
+        :return: tuple, W and C, each of size (m, n_test)
+        """
+        terms = self._fitted()
+        W = solve_lower(terms['L_uu'], self.kern.K(self.Z, Xnew))
+        C = solve_lower(terms['L_A'], W)
+        return W, C
+
+    def predict_f(self, Xnew, noisy_targets=False, full_cov=False, chunk_size=None):
+        """
+        Compute the predictive mean vector and marginal variances (or covariance matrix) for the specified inputs.
+
+        :param Xnew: torch.Tensor, test inputs at which to perform predictions
+        :param noisy_targets: bool, specify if predictive covariances are computed for noisy targets
+        :param full_cov: bool, specify if the full covariance matrix (True) or marginal variances (False) are returned
+        :param chunk_size: int, (optional) number of test points processed at a time when full_cov is False
+        :return: tuple, predictive mean (n_test, 1), predictive variances (n_test, 1) or covariance (n_test, n_test)
+        """
+        terms = self._fitted()
+        Xnew = Xnew.to(device=self.X.device, dtype=torch.float64)
+
+        if full_cov:
+            W, C = self._test_terms(Xnew)
+            fmean = C.T @ terms['b']
+            fvar = C.T @ C
+            if self.approx != 'sor':
+                fvar += self.kern.K(Xnew) - W.T @ W
+            if noisy_targets:
+                fvar += torch.eye(Xnew.shape[0], dtype=fvar.dtype, device=fvar.device) * terms['sn2']
+            return fmean, fvar
+
+        n_test = Xnew.shape[0]
+        if chunk_size is None:
+            chunk_size = n_test
+        fmean = torch.empty(n_test, 1, dtype=torch.float64, device=Xnew.device)
+        fvar = torch.empty(n_test, 1, dtype=torch.float64, device=Xnew.device)
+        for start in range(0, n_test, chunk_size):
+            stop = min(start + chunk_size, n_test)
+            W, C = self._test_terms(Xnew[start:stop])
+            fmean[start:stop] = C.T @ terms['b']
+            var = (C ** 2).sum(0)
+            if self.approx != 'sor':
+                var += self.kern.K_diag(Xnew[start:stop]) - (W ** 2).sum(0)
+            fvar[start:stop] = var.reshape(-1, 1)
+        if noisy_targets:
+            fvar += terms['sn2']
+        return fmean, fvar
+
+    def predict_f_samples(self, Xnew, n_samples, noisy_targets=False, chunk_size=None):
+        """
+        Generate posterior samples, drawing inducing values once and projecting them to the test inputs.
+
+        Note: in whitened coordinates the inducing values have posterior N(L_A^{-T} b, A^{-1}), so each sample costs
+        O(n_test * m). Except for `sor`, the residual variance diag(K_** - Q_**) is added independently per test point
+        (fully independent test conditional), which avoids any O(n_test^2) matrix.
+
+        :param Xnew: torch.Tensor, inputs at which to generate samples
+        :param n_samples: int, number of sampled functions
+        :param noisy_targets: bool, specify if samples are generated for noisy targets
+        :param chunk_size: int, (optional) number of test points processed at a time
+        :return: torch.Tensor, size (n_inputs, n_samples), function samples in columns
+        """
+        terms = self._fitted()
+        Xnew = Xnew.to(device=self.X.device, dtype=torch.float64)
+        m = self.Z.shape[0]
+
+        # Whitened inducing values v, with u = L_uu v
+        eps = torch.randn(m, n_samples, dtype=torch.float64, device=self.X.device)
+        v = solve_upper(terms['L_A'].T, terms['b'] + eps)  # small (m, m) system
+
+        n_test = Xnew.shape[0]
+        if chunk_size is None:
+            chunk_size = n_test
+        samples = torch.empty(n_test, n_samples, dtype=torch.float64, device=Xnew.device)
+        for start in range(0, n_test, chunk_size):
+            stop = min(start + chunk_size, n_test)
+            W = solve_lower(terms['L_uu'], self.kern.K(self.Z, Xnew[start:stop]))
+            f = W.T @ v
+            var = torch.zeros(stop - start, dtype=torch.float64, device=Xnew.device)
+            if self.approx != 'sor':
+                var += (self.kern.K_diag(Xnew[start:stop]) - (W ** 2).sum(0)).clamp(min=0)
+            if noisy_targets:
+                var += terms['sn2']
+            samples[start:stop] = f + var.sqrt().reshape(-1, 1) * torch.randn_like(f)
+        return samples
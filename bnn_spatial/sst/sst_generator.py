@@ -109,13 +109,14 @@ class SST(torch.nn.Module):
                     self.data[n_panels * tt + cc - 1, :, :] = sst_panel
                 self.data_loc[n_panels * tt + cc - 1, :] = row, col  # store (row, column) of panel
 
-    def sample_functions(self, n_samples, replace=False, flatten_order='C'):
+    def sample_functions(self, n_samples, replace=False, flatten_order='C', random_state=None):
         """
         Produce samples from the SST data set, with or without replacement.
 
         :param n_samples: int, number of sampled functions
         :param flatten_order: str, specify whether to flatten samples row-wise ('C') or col-wise ('F')
         :param replace: bool, specify is sampling is done with replacement or not (default: without replacement)
+        :param random_state: np.random.RandomState, (optional) random number generator used instead of the global one
         :return: torch.Tensor, size (n_inputs, n_samples), with samples in columns
         """
         if self.data is None:
@@ -132,7 +133,8 @@ class SST(torch.nn.Module):
                 self.samples = deepcopy(self.data)
 
         # Randomly sample and resize panels of SST data
-        np.random.shuffle(self.samples)  # randomly shuffle along first mode
+        rng = np.random if random_state is None else random_state
+        rng.shuffle(self.samples)  # randomly shuffle along first mode
         samples = self.samples[:n_samples, :, :]
         samples_ = np.empty((64**2, n_samples))
         for ss in range(n_samples):
@@ -0,0 +1,141 @@
+"""
+Background producer of measurement sets and target samples for stage-1 calibration
+"""
+
+import queue
+import threading
+import torch
+import numpy as np
+
+
+class TargetPrefetcher(object):
+    def __init__(self, data_generator, sample_targets, n_data, n_samples, n_iters, n_draws=2, queue_size=2, seed=0,
+                 device='cpu', start_it=1, snapshot_its=None, snapshot_extra=None, rng_state=None):
+        """
+        Produce measurement sets and target (GP or SST) samples in a background thread, into a bounded queue.
+
+        Note: target draws do not depend on the BNN hyperparameters, so the next iterations' draws can be computed
+        while the optimiser works on the current one (PyTorch releases the GIL inside its kernels). The producer draws
+        from its own torch.Generator and np.random.RandomState, so its random stream does not interleave with the
+        main thread's, and a run is reproducible for a given seed. Measurement set generators must be deterministic
+        (e.g. GridGenerator) or use their own random number generators.
+
+        For exact resumption, the producer state after item it (the generator states, plus snapshot_extra()) is attached
+        to that item whenever snapshot_its(it) is true; a checkpoint saved at iteration it stores this state, and a
+        prefetcher created with rng_state set to it continues the same stream from iteration it + 1.
+
+        :param data_generator: instance of data generation object (e.g. GridGenerator), generates measurement set
+        :param sample_targets: callable, maps (measurement set, n_samples, generator, random_state) to target samples
+            of size (n_data, n_samples)
+        :param n_data: int, size of measurement set
+        :param n_samples: int, number of target samples per draw
+        :param n_iters: int, number of items to produce (one per outer iteration)
+        :param n_draws: int, number of independent target draws per measurement set
+        :param queue_size: int, maximum number of items produced ahead of the consumer
+        :param seed: int, seed of the producer's random number generators (derive it from the main seed)
+        :param device: str or torch.device, device of the producer's torch.Generator (where target samples are drawn)
+        :param start_it: int, outer iteration of the first item
+        :param snapshot_its: callable, (optional) maps an outer iteration to whether the producer state is attached
+        :param snapshot_extra: callable, (optional) returns further producer-side state to attach (e.g. a copy of the
+            SST sample pool, which the producer consumes ahead of the main thread)
+        :param rng_state: dict, (optional) producer state attached to an earlier item, to continue its stream
+        """
+        self.data_generator = data_generator
+        self.sample_targets = sample_targets
+        self.n_data = n_data
+        self.n_samples = n_samples
+        self.n_iters = n_iters
+        self.n_draws = n_draws
+        self.start_it = start_it
+        self.snapshot_its = snapshot_its
+        self.snapshot_extra = snapshot_extra
+
+        # Dedicated random number generators of the producer thread
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(seed)
+        self.random_state = np.random.RandomState(seed % 2**32)
+        if rng_state is not None:
+            self.generator.set_state(rng_state['torch'].cpu())
+            self.random_state.set_state(rng_state['numpy'])
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+
+    def _put(self, item):
+        """
+        Put an item in the queue, giving up if the prefetcher is closed while waiting for space.
+
+        :param item: tuple or Exception, item to enqueue
+        :return: bool, whether the item was enqueued
+        """
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def rng_state(self):
+        """
+        Current state of the producer's random number generators.
+
+        :return: dict, torch.Generator state and np.random.RandomState state
+        """
+        return {'torch': self.generator.get_state(), 'numpy': self.random_state.get_state()}
+
+    def _produce(self):
+        """
+        Producer loop run in the background thread; exceptions are passed to the consumer.
+        """
+        try:
+            for it in range(self.start_it, self.start_it + self.n_iters):
+                X = self.data_generator.get(self.n_data)
+                draws = [self.sample_targets(X, self.n_samples, generator=self.generator,
+                                             random_state=self.random_state) for _ in range(self.n_draws)]
+
+                # Producer state after this item, for a checkpoint saved at this iteration
+                snapshot = None
+                if self.snapshot_its is not None and self.snapshot_its(it):
+                    snapshot = self.rng_state()
+                    if self.snapshot_extra is not None:
+                        snapshot['extra'] = self.snapshot_extra()
+                if not self._put((X, draws, snapshot)):
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def start(self):
+        """
+        Start the background thread.
+
+        :return: TargetPrefetcher, self
+        """
+        self._thread.start()
+        return self
+
+    def get(self):
+        """
+        Retrieve the next measurement set and target draws, waiting only if the producer has fallen behind.
+
+        :return: tuple, measurement set, list of n_draws target sample tensors, and producer state (or None)
+        """
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        """
+        Stop the background thread and discard any unconsumed items.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,118 @@
+"""
+Run independent stage-1 calibrations for a grid of BNN prior configurations in parallel
+"""
+
+import os
+import itertools
+import pickle
+import multiprocessing as mp
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .wasserstein_mapper import MapperWasserstein
+from ..bnn.nets.gaussian_net import GaussianNet
+from ..bnn.nets.hierarchical_net import HierarchicalNet
+from ..utils.util import ensure_dir, set_seed
+
+NETS = {'GaussianNet': GaussianNet, 'HierarchicalNet': HierarchicalNet}
+
+
+def config_grid(**options):
+    """
+    Expand lists of options into the list of all configurations (Cartesian product).
+
+    Example: config_grid(activation_fn=['tanh', 'relu'], prior_per=['layer', 'parameter']) gives four configurations.
+
+    :param options: dict, key-value pairs with a list of candidate values for each BNN constructor argument
+    :return: list, contains one dict of constructor arguments per configuration
+    """
+    keys = list(options.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*options.values())]
+
+def _init_worker(threads_per_worker):
+    """
+    Limit intra-op threads in each worker, so that the workers do not oversubscribe the cores.
+
+    :param threads_per_worker: int, number of threads used by PyTorch in each worker process
+    """
+    torch.set_num_threads(threads_per_worker)
+
+def _run_config(idx, config, gp, data_generator, out_dir, net_kwargs, mapper_kwargs, optimise_kwargs, seed):
+    """
+    Perform the Wasserstein optimisation for one configuration (executed in a worker process).
+
+    :param idx: int, index of configuration in the sweep
+    :param config: dict, BNN constructor arguments (and optionally `net`, the name of the BNN class)
+    :return: dict, index entry for the configuration
+    """
+    set_seed(seed + idx)
+    net_name = config.get('net', 'GaussianNet')
+    net_config = {key: value for key, value in config.items() if key != 'net'}
+    bnn = NETS[net_name](**{**net_kwargs, **net_config})
+
+    run_dir = os.path.join(out_dir, "config-{}".format(idx))
+    mapper = MapperWasserstein(gp, bnn, data_generator, out_dir=run_dir, **mapper_kwargs)
+    wdist_hist = mapper.optimise(**optimise_kwargs)
+
+    return {'idx': idx,
+            'config': dict(config),
+            'net': net_name,
+            'out_dir': run_dir,
+            'ckpt_dir': mapper.ckpt_dir,
+            'wdist_hist': wdist_hist,
+            'final_wdist': wdist_hist[-1] if len(wdist_hist) > 0 else None}
+
+def run_sweep(configs, gp, data_generator, out_dir, net_kwargs=None, mapper_kwargs=None, optimise_kwargs=None,
+              n_workers=None, threads_per_worker=None, seed=1):
+    """
+    Schedule independent MapperWasserstein runs across a process pool, one run per configuration.
+
+    Note: workers are started with the `spawn` method, so calling scripts need an `if __name__ == '__main__'` guard.
+
+    :param configs: list, contains dicts of BNN constructor arguments (e.g. from config_grid), with optional key `net`
+        set to `GaussianNet` (default) or `HierarchicalNet`
+    :param gp: nn.Module, target prior (must be on CPU and picklable)
+    :param data_generator: instance of data generation object (e.g. GridGenerator), generates measurement set
+    :param out_dir: str, directory for output files; each run writes into its own `config-<idx>` subdirectory
+    :param net_kwargs: dict, BNN constructor arguments shared by all configurations (overridden by configs)
+    :param mapper_kwargs: dict, arguments passed to MapperWasserstein (except gp, bnn, data_generator, out_dir)
+    :param optimise_kwargs: dict, arguments passed to MapperWasserstein.optimise
+    :param n_workers: int, number of worker processes (default: number of cores divided by threads_per_worker)
+    :param threads_per_worker: int, number of PyTorch threads in each worker (default: cores divided by n_workers)
+    :param seed: int, base seed; the run with index idx uses seed + idx
+    :return: list, index with one dict per configuration (sorted by index), also saved to `sweep_index.pkl`
+    """
+    if len(configs) == 0:
+        raise ValueError('No configurations to run; configs must contain at least one dict of BNN arguments')
+    net_kwargs = {} if net_kwargs is None else net_kwargs
+    mapper_kwargs = {} if mapper_kwargs is None else mapper_kwargs
+    optimise_kwargs = {'num_iters': 1000} if optimise_kwargs is None else optimise_kwargs
+
+    # Share the cores between the workers
+    n_cores = os.cpu_count() or 1
+    if n_workers is None:
+        n_workers = max(1, n_cores // (threads_per_worker or 1))
+    n_workers = min(n_workers, len(configs))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, n_cores // n_workers)
+
+    ensure_dir(out_dir)
+    index = []
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=mp.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(threads_per_worker,)) as executor:
+        futures = [executor.submit(_run_config, idx, config, gp, data_generator, out_dir,
+                                   net_kwargs, mapper_kwargs, optimise_kwargs, seed)
+                   for idx, config in enumerate(configs)]
+        for future in as_completed(futures):
+            entry = future.result()
+            index.append(entry)
+            print(">>> Configuration # {:3d} done: Wasserstein Dist {}".format(entry['idx'], entry['final_wdist']))
+
+    # Collect the results for all configurations into a single index
+    index = sorted(index, key=lambda entry: entry['idx'])
+    with open(os.path.join(out_dir, "sweep_index.pkl"), "wb") as index_file:
+        pickle.dump(index, index_file)
+
+    return index
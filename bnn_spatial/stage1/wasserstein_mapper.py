@@ -5,9 +5,11 @@ Calibrate BNN prior to target GP prior (or any other stochastic process)
 import torch
 import torch.nn as nn
 import numpy as np
-import itertools, os
+import itertools, os, random, inspect
+from copy import deepcopy
 from torch.utils.data import TensorDataset, DataLoader
 from ..utils.util import prepare_device, ensure_dir
+from .prefetch import TargetPrefetcher
 
 
 class LipschitzFunction(nn.Module):
@@ -122,7 +124,8 @@ class WassersteinDistance():
         grad_penalty, avg_grad_norm = ((f_gradient_norm - 1) ** 2).mean(), f_gradient_norm.mean().item()
         return grad_penalty, avg_grad_norm
 
-    def lipschitz_optimisation(self, X, n_samples, out_dir, n_steps=200, print_every=10, outer_step=None):
+    def lipschitz_optimisation(self, X, n_samples, out_dir, n_steps=200, print_every=10, outer_step=None,
+                               gp_samples_bag=None):
         """
         Performs inner Lipschitz optimisation loop.
 
@@ -131,6 +134,7 @@ class WassersteinDistance():
         :param n_steps: int, number of loop repeats (n_Lipschitz in paper)
         :param print_every: int, regularity of printed feedback in outer optimisation loop
         :param outer_step: int, current step in outer optimisation loop
+        :param gp_samples_bag: torch.Tensor, size (n_data, n_samples), (optional) pre-drawn GP samples for X
         """
         # Enable storing gradients for parameters
         for p in self.lipschitz_f.parameters():
@@ -140,8 +144,10 @@ class WassersteinDistance():
         if not self.gpu_gp:
             X = X.to("cpu")
 
-        # Draw functions from GP, into tensor of size (n_data, n_samples)
-        if self.raw_data:
+        # Draw functions from GP, into tensor of size (n_data, n_samples), unless already drawn (e.g. prefetched)
+        if gp_samples_bag is not None:
+            gp_samples_bag = gp_samples_bag.detach().float().to(self.device)
+        elif self.raw_data:
             gp_samples_bag = self.gp.sample_functions(n_samples).detach().float().to(self.device)
         else:
             gp_samples_bag = self.gp.sample_functions(X.double(), n_samples).detach().float().to(self.device)
@@ -318,18 +324,126 @@ class MapperWasserstein(object):
         self.ckpt_dir = os.path.join(self.out_dir, "ckpts")
         ensure_dir(self.ckpt_dir)
 
-    def optimise(self, num_iters, n_samples=128, lr=0.05, print_every=10, save_ckpt_every=50):
+    def save_state(self, path, it, prior_optimiser, wdist_hist, grad_hist, prefetch_state=None):
+        """
+        Save the full optimisation state, so that an interrupted run can be resumed exactly.
+
+        :param path: str, path of checkpoint file
+        :param it: int, last completed outer iteration
+        :param prior_optimiser: torch.optim.Optimizer, outer optimiser for BNN prior hyperparameters
+        :param wdist_hist: list, Wasserstein distance history
+        :param grad_hist: tuple, accumulated Lipschitz gradient norms, parameter gradient norms and losses
+        :param prefetch_state: dict, (optional) state of the TargetPrefetcher after producing iteration it (the
+            producer runs ahead, so its current state and the current SST sample pool do not match iteration it)
+        """
+        target_samples = getattr(self.gp, 'samples', None) if self.raw_data else None
+        prefetch_rng = None
+        if prefetch_state is not None:
+            prefetch_rng = {'torch': prefetch_state['torch'], 'numpy': prefetch_state['numpy']}
+            target_samples = prefetch_state.get('extra')
+        state = {
+            'it': it,
+            'bnn': self.bnn.state_dict(),
+            'prior_optimiser': prior_optimiser.state_dict(),
+            'lipschitz_f': self.wasserstein.lipschitz_f.state_dict(),
+            'lipschitz_optimiser': self.wasserstein.optimiser.state_dict(),
+            'wdist_hist': list(wdist_hist),
+            'grad_hist': grad_hist,
+            'torch_rng': torch.get_rng_state(),
+            'cuda_rng': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy_rng': np.random.get_state(),
+            'python_rng': random.getstate(),
+            'prefetch_rng': prefetch_rng,
+            'target_samples': target_samples
+        }
+
+        # Write to a temporary file first, then rename, so a crash mid-write never corrupts the last checkpoint
+        tmp_path = path + '.tmp'
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load_state(self, path, prior_optimiser):
+        """
+        Restore the full optimisation state saved by save_state.
+
+        :param path: str, path of checkpoint file
+        :param prior_optimiser: torch.optim.Optimizer, outer optimiser for BNN prior hyperparameters
+        :return: tuple, last completed outer iteration, Wasserstein distance history, accumulated gradient history,
+            and TargetPrefetcher random number generator states (None if the run did not prefetch)
+        """
+        # The state holds numpy/python RNG states, so it cannot be loaded in weights-only mode (default in torch >= 2.6)
+        load_kwargs = {}
+        if 'weights_only' in inspect.signature(torch.load).parameters:  # absent before torch 1.13
+            load_kwargs['weights_only'] = False
+        state = torch.load(path, map_location=self.device, **load_kwargs)
+        self.bnn.load_state_dict(state['bnn'])
+        prior_optimiser.load_state_dict(state['prior_optimiser'])
+        self.wasserstein.lipschitz_f.load_state_dict(state['lipschitz_f'])
+        self.wasserstein.optimiser.load_state_dict(state['lipschitz_optimiser'])
+
+        # Restore random number generators last, so that nothing above consumes random numbers
+        torch.set_rng_state(state['torch_rng'].cpu())
+        if state['cuda_rng'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([s.cpu() for s in state['cuda_rng']])
+        np.random.set_state(state['numpy_rng'])
+        random.setstate(state['python_rng'])
+        if state['target_samples'] is not None:
+            self.gp.samples = state['target_samples']
+
+        return state['it'], state['wdist_hist'], state['grad_hist'], state.get('prefetch_rng')
+
+    def sample_targets(self, X, n_samples, generator=None, random_state=None):
+        """
+        Draw target (GP or SST) samples for a measurement set.
+
+        :param X: torch.Tensor, size (n_data, input_dim), measurement set
+        :param n_samples: int, number of sampled functions
+        :param generator: torch.Generator, (optional) random number generator for GP samples, instead of the global one
+        :param random_state: np.random.RandomState, (optional) random number generator for SST samples, ditto
+        :return: torch.Tensor, size (n_data, n_samples), target samples on the configured device
+        """
+        if self.raw_data:
+            if self.n_data != 64**2:
+                raise Exception('Only 64-by-64 SST samples are considered; need n_data = 64^2')
+            return self.gp.sample_functions(n_samples, random_state=random_state).detach().float().to(self.device)
+
+        # Compute GP samples on CPU if gpu_gp specified as false
+        X = X.to(self.device if self.gpu_gp else "cpu")
+        return self.gp.sample_functions(X.double(), n_samples, generator=generator).detach().float().to(self.device)
+
+    @staticmethod
+    def _is_checkpoint(it, save_ckpt_every, num_iters):
+        """
+        Check whether a checkpoint is saved after outer iteration it.
+
+        :param it: int, outer iteration
+        :param save_ckpt_every: int, frequency of save checkpoints
+        :param num_iters: int, number of outer loop repeats
+        :return: bool, whether a checkpoint is saved
+        """
+        return (it % save_ckpt_every == 0) or (it in [1, 10, num_iters])
+
+    def optimise(self, num_iters, n_samples=128, lr=0.05, print_every=10, save_ckpt_every=50, resume=False,
+                 prefetch=0):
         """
         Implement outer optimisation loop for BNN prior hyperparameters.
 
+        Note: with prefetch > 0, measurement sets and target samples (for both the outer step and the inner Lipschitz
+        loop) are produced by a background thread up to prefetch iterations ahead, overlapping with the optimisation.
+        The thread has its own random number generators, seeded from the main seed and saved in the full checkpoint,
+        so a run must be resumed with the same choice of prefetching (on or off) as it was started with.
+
         :param num_iters: int, number of outer loop repeats
         :param n_samples: int, number of GP and BNN samples (N_s in paper)
         :param lr: float, learning rate of outer optimiser
         :param print_every: int, frequency of printed feedback
         :param save_ckpt_every: int, frequency of save checkpoints
+        :param resume: bool, specify if optimisation continues from the last saved state in the checkpoint directory
+        :param prefetch: int, number of iterations of targets produced ahead in the background (0 to disable)
         :return: list, Wasserstein distance history (for plotting)
         """
         wdist_hist = []
+        f_grad_norms, p_grad_norms, lip_losses = None, None, None
 
         # Optimise wrt BNN prior hyperparameters; Tran used RMSprop optimiser
         prior_optimizer = torch.optim.RMSprop(self.bnn.parameters(), lr=lr)
@@ -337,27 +451,79 @@ class MapperWasserstein(object):
         # Note: for each layer have W_std = softplus(W_rho) and b_std = softplus(b_rho), with rho values optimised.
         #       The rho values are registered as parameters using nn.Parameter, with the setting require_grad = True.
 
-        # Outer optimisation loop for BNN prior hyperparameters
-        for it in range(1, num_iters+1):
+        # Restore optimiser states, RNG states and histories from the last full checkpoint
+        state_path = os.path.join(self.ckpt_dir, "state.ckpt")
+        start_it = 1
+        prefetch_rng = None
+        if resume and os.path.exists(state_path):
+            last_it, wdist_hist, grad_hist, prefetch_rng = self.load_state(state_path, prior_optimizer)
+            if prefetch_rng is not None and prefetch == 0:
+                raise Exception('Checkpoint was saved by a run with prefetching; resume it with prefetch > 0')
+            if prefetch_rng is None and prefetch > 0:
+                raise Exception('Checkpoint was saved by a run without prefetching; resume it with prefetch = 0')
+            f_grad_norms, p_grad_norms, lip_losses = grad_hist
+            start_it = last_it + 1
+            print(">>> Resuming from iteration # {:3d}".format(last_it))
+
+        # Start background production of measurement sets and target samples (outer step and inner loop draws)
+        prefetcher = None
+        if prefetch > 0:
+            prefetcher = TargetPrefetcher(self.data_generator, self.sample_targets,
+                                          n_data=self.n_data,
+                                          n_samples=n_samples,
+                                          n_iters=num_iters - start_it + 1,
+                                          n_draws=2,
+                                          queue_size=prefetch,
+                                          seed=torch.initial_seed() + 1,  # offset, so streams differ from main
+                                          device=self.device if self.gpu_gp else "cpu",
+                                          start_it=start_it,
+                                          snapshot_its=lambda it: self._is_checkpoint(it, save_ckpt_every, num_iters),
+                                          snapshot_extra=(lambda: deepcopy(self.gp.samples)) if self.raw_data else None,
+                                          rng_state=prefetch_rng).start()
+        try:
+            wdist_hist, f_grad_norms, p_grad_norms, lip_losses = self._outer_loop(
+                start_it, num_iters, n_samples, prior_optimizer, state_path, prefetcher, print_every, save_ckpt_every,
+                wdist_hist, (f_grad_norms, p_grad_norms, lip_losses))
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
 
-            # Generate measurement set
-            X = self.data_generator.get(self.n_data)  # size (n_data, input_dim)
-            X = X.to(self.device)
+        # Store the gradient norms and losses for all outer optimisation steps
+        ensure_dir(self.out_dir)
+        nn_file = os.path.join(self.out_dir, "f_grad_norms")  # saved as .npy file
+        param_file = os.path.join(self.out_dir, "p_grad_norms")  # ditto
+        loss_file = os.path.join(self.out_dir, "lip_losses")  # ditto
+        np.save(nn_file, f_grad_norms.T)  # one column per outer step, after transpose
+        np.save(param_file, p_grad_norms.T)  # ditto
+        np.save(loss_file, lip_losses.T)  # ditto
 
-            # Transfer measurement set to CPU if gpu_gp specified as false
-            if not self.gpu_gp:
-                X = X.to("cpu")
+        # Return history of Wasserstein distance values (for assessing convergence)
+        return wdist_hist
 
-            # Draw functions from GP
-            if self.raw_data:
-                if self.n_data != 64**2:
-                    raise Exception('Only 64-by-64 SST samples are considered; need n_data = 64^2')
-                gp_samples = self.gp.sample_functions(n_samples).detach().float().to(self.device)
-            else:
-                gp_samples = self.gp.sample_functions(X.double(), n_samples).detach().float().to(self.device)
+    def _outer_loop(self, start_it, num_iters, n_samples, prior_optimizer, state_path, prefetcher, print_every,
+                    save_ckpt_every, wdist_hist, grad_hist):
+        """
+        Run outer iterations start_it, ..., num_iters (see optimise).
+
+        :param prefetcher: TargetPrefetcher, (optional) source of measurement sets and target samples
+        :param grad_hist: tuple, accumulated Lipschitz gradient norms, parameter gradient norms and losses
+        :return: tuple, Wasserstein distance history, and the accumulated gradient norms and losses
+        """
+        f_grad_norms, p_grad_norms, lip_losses = grad_hist
 
-            # Retrieve measurement from CPU if transferred earlier
-            if not self.gpu_gp:
+        # Outer optimisation loop for BNN prior hyperparameters
+        for it in range(start_it, num_iters+1):
+
+            if prefetcher is not None:
+                # Take the next measurement set and target samples, produced in the background
+                X, (gp_samples, gp_samples_inner), prefetch_state = prefetcher.get()
+                X = X.to(self.device)
+            else:
+                # Generate measurement set, and draw functions from GP
+                X = self.data_generator.get(self.n_data)  # size (n_data, input_dim)
+                gp_samples = self.sample_targets(X, n_samples)
+                gp_samples_inner = None  # drawn within the inner loop
+                prefetch_state = None
                 X = X.to(self.device)
 
             # Draw functions from BNN
@@ -387,7 +553,8 @@ class MapperWasserstein(object):
                                                     out_dir=self.out_dir,
                                                     n_steps=inner_steps,
                                                     print_every=print_every,
-                                                    outer_step=it)
+                                                    outer_step=it,
+                                                    gp_samples_bag=gp_samples_inner)
 
             # Load penalty term gradients for this particular outer optimisation step
             ensure_dir(self.out_dir)
@@ -416,19 +583,11 @@ class MapperWasserstein(object):
             if (it % print_every == 0) or it == 1:
                 print(">>> Iteration # {:3d}: Wasserstein Dist {:.4f}".format(it, float(wdist)))
 
-            # Save checkpoint
-            if (it % save_ckpt_every == 0) or (it in [1, 10, num_iters]):
+            # Save checkpoint (BNN hyperparameters only), along with the full state for resuming
+            if self._is_checkpoint(it, save_ckpt_every, num_iters):
                 path = os.path.join(self.ckpt_dir, "it-{}.ckpt".format(it))
                 torch.save(self.bnn.state_dict(), path)
+                self.save_state(state_path, it, prior_optimizer, wdist_hist,
+                                (f_grad_norms, p_grad_norms, lip_losses), prefetch_state=prefetch_state)
 
-        # Store the gradient norms and losses for all outer optimisation steps
-        ensure_dir(self.out_dir)
-        nn_file = os.path.join(self.out_dir, "f_grad_norms")  # saved as .npy file
-        param_file = os.path.join(self.out_dir, "p_grad_norms")  # ditto
-        loss_file = os.path.join(self.out_dir, "lip_losses")  # ditto
-        np.save(nn_file, f_grad_norms.T)  # one column per outer step, after transpose
-        np.save(param_file, p_grad_norms.T)  # ditto
-        np.save(loss_file, lip_losses.T)  # ditto
-
-        # Return history of Wasserstein distance values (for assessing convergence)
-        return wdist_hist
+        return wdist_hist, f_grad_norms, p_grad_norms, lip_losses
@@ -1,5 +1,6 @@
 import numpy as np
 import math
+import contextlib
 import torch
 import torch.utils.data as data_utils
 import torch.nn.functional as F
@@ -13,11 +14,12 @@ from ..samplers.sghmc import SGHMC
 from ..utils.util import inf_loop, prepare_device
 from ..utils.normalisation import zscore_normalisation, zscore_unnormalisation
 from ..bnn.layers.embedding_layer import EmbeddingLayer
+from ..bnn.nets.net import BlankNet
 
 
 class BayesNet:
     def __init__(self, net, likelihood, prior, sampling_method="adaptive_sghmc", n_gpu=0,
-                 normalise_input=False, normalise_output=True):
+                 normalise_input=False, normalise_output=True, compute_dtype=None):
         """
         Bayesian neural network that uses stochastic gradient MCMC to sample from the posterior.
 
@@ -28,6 +30,8 @@ class BayesNet:
         :param n_gpu: int, number of GPUs to use for computation
         :param normalise_input: bool, specify whether inputs are normalised
         :param normalise_output: bool, specify whether outputs are normalised
+        :param compute_dtype: str, (optional) `bfloat16` to run the BlankNet forward/backward passes in train with
+            bfloat16 autocasting, while parameters, gradients, sampler state, prior and likelihood stay in float32
         """
         self.net = net
         self.lik_module = likelihood
@@ -56,6 +60,17 @@ class BayesNet:
         self.sampled_weights = None
         self.pred_weights = None
 
+        # Reduced-precision forward/backward passes (opt-in)
+        self.compute_dtype = None
+        if compute_dtype is not None:
+            if compute_dtype not in ['bfloat16', torch.bfloat16]:
+                raise ValueError("Accepted values for compute_dtype: None or `bfloat16`")
+            if not hasattr(torch, 'autocast'):
+                raise Exception('bfloat16 sampling requires PyTorch >= 1.10 (torch.autocast)')
+            if not isinstance(net, BlankNet):
+                raise Exception('bfloat16 sampling is only supported for BlankNet.')
+            self.compute_dtype = torch.bfloat16
+
         # Setup GPU device if available, move model into configured device
         self.device, device_ids = prepare_device(self.n_gpu)
         self.net = self.net.to(self.device)
@@ -160,6 +175,16 @@ class BayesNet:
         prior = self.prior_module(self.net, test_input)
         return prior / n_train
 
+    def _autocast(self):
+        """
+        Context for the network forward pass in train (bfloat16 autocasting if specified by compute_dtype).
+
+        :return: context manager
+        """
+        if self.compute_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=self.compute_dtype)
+
     def _initialise_sampler(self, n_train, lr=1e-2, mdecay=0.05, num_burn_in_steps=3000, epsilon=1e-10):
         """
         Initialise the stochastic gradient MCMC sampler.
@@ -475,7 +500,9 @@ class BayesNet:
             input_batch, y_batch = input_batch.to(self.device), y_batch.to(self.device)
             input_batch = input_batch.view(y_batch.shape[0], -1)  # batch of training set inputs
             y_batch = y_batch.view(-1, 1)  # batch of training set noisy targets (observations)
-            fx_batch = self.net(input_batch).view(-1, 1)  # network predictions on the input batch
+            with self._autocast():
+                fx_batch = self.net(input_batch)  # network predictions on the input batch
+            fx_batch = fx_batch.float().view(-1, 1)  # likelihood and prior are evaluated in float32
 
             self.step += 1  # number of MCMC steps
 
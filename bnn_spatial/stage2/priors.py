@@ -8,6 +8,26 @@ import torch.nn.functional as F
 import torch.distributions as dist
 
 
+def _member_view(value, param, per_member):
+    """
+    Reshape hyperparameters to broadcast against stacked parameters of a batch of networks.
+
+    :param value: float or torch.Tensor, mean or std dev, either one per network (leading dim n_members) or shared
+    :param param: torch.Tensor, size (n_members, *param_shape), stacked parameters
+    :param per_member: bool, specify if value has one entry (or one parameter-sized block) per network
+    :return: float or torch.Tensor, value broadcastable to the size of param
+    """
+    if not isinstance(value, torch.Tensor):
+        return value
+    if per_member:
+        if value.numel() == param.numel():
+            return value.reshape(param.shape)
+        return value.reshape((param.shape[0],) + (1,) * (param.dim() - 1))  # one scalar per network
+    if value.numel() == param[0].numel():
+        return value.reshape(param.shape[1:])
+    return value
+
+
 class PriorModule(nn.Module):
     def __init__(self):
         """
@@ -34,6 +54,18 @@ class PriorModule(nn.Module):
         """
         raise NotImplementedError
 
+    def logp_batched(self, stacked_params, site_indices=None):
+        """
+        Compute log joint prior of many networks at once (implemented by child classes).
+
+        :param stacked_params: dict, parameter name (as in net.named_parameters()) to tensor of size
+            (n_members, *param_shape), stacked parameters of n_members networks
+        :param site_indices: list or torch.Tensor, (optional) size (n_members), row index of the test input for each
+            network (nonstationary priors)
+        :return: torch.Tensor, size (n_members), log joint prior of each network
+        """
+        raise NotImplementedError
+
 """
 Gaussian Prior (Fixed and GPi-G)
 """
@@ -65,14 +97,31 @@ class FixedGaussianPrior(PriorModule):
             res -= 0.5 * torch.sum((param - self.mu) ** 2) / var
         return res
 
+    def logp_batched(self, stacked_params, site_indices=None):
+        """
+        Compute log joint prior of many networks at once.
+
+        :param stacked_params: dict, parameter name to tensor of size (n_members, *param_shape)
+        :param site_indices: list or torch.Tensor, not used (stationary prior)
+        :return: torch.Tensor, size (n_members), log joint prior of each network
+        """
+        res = 0.
+        for name, param in stacked_params.items():
+            if 'batch_norm' in name:
+                continue
+            var = self.std.to(param.device) ** 2
+            res = res - 0.5 * ((param - self.mu) ** 2).flatten(1).sum(1) / var
+        return res
+
 class OptimGaussianPrior(PriorModule):
-    def __init__(self, saved_path, rbf=None, device="cpu"):
+    def __init__(self, saved_path, rbf=None, device="cpu", tables_path=None):
         """
         Child class for optimised Gaussian prior over the parameters (GPi-G).
 
         :param saved_path: str, path to checkpoint containing optimised parameters
         :param rbf: torch.Tensor, embedding layer evaluations on all spatial inputs
         :param device: str, specify device for module
+        :param tables_path: str, (optional) path to prior tables saved with save_tables (see precompute)
         """
         super(OptimGaussianPrior, self).__init__()
         self.params = {}
@@ -81,9 +130,18 @@ class OptimGaussianPrior(PriorModule):
         # Embedding layer RBF evaluations
         self.rbf = rbf
 
+        # Precomputed means and std devs at each site (see precompute)
+        self.tables = None
+        self.site_rows = {}
+
         data = torch.load(saved_path, map_location=torch.device(self.device))
         for name, param in data.items():  # hyperparam tensors contain rho and mu coefficients (for weights and biases)
-            self.params[name] = param.squeeze().to(self.device)
+            # Note: not squeezed, so hyperparameters keep the shape of their parameters (e.g. (hidden_dim, 1) for the
+            #       output weights), or size (1) for one prior per layer, and broadcast elementwise against them
+            self.params[name] = param.to(self.device)
+
+        if tables_path is not None:
+            self.load_tables(tables_path)
 
     def to(self, device):
         """
@@ -96,8 +154,26 @@ class OptimGaussianPrior(PriorModule):
             self.params[name] = self.params[name].to(device)
             if self.rbf is not None:
                 self.rbf = self.rbf.to(device)
+        if self.tables is not None:
+            self.tables = {name: tuple(None if t is None else t.to(device) for t in table)
+                           for name, table in self.tables.items()}
         return self
 
+    def _field(self, rbf, key):
+        """
+        Evaluate spatially varying coefficients (full tensor, or rank-r CP factors key + '_rbf', '_in', '_out').
+
+        :param rbf: torch.Tensor, size (n_sites, rbf_dim), embedding layer evaluations at the sites
+        :param key: str, name of the (full) coefficient tensor, e.g. "layers.hidden_X.W_rho_coeffs"
+        :return: torch.Tensor or None, size (n_sites, *param_shape), coefficients evaluated at the sites (None if absent)
+        """
+        if key in self.params.keys():
+            return torch.tensordot(rbf, self.params[key], dims=([1], [0]))
+        if key + '_rbf' in self.params.keys():
+            U, V, T = self.params[key + '_rbf'], self.params[key + '_in'], self.params[key + '_out']
+            return torch.einsum('br,ir,or->bio', rbf @ U, V, T)
+        return None
+
     def _get_params_by_name(self, name, test_input=None):
         """
         Extract hyperparameters for layer by specifying name of corresponding parameters.
@@ -107,7 +183,13 @@ class OptimGaussianPrior(PriorModule):
         :return: tuple, 2*(float) or 2*(torch.Tensor), mean and std dev for the layer's parameters
         """
         mu, std = 0., None
+        rbf = None
         if test_input is not None:
+            if self.tables is not None and name in self.tables and int(test_input) in self.site_rows:
+                row = self.site_rows[int(test_input)]
+                mu_table, std_table = self.tables[name]
+                mu = self.params.get(name + '_mu', 0.) if mu_table is None else mu_table[row].float()
+                return mu, std_table[row].float()
             if self.rbf is None:
                 raise Exception('Must provide prior with embedding layer evaluations for nonstationary case.')
             rbf = self.rbf[int(test_input), :].unsqueeze(0)
@@ -115,29 +197,79 @@ class OptimGaussianPrior(PriorModule):
         # NOTE: parameter tensor names have the form (e.g.) "layers.hidden_X.W" or "output_layer.W", whereas
         #       hyperparameter tensor names have the same form with (e.g.) ".W_rho_coeffs" instead of ".W"
 
-        if '.W' in name:
-            if name.replace('.W', '.W_rho_coeffs') in self.params.keys():
-                std = F.softplus(
-                    torch.tensordot(rbf, self.params[name.replace('.W', '.W_rho_coeffs')], dims=([1], [0]))).squeeze()
-            elif name.replace('.W', '.W_rho') in self.params.keys():
-                std = F.softplus(self.params[name.replace('.W', '.W_rho')])
-            if name.replace('.W', '.W_mu_coeffs') in self.params.keys():
-                mu = torch.tensordot(rbf, self.params[name.replace('.W', '.W_mu_coeffs')], dims=([1], [0])).squeeze()
-            elif name.replace('.W', '.W_mu') in self.params.keys():
-                mu = self.params[name.replace('.W', '.W_mu')]
-        elif '.b' in name:
-            if name.replace('.b', '.b_rho_coeffs') in self.params.keys():
-                std = F.softplus(
-                    torch.tensordot(rbf, self.params[name.replace('.b', '.b_rho_coeffs')], dims=([1], [0]))).squeeze()
-            elif name.replace('.b', '.b_rho') in self.params.keys():
-                std = F.softplus(self.params[name.replace('.b', '.b_rho')])
-            if name.replace('.b', '.b_mu_coeffs') in self.params.keys():
-                mu = torch.tensordot(rbf, self.params[name.replace('.b', '.b_mu_coeffs')], dims=([1], [0])).squeeze()
-            elif name.replace('.b', '.b_mu') in self.params.keys():
-                mu = self.params[name.replace('.b', '.b_mu')]
+        for p in ['.W', '.b']:
+            if p in name:
+                rho = None if rbf is None else self._field(rbf, name.replace(p, p + '_rho_coeffs'))
+                if rho is not None:
+                    std = F.softplus(rho)[0]  # single site
+                elif name.replace(p, p + '_rho') in self.params.keys():
+                    std = F.softplus(self.params[name.replace(p, p + '_rho')])
+                mean = None if rbf is None else self._field(rbf, name.replace(p, p + '_mu_coeffs'))
+                if mean is not None:
+                    mu = mean[0]
+                elif name.replace(p, p + '_mu') in self.params.keys():
+                    mu = self.params[name.replace(p, p + '_mu')]
+                break
 
         return mu, std
 
+    def precompute(self, sites=None, dtype=torch.float32):
+        """
+        Precompute tables of prior means and std devs at each site (nonstationary case), once, so that the prior
+        evaluation at each step is a row lookup rather than an evaluation of the embedding layer coefficients.
+
+        :param sites: list, (optional) row indices of the domain to tabulate (e.g. BayesNet.bnn_idxs), all if None
+        :param dtype: torch.dtype, storage type of the tables (torch.float16 or torch.float32), looked-up rows are
+            returned in float32
+        :return: instance of OptimGaussianPrior
+        """
+        if self.rbf is None:
+            raise Exception('Must provide prior with embedding layer evaluations for nonstationary case.')
+        if sites is None:
+            sites = range(self.rbf.shape[0])
+        sites = [int(site) for site in sites]
+        rbf = self.rbf[sites, :]
+
+        # Parameter names (e.g. "layers.hidden_X.W") with spatially varying std devs
+        names = set()
+        for key in self.params.keys():
+            for suffix in ['_rho_coeffs', '_rho_coeffs_rbf']:
+                if key.endswith(suffix):
+                    names.add(key[:-len(suffix)])
+
+        tables = {}
+        with torch.no_grad():
+            for name in sorted(names):
+                std = F.softplus(self._field(rbf, name + '_rho_coeffs'))
+                mu = self._field(rbf, name + '_mu_coeffs')
+                # Rows have the shape of the parameters (as a single-site lookup), size (n_sites, *param_shape)
+                tables[name] = (None if mu is None else mu.to(dtype), std.to(dtype))
+        self.tables = tables
+        self.site_rows = {site: row for row, site in enumerate(sites)}
+        return self
+
+    def save_tables(self, path):
+        """
+        Save precomputed tables (e.g. alongside the stage-1 checkpoint).
+
+        :param path: str, path of saved file
+        """
+        if self.tables is None:
+            raise Exception('No precomputed tables, call precompute first.')
+        torch.save({'tables': self.tables, 'site_rows': self.site_rows}, path)
+
+    def load_tables(self, path):
+        """
+        Load tables saved with save_tables, onto the configured device.
+
+        :param path: str, path of saved file
+        :return: instance of OptimGaussianPrior
+        """
+        data = torch.load(path, map_location=torch.device(self.device))
+        self.tables = data['tables']
+        self.site_rows = data['site_rows']
+        return self
+
     def logp(self, net, test_input=None):
         """
         Compute log joint prior.
@@ -155,6 +287,68 @@ class OptimGaussianPrior(PriorModule):
             res -= 0.5 * torch.sum(((param - mu) ** 2) / var)
         return res
 
+    def _shared_mean(self, name, n_sites):
+        """
+        Extract the stationary mean of a layer's parameters (zero if not fitted), repeated for each site.
+
+        :param name: str, name of parameters
+        :param n_sites: int, number of sites
+        :return: float or torch.Tensor, size (n_sites, ...), mean at each site
+        """
+        mu = self.params.get(name + '_mu', 0.)
+        if isinstance(mu, torch.Tensor):
+            mu = mu.expand((n_sites,) + mu.shape)
+        return mu
+
+    def _get_params_at_sites(self, name, sites):
+        """
+        Extract hyperparameters for layer at several sites at once (one per network in a batch).
+
+        :param name: str, name of parameters
+        :param sites: list, row index of the test input for each network
+        :return: tuple, mean, std dev, and bool specifying if they vary by site (size (n_sites, ...)) or are shared
+        """
+        if self.tables is not None and name in self.tables and all(site in self.site_rows for site in sites):
+            mu_table, std_table = self.tables[name]
+            rows = torch.tensor([self.site_rows[site] for site in sites], device=std_table.device)
+            mu = self._shared_mean(name, len(sites)) if mu_table is None else mu_table[rows].float()
+            return mu, std_table[rows].float(), True
+        if self.rbf is None:
+            raise Exception('Must provide prior with embedding layer evaluations for nonstationary case.')
+        rbf = self.rbf[sites, :]
+        rho = self._field(rbf, name + '_rho_coeffs')
+        if rho is None:
+            mu, std = self._get_params_by_name(name)  # stationary hyperparameters
+            return mu, std, False
+        mu = self._field(rbf, name + '_mu_coeffs')
+        return (self._shared_mean(name, len(sites)) if mu is None else mu), F.softplus(rho), True
+
+    def logp_batched(self, stacked_params, site_indices=None):
+        """
+        Compute log joint prior of many networks at once, each against the prior at its own site.
+
+        Note: uses the precomputed tables (see precompute) when they cover all requested sites.
+
+        :param stacked_params: dict, parameter name to tensor of size (n_members, *param_shape)
+        :param site_indices: list or torch.Tensor, (optional) size (n_members), row index of the test input for each
+            network (nonstationary case)
+        :return: torch.Tensor, size (n_members), log joint prior of each network
+        """
+        sites = None if site_indices is None else [int(site) for site in site_indices]
+        res = 0.
+        for name, param in stacked_params.items():  # param tensors contain stacked weights and biases
+            if 'batch_norm' in name:
+                continue
+            if sites is None:
+                mu, std = self._get_params_by_name(name)
+                per_member = False
+            else:
+                mu, std, per_member = self._get_params_at_sites(name, sites)
+            mu = _member_view(mu, param, per_member)
+            var = _member_view(std, param, per_member) ** 2
+            res = res - 0.5 * (((param - mu) ** 2) / var).flatten(1).sum(1)
+        return res
+
 """
 Hierarchical Gaussian prior (Fixed and GPi-H)
 """
@@ -268,6 +462,25 @@ class FixedHierarchicalPrior(PriorModule):
             res -= 0.5 * torch.sum((param - mu) ** 2 / var)
         return res
 
+    def logp_batched(self, stacked_params, site_indices=None):
+        """
+        Compute log joint prior of many networks at once, given the current (resampled) std devs of each layer.
+
+        :param stacked_params: dict, parameter name to tensor of size (n_members, *param_shape)
+        :param site_indices: list or torch.Tensor, not used (stationary prior)
+        :return: torch.Tensor, size (n_members), log joint prior of each network
+        """
+        res = 0.
+        for name, param in stacked_params.items():
+            if 'batch_norm' in name:
+                continue
+            mu, std = self._get_params_by_name(name)
+            if std is None:
+                continue
+            var = _member_view(std.to(param.device), param, False) ** 2
+            res = res - 0.5 * ((param - mu) ** 2 / var).flatten(1).sum(1)
+        return res
+
 class OptimHierarchicalPrior(PriorModule):
     def __init__(self, saved_path, rbf=None, device="cpu"):
         """
@@ -464,3 +677,45 @@ class OptimHierarchicalPrior(PriorModule):
             res -= 0.5 * torch.sum((param - mu) ** 2 / var)
         return res
 
+    def logp_batched(self, stacked_params, site_indices=None):
+        """
+        Compute log joint prior of many networks at once, given the current (resampled) std devs of each layer, with
+        means evaluated at each network's site.
+
+        Note: with spatially varying shape and rate (nonstationary case), the std devs are resampled at one site (see
+        resample), so all networks must share that site.
+
+        :param stacked_params: dict, parameter name to tensor of size (n_members, *param_shape)
+        :param site_indices: list or torch.Tensor, (optional) size (n_members), row index of the test input for each
+            network (nonstationary case)
+        :return: torch.Tensor, size (n_members), log joint prior of each network
+        """
+        rbf = None
+        if site_indices is not None:
+            if self.rbf is None:
+                raise Exception('Must provide prior with embedding layer evaluations for nonstationary case.')
+            sites = [int(site) for site in site_indices]
+            if len(set(sites)) > 1 and any(key.endswith(('_shape_coeffs', '_rate_coeffs')) for key in self.params):
+                raise Exception('Std devs of the nonstationary hierarchical prior are resampled at a single site; '
+                                'evaluate one site at a time.')
+            rbf = self.rbf[sites, :]
+
+        res = 0.
+        for name, param in stacked_params.items():
+            if 'batch_norm' in name:
+                continue
+            std = self.params.get(name + '_std')  # e.g. "layers.hidden_X.W_std"
+            if std is None:
+                continue
+            if name + '_mu_coeffs' in self.params.keys():
+                if rbf is None:
+                    raise Exception('Must provide site_indices for nonstationary case.')
+                mu = torch.tensordot(rbf, self.params[name + '_mu_coeffs'], dims=([1], [0]))
+                per_member = True
+            else:
+                mu = self.params.get(name + '_mu', 0.)
+                per_member = False
+            mu = _member_view(mu, param, per_member)
+            var = _member_view(std, param, False) ** 2
+            res = res - 0.5 * ((param - mu) ** 2 / var).flatten(1).sum(1)
+        return res
@@ -31,7 +31,6 @@ from bnn_spatial.stage2.bayes_net import BayesNet
 from bnn_spatial.metrics.sampling import compute_rhat
 from bnn_spatial.sst.sst_generator import SST
 from bnn_spatial.metrics.prediction import rmspe, perc_coverage, interval_score
-from scipy.optimize import minimize, basinhopping
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'  # for handling OMP: Error 15 (2022/11/21)
 
@@ -514,26 +513,14 @@ GP.assign_data(gp,
                Y=y.reshape(-1, 1),
                sn2=sn2)
 
-# Function to use as objective in MLE (optimise in log space)
-def objective(log_hyper):
-    ampl, leng, sn2 = [np.exp(x) for x in log_hyper]
-    loglik, *_ = gp.marginal_loglik(ampl=ampl, leng=leng, sn2=sn2)
-    return -loglik
-
-# Optimisation of ML (in log space) to obtain kernel hyperparameter estimates
-hyper_init = np.asarray((ampl, leng, sn2))
-hyper_init_log = np.log(hyper_init)
-
-# Optimisation of ML to obtain kernel hyperparameter estimates
-ML_optim = basinhopping(func=objective,
-                        x0=hyper_init_log,
-                        niter=100,
-                        minimizer_kwargs={'method': 'BFGS'})
+# Maximum likelihood estimation of kernel hyperparameters (batched screening, then L-BFGS in log space)
+ML_optim = gp.fit_hyperparameters(init={'ampl': ampl, 'leng': leng, 'sn2': sn2},
+                                  n_candidates=64,
+                                  n_restarts=3,
+                                  update=False)
 
 # Extract optimised hyperparameters, and terms in likelihood
-hyper_opt_log = ML_optim.get('x')
-hyper_opt = [np.exp(x) for x in hyper_opt_log]
-opt_ampl, opt_leng, opt_sn2 = hyper_opt
+opt_ampl, opt_leng, opt_sn2 = ML_optim['ampl'], ML_optim['leng'], ML_optim['sn2']
 loglik0, modelfit0, complexity0 = gp.marginal_loglik(ampl=ampl, leng=leng, sn2=sn2)
 loglik, modelfit, complexity = gp.marginal_loglik(ampl=opt_ampl, leng=opt_leng, sn2=opt_sn2)
 print('Initial GP: amplitude {}, length-scale {}, measurement error variance {}'.format(ampl, leng, sn2))
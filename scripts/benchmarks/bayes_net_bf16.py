@@ -0,0 +1,79 @@
+"""
+Compare float32 and bfloat16 SGHMC sampling of BlankNet posteriors on the Ch5 2D setting (time and posterior summaries)
+"""
+
+import torch
+import numpy as np
+import os, sys
+import time
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.bnn.nets import BlankNet
+from bnn_spatial.gp.model import GP
+from bnn_spatial.gp import kernels, base
+from bnn_spatial.stage2.likelihoods import LikGaussian
+from bnn_spatial.stage2.priors import FixedGaussianPrior
+from bnn_spatial.stage2.bayes_net import BayesNet
+from bnn_spatial.metrics.sampling import compute_rhat
+from bnn_spatial.utils import util
+
+# Ch5 2D settings (fixed BNN prior), with shorter chains
+hidden_dims = [9**2, 40, 40, 40]
+embed_width = hidden_dims[0]
+transfer_fn = 'tanh'
+sn2 = 0.001  # measurement error variance
+n_train = 100
+rbf_ls = 1
+
+n_test_h = n_test_v = 64
+test_range = np.linspace(-4, 4, n_test_h)
+X1, X2 = np.meshgrid(test_range, test_range)
+test_array = np.vstack((X1.flatten(), X2.flatten())).T
+test_tensor = torch.from_numpy(test_array).float()
+
+sampling_configs = {
+    "batch_size": 32,
+    "num_samples": 100,
+    "n_discarded": 0,
+    "num_burn_in_steps": 2000,
+    "keep_every": 100,
+    "lr": 1e-2,  # adaptive SGHMC
+    "mdecay": 0.05,
+    "num_chains": 4,
+    "print_every_n_samples": 1000,
+}
+
+# Data set: noisy observations of a GP sample (RBF kernel, as in the Ch5 scripts)
+util.set_seed(1)
+gp = GP(kern=base.Isotropic(cov=kernels.RBF, ampl=1.0, leng=1.0))
+gp_latent = gp.sample_functions(test_tensor.double(), 1).detach().cpu().numpy().squeeze()
+inds = np.random.randint(0, test_array.shape[0], size=n_train)
+X = test_array[inds, :]
+y = gp_latent[inds] + np.sqrt(sn2) * np.random.randn(n_train)
+
+results = {}
+for compute_dtype in [None, 'bfloat16']:
+    util.set_seed(1)
+    net = BlankNet(output_dim=1, hidden_dims=hidden_dims, activation_fn=transfer_fn)
+    bayes_net = BayesNet(net, LikGaussian(sn2), FixedGaussianPrior(mu=0, std=1), sampling_method='adaptive_sghmc',
+                         compute_dtype=compute_dtype)
+    bayes_net.add_embedding_layer(input_dim=2, rbf_dim=embed_width, domain=test_tensor, rbf_ls=rbf_ls)
+
+    start = time.perf_counter()
+    bayes_net.sample_multi_chains(X, y, **sampling_configs)
+    t_sample = time.perf_counter() - start
+    preds, _ = bayes_net.predict(test_tensor)  # rows samples, cols test inputs
+    r_hat = compute_rhat(preds, sampling_configs['num_chains'])
+    results[compute_dtype] = (t_sample, preds.mean(0), preds.std(0), float(r_hat.mean()))
+
+t32, mean32, sd32, rhat32 = results[None]
+t16, mean16, sd16, rhat16 = results['bfloat16']
+print('{:>9} | {:>10} {:>10} {:>10} {:>8}'.format('dtype', 'time (s)', 'RMSE mean', 'mean sd', 'R-hat'))
+print('{:>9} | {:>10.2f} {:>10.4f} {:>10.4f} {:>8.4f}'.format('float32', t32, np.sqrt(np.mean((mean32 - gp_latent) ** 2)),
+                                                            sd32.mean(), rhat32))
+print('{:>9} | {:>10.2f} {:>10.4f} {:>10.4f} {:>8.4f}'.format('bfloat16', t16, np.sqrt(np.mean((mean16 - gp_latent) ** 2)),
+                                                            sd16.mean(), rhat16))
+print('speedup {:.2f}, max |mean difference| {:.4f}, max |sd difference| {:.4f}'
+      .format(t32 / t16, np.abs(mean16 - mean32).max(), np.abs(sd16 - sd32).max()))
@@ -0,0 +1,62 @@
+"""
+Benchmark float64 against mixed-precision (float32) GP sampling and prediction
+"""
+
+import torch
+import numpy as np
+import os, sys
+import time
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.gp.model import GP
+from bnn_spatial.gp import kernels, base
+
+torch.manual_seed(1)
+n_reps = 5  # timing repetitions per setting
+n_samples = 128  # number of sampled functions
+n_train = 400  # training set size for predictions
+
+def timed(fn):
+    """
+    Return mean wall-clock time (seconds) over n_reps calls, and the output of the last call.
+    """
+    out = fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(n_reps):
+        out = fn()
+    return (time.perf_counter() - start) / n_reps, out
+
+print('{:>6} {:>8} {:>6} | {:>10} {:>10} {:>7} | {:>10} {:>10} {:>10}'
+      .format('n', 'cov', 'leng', 't64 samp', 't32 samp', 'speedup', 'cov err', 'mean err', 'sd err'))
+for n_side in [32, 48, 64]:
+    grid = np.linspace(-4, 4, n_side)
+    X1, X2 = np.meshgrid(grid, grid)
+    X = torch.from_numpy(np.vstack((X1.flatten(), X2.flatten())).T).float()
+    for cov, leng in [(kernels.RBF, 0.5), (kernels.RBF, 1.0), (kernels.Matern32, 1.0)]:
+        kern = base.Isotropic(cov=cov, ampl=1.0, leng=leng)
+        gp64 = GP(kern=kern)
+        gp32 = GP(kern=kern, precision='mixed')
+
+        # Prior sampling: time, and accuracy of the empirical covariance of the float32 path (large sample)
+        t64, _ = timed(lambda: gp64.sample_functions(X, n_samples))
+        t32, _ = timed(lambda: gp32.sample_functions(X, n_samples))
+        K = kern.K(X)
+        L32 = gp32.cholesky_mixed(kern.K(X, dtype=torch.float32))
+        cov_err = float('nan') if L32 is None else (torch.norm(L32.double() @ L32.double().T - K) / torch.norm(K)).item()
+
+        # Predictions: compare posterior mean and SD at all points
+        idxs = torch.randperm(X.shape[0])[:n_train]
+        Y = gp64.sample_functions(X[idxs], 1) + 0.1 * torch.randn(n_train, 1, dtype=torch.float64)
+        gp64.assign_data(X[idxs], Y, sn2=0.01)
+        gp32.assign_data(X[idxs], Y, sn2=0.01)
+        mu64, var64 = gp64.predict_f(X, full_cov=False)
+        mu32, var32 = gp32.predict_f(X, full_cov=False)
+        mean_err = (mu32 - mu64).abs().max().item()
+        sd_err = (var32.clamp(min=0).sqrt() - var64.clamp(min=0).sqrt()).abs().max().item()
+
+        print('{:>6} {:>8} {:>6} | {:>10.4f} {:>10.4f} {:>7.2f} | {:>10.2e} {:>10.2e} {:>10.2e}'
+              .format(X.shape[0], cov.__name__, leng, t64, t32, t64 / t32, cov_err, mean_err, sd_err))
+        print('       float32 factors: {}, fallbacks to float64: {}'
+              .format(gp32.precision_stats['n_float32'], gp32.precision_stats['n_fallback']))
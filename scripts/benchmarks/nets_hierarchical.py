@@ -0,0 +1,63 @@
+"""
+Exercise all HierarchicalNet sampling paths, and benchmark GPi-H against GPi-G stage-1 sampling time
+"""
+
+import torch
+import numpy as np
+import os, sys
+import time
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.bnn.nets import GaussianNet, HierarchicalNet
+
+torch.manual_seed(1)
+n_reps = 10  # timing repetitions per setting
+n_samples = 128  # number of network samples
+n_data = 1024  # size of measurement set
+
+# Measurement set drawn from a 32-by-32 grid on [-4, 4]^2 (as in the Ch5 scripts)
+grid = np.linspace(-4, 4, 32)
+X1, X2 = np.meshgrid(grid, grid)
+domain = torch.from_numpy(np.vstack((X1.flatten(), X2.flatten())).T).float()
+X = domain[torch.randperm(domain.shape[0])[:n_data]]
+
+def timed(fn):
+    """
+    Return mean wall-clock time (seconds) over n_reps calls.
+    """
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(n_reps):
+        fn()
+    return (time.perf_counter() - start) / n_reps
+
+# Every code path: stationary (with and without embedding layer) and nonstationary, with and without fitted means
+print('{:>9} {:>9} {:>9} | {:>14} {:>16} {:>10}'.format('prior_per', 'embedding', 'fit_means', 'forward', 'sample_functions',
+                                                        'grads ok'))
+for prior_per, use_domain in [('layer', False), ('parameter', False), ('layer', True), ('parameter', True),
+                              ('input', True)]:
+    for fit_means in [False, True]:
+        net = HierarchicalNet(input_dim=2, output_dim=1, hidden_dims=[16, 32, 32], activation_fn='tanh',
+                              domain=domain if use_domain else None, prior_per=prior_per, fit_means=fit_means)
+        fwd = net(X)
+        out = net.sample_functions(X, n_samples)
+        out.sum().backward()
+        grads_ok = all(p.grad is not None and torch.isfinite(p.grad).all() for n, p in net.named_parameters()
+                       if 'mu' not in n or fit_means)
+        print('{:>9} {:>9} {:>9} | {:>14} {:>16} {:>10}'.format(prior_per, str(use_domain), str(fit_means),
+                                                                str(tuple(fwd.shape)), str(tuple(out.shape)),
+                                                                str(grads_ok)))
+
+# Stage-1 sampling time (forward and backward), GPi-H against GPi-G
+print('\n{:>9} {:>10} {:>10} {:>7}'.format('prior_per', 'GPi-G (s)', 'GPi-H (s)', 'ratio'))
+for prior_per_G, prior_per_H, nonstationary in [('layer', 'layer', False), ('parameter', 'parameter', False),
+                                                ('layer', 'input', True)]:
+    net_G = GaussianNet(input_dim=2, output_dim=1, hidden_dims=[16, 32, 32], activation_fn='tanh', domain=domain,
+                        prior_per=prior_per_G, nonstationary=nonstationary)
+    net_H = HierarchicalNet(input_dim=2, output_dim=1, hidden_dims=[16, 32, 32], activation_fn='tanh', domain=domain,
+                            prior_per=prior_per_H)
+    t_G = timed(lambda: net_G.sample_functions(X, n_samples).sum().backward())
+    t_H = timed(lambda: net_H.sample_functions(X, n_samples).sum().backward())
+    print('{:>9} {:>10.4f} {:>10.4f} {:>7.2f}'.format(prior_per_H, t_G, t_H, t_H / t_G))
@@ -0,0 +1,78 @@
+"""
+Check that pointwise draws with the local reparameterisation (GaussianNet.sample_marginals) match the marginal
+distribution of weight-space function samples (sample_functions) at each input, and compare their cost
+"""
+
+import torch
+import numpy as np
+import os, sys
+import time
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.bnn.nets import GaussianNet
+
+torch.manual_seed(1)
+n_reps = 10  # timing repetitions per setting
+n_samples = 20000  # number of network samples for the distributional checks
+n_data = 16  # number of inputs
+
+# Inputs: random points in [-4, 4]^2
+X = 8 * torch.rand(n_data, 2) - 4
+
+def timed(fn):
+    """
+    Return mean wall-clock time (seconds) over n_reps calls.
+    """
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(n_reps):
+        fn()
+    return (time.perf_counter() - start) / n_reps
+
+def ks_stat(a, b):
+    """
+    Two-sample Kolmogorov-Smirnov statistic between 1D samples a and b.
+    """
+    grid = torch.cat([a, b]).sort().values
+    F_a = torch.searchsorted(a.sort().values, grid, right=True).double() / a.numel()
+    F_b = torch.searchsorted(b.sort().values, grid, right=True).double() / b.numel()
+    return (F_a - F_b).abs().max().item()
+
+# Critical value of the two-sample KS test at the 1% level (asymptotic)
+ks_crit = 1.63 * np.sqrt(2 / n_samples)
+
+# Tolerances: max z-score of the differences in means and in variances (over inputs), and the KS critical value
+z_tol = 4.
+
+print('{:>9} {:>9} {:>6} | {:>9} {:>9} {:>9} {:>9} {:>5} | {:>10} {:>10}'
+      .format('prior_per', 'fit_means', 'width', 'mean err', 'var err', 'max KS', 'KS crit', 'ok', 'weights (s)',
+              'local (s)'))
+for prior_per in ['layer', 'parameter']:
+    for fit_means in [False, True]:
+        for width in [32, 128]:
+            net = GaussianNet(input_dim=2, output_dim=1, hidden_dims=[width, width], activation_fn='tanh',
+                              prior_per=prior_per, fit_means=fit_means)
+            with torch.no_grad():
+                for p in net.parameters():
+                    p.normal_(0, 0.5)  # move away from the initial values, so the means are nonzero if fitted
+                f_w = net.sample_functions(X, n_samples).squeeze(-1)  # (n_data, n_samples)
+                f_l = net.sample_marginals(X, n_samples).squeeze(-1)
+
+                # Marginal distribution at each input: moments (relative to their sampling errors) and KS statistic
+                mean_se = torch.sqrt((f_w.var(1) + f_l.var(1)) / n_samples)
+                mean_err = ((f_l.mean(1) - f_w.mean(1)).abs() / mean_se).max().item()
+                var_se = torch.sqrt((((f_w - f_w.mean(1, keepdim=True)) ** 2).var(1)
+                                     + ((f_l - f_l.mean(1, keepdim=True)) ** 2).var(1)) / n_samples)
+                var_err = ((f_l.var(1) - f_w.var(1)).abs() / var_se).max().item()
+                ks = max(ks_stat(f_w[i], f_l[i]) for i in range(n_data))
+                ok = mean_err < z_tol and var_err < z_tol and ks < ks_crit
+
+                t_w = timed(lambda: net.sample_functions(X, 512))
+                t_l = timed(lambda: net.sample_marginals(X, 512))
+
+            print('{:>9} {:>9} {:>6} | {:>9.3f} {:>9.3f} {:>9.4f} {:>9.4f} {:>5} | {:>10.5f} {:>10.5f}'
+                  .format(prior_per, str(fit_means), width, mean_err, var_err, ks, ks_crit, str(ok), t_w, t_l))
+print('mean err, var err: max |difference| / standard error of the difference, over inputs (tolerance {})'
+      .format(z_tol))
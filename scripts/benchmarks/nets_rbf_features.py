@@ -0,0 +1,59 @@
+"""
+Benchmark stage-1 sampling time and memory of nonstationary GaussianNet with shared (uncopied) RBF features
+"""
+
+import torch
+import numpy as np
+import os, sys
+import time
+from copy import deepcopy
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.bnn.nets import GaussianNet
+
+torch.manual_seed(1)
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+n_reps = 10  # timing repetitions per setting
+n_samples = 128  # number of network samples
+
+# Measurement set: 64-by-64 grid on [-4, 4]^2 (as in the Ch5 scripts)
+grid = np.linspace(-4, 4, 64)
+X1, X2 = np.meshgrid(grid, grid)
+domain = torch.from_numpy(np.vstack((X1.flatten(), X2.flatten())).T).float().to(device)
+
+def timed(fn):
+    """
+    Return mean wall-clock time (seconds) over n_reps calls, and the peak device memory (bytes, CUDA only).
+    """
+    fn()  # warm-up
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(n_reps):
+        fn()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    peak = torch.cuda.max_memory_allocated() if device == 'cuda' else float('nan')
+    return (time.perf_counter() - start) / n_reps, peak
+
+print('{:>6} {:>6} {:>9} | {:>10} {:>12} | {:>12} {:>12}'
+      .format('n', 'width', 'prior_per', 'sample (s)', 'peak (MB)', 'copy (s)', 'copy (MB)'))
+for n_data in [256, 1024, 4096]:
+    X = domain[torch.randperm(domain.shape[0])[:n_data]]
+    for width, prior_per in [(16, 'layer'), (32, 'layer'), (16, 'parameter')]:
+        net = GaussianNet(input_dim=2, output_dim=1, hidden_dims=[64, width, width], activation_fn='tanh',
+                          domain=domain, prior_per=prior_per, nonstationary=True).to(device)
+        with torch.no_grad():
+            t_sample, peak = timed(lambda: net.sample_functions(X, n_samples))
+
+            # Cost of the copies that the forward pipeline no longer makes: deepcopy of the RBF features in the net,
+            # and clone of the features in the first layer after the embedding
+            X_RBF = net.layers[0](X)
+            t_copy, _ = timed(lambda: (deepcopy(X_RBF), X_RBF.detach().clone()))
+        copy_mb = 2 * X_RBF.numel() * X_RBF.element_size() / 2**20
+
+        print('{:>6} {:>6} {:>9} | {:>10.4f} {:>12.1f} | {:>12.6f} {:>12.2f}'
+              .format(n_data, width, prior_per, t_sample, peak / 2**20, t_copy, copy_mb))
@@ -0,0 +1,101 @@
+"""
+Check that batched log prior evaluation (logp_batched) matches per-network evaluation (logp) for every prior module
+"""
+
+import torch
+import numpy as np
+import os, sys
+import tempfile
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.bnn.nets import BlankNet, GaussianNet, HierarchicalNet
+from bnn_spatial.bnn.layers.embedding_layer import EmbeddingLayer
+from bnn_spatial.stage2.priors import FixedGaussianPrior, OptimGaussianPrior, FixedHierarchicalPrior, \
+    OptimHierarchicalPrior
+
+torch.manual_seed(1)
+n_members = 8  # number of stacked networks
+rtol = 1e-5  # max relative difference between batched and per-network log priors
+hidden_dims = [16, 8, 8]
+
+# Sites on an 8-by-8 grid on [-4, 4]^2, with embedding layer evaluations
+grid = np.linspace(-4, 4, 8)
+X1, X2 = np.meshgrid(grid, grid)
+domain = torch.from_numpy(np.vstack((X1.flatten(), X2.flatten())).T).float()
+rbf = EmbeddingLayer(input_dim=2, output_dim=hidden_dims[0], domain=domain, rbf_ls=1)(domain).detach()
+
+# One stage-2 network per site, with random parameters, and the same parameters stacked
+nets = [BlankNet(output_dim=1, hidden_dims=hidden_dims, activation_fn='tanh') for _ in range(n_members)]
+sites = torch.randperm(domain.shape[0])[:n_members].tolist()
+with torch.no_grad():
+    for net in nets:
+        for p in net.parameters():
+            p.normal_(0, 1)
+    stacked = {name: torch.stack([dict(net.named_parameters())[name] for net in nets])
+               for name, _ in nets[0].named_parameters()}
+
+def saved_prior(stage1_net, path):
+    """
+    Save the hyperparameters of a stage-1 network (moved away from their initial values), named as the parameters of
+    the stage-2 network, and return the checkpoint path.
+    """
+    with torch.no_grad():
+        for p in stage1_net.parameters():
+            p.normal_(0, 0.5)
+    state = {k.replace('output_layer.', 'layers.output.'): v for k, v in stage1_net.state_dict().items()}
+    torch.save(state, path)
+    return path
+
+def max_rel_err(prior, site_list):
+    """
+    Max relative difference between batched and per-network log priors (site_list None for stationary priors).
+    """
+    batched = prior.logp_batched(stacked, site_list)
+    looped = torch.stack([torch.as_tensor(prior.logp(net, site)).reshape(())
+                          for net, site in zip(nets, site_list or [None] * n_members)])
+    return ((batched - looped).abs() / looped.abs()).max().item()
+
+with tempfile.TemporaryDirectory() as tmp_dir, torch.no_grad():
+    G_kwargs = dict(input_dim=2, output_dim=1, hidden_dims=hidden_dims, activation_fn='tanh', domain=domain,
+                    prior_per='parameter', fit_means=True)
+    H_kwargs = dict(input_dim=2, output_dim=1, hidden_dims=hidden_dims, activation_fn='tanh', domain=domain,
+                    fit_means=True)
+
+    # Hierarchical priors are evaluated given their current std devs, resampled at one site if nonstationary
+    H_stat = OptimHierarchicalPrior(saved_prior(HierarchicalNet(prior_per='parameter', **H_kwargs),
+                                                os.path.join(tmp_dir, 'H_stat.ckpt')), rbf=rbf)
+    H_stat.resample(nets[0])
+    H_nonstat = OptimHierarchicalPrior(saved_prior(HierarchicalNet(prior_per='input', **H_kwargs),
+                                                   os.path.join(tmp_dir, 'H_nonstat.ckpt')), rbf=rbf)
+    H_nonstat.resample(nets[0], test_input=sites[0])
+
+    cases = [
+        ('FixedGaussianPrior', FixedGaussianPrior(mu=0.1, std=0.7), None),
+        ('OptimGaussianPrior (stationary)',
+         OptimGaussianPrior(saved_prior(GaussianNet(**G_kwargs), os.path.join(tmp_dir, 'G_stat.ckpt')), rbf=rbf),
+         None),
+        ('OptimGaussianPrior (nonstationary)',
+         OptimGaussianPrior(saved_prior(GaussianNet(nonstationary=True, **G_kwargs),
+                                        os.path.join(tmp_dir, 'G_nonstat.ckpt')), rbf=rbf), sites),
+        ('OptimGaussianPrior (rank 2)',
+         OptimGaussianPrior(saved_prior(GaussianNet(nonstationary=True, rank=2, **G_kwargs),
+                                        os.path.join(tmp_dir, 'G_rank.ckpt')), rbf=rbf), sites),
+        ('FixedHierarchicalPrior', FixedHierarchicalPrior(nets[0], mu=0.1, shape=2., rate=1.), None),
+        ('OptimHierarchicalPrior (stationary)', H_stat, None),
+        ('OptimHierarchicalPrior (one site)', H_nonstat, [sites[0]] * n_members),
+    ]
+
+    for label, prior, site_list in cases:
+        err = max_rel_err(prior, site_list)
+        assert err < rtol, '{}: logp_batched differs from logp (max rel err {:.2e})'.format(label, err)
+        print('{:>36}: ok (max rel err {:.2e})'.format(label, err))
+
+    # Nonstationary GPi-H std devs belong to a single site, so a batch over several sites must be rejected
+    try:
+        H_nonstat.logp_batched(stacked, sites)
+    except Exception as e:
+        print('{:>36}: ok (rejected: {})'.format('OptimHierarchicalPrior (sites)', e))
+    else:
+        raise AssertionError('OptimHierarchicalPrior accepted a batch over several sites')
@@ -0,0 +1,100 @@
+"""
+Check that the precomputed prior tables of OptimGaussianPrior (precompute, save_tables, tables_path) reproduce the
+direct evaluation of the prior means and std devs at each site, in float32 and float16 storage
+"""
+
+import torch
+import numpy as np
+import os, sys
+import tempfile
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.bnn.nets import BlankNet, GaussianNet
+from bnn_spatial.bnn.layers.embedding_layer import EmbeddingLayer
+from bnn_spatial.stage2.priors import OptimGaussianPrior
+
+torch.manual_seed(1)
+hidden_dims = [16, 8, 8]
+tolerances = {torch.float32: 1e-5, torch.float16: 2e-3}  # max relative error of table rows, by storage type
+
+# Sites on an 8-by-8 grid on [-4, 4]^2, with embedding layer evaluations
+grid = np.linspace(-4, 4, 8)
+X1, X2 = np.meshgrid(grid, grid)
+domain = torch.from_numpy(np.vstack((X1.flatten(), X2.flatten())).T).float()
+rbf = EmbeddingLayer(input_dim=2, output_dim=hidden_dims[0], domain=domain, rbf_ls=1)(domain).detach()
+sites = list(range(domain.shape[0]))
+
+# Stage-2 network, whose parameter names index the prior
+net = BlankNet(output_dim=1, hidden_dims=hidden_dims, activation_fn='tanh')
+names = [name for name, _ in net.named_parameters()]
+
+def saved_prior(path, extra_means=False, **kwargs):
+    """
+    Save the hyperparameters of a nonstationary stage-1 network (moved away from their initial values), optionally
+    with stationary means added, and return the checkpoint path.
+    """
+    bnn = GaussianNet(input_dim=2, output_dim=1, hidden_dims=hidden_dims, activation_fn='tanh', domain=domain,
+                      nonstationary=True, **kwargs)
+    with torch.no_grad():
+        for p in bnn.parameters():
+            p.normal_(0, 0.5)
+    state = bnn.state_dict()
+    if extra_means:
+        for name, param in net.named_parameters():
+            state[name + '_mu'] = 0.5 * torch.randn(param.shape)
+    torch.save(state, path)
+    return path
+
+def rel_err(a, b):
+    """
+    Relative difference (max norm) between a (table) and b (direct), either of which may be the float 0.
+    """
+    a, b = torch.as_tensor(a, dtype=torch.float32), torch.as_tensor(b, dtype=torch.float32)
+    return ((a - b).abs().max() / b.abs().max().clamp(min=1e-6)).item()
+
+with tempfile.TemporaryDirectory() as tmp_dir, torch.no_grad():
+    cases = [
+        ('per parameter, fitted means', dict(prior_per='parameter', fit_means=True), False),
+        ('per parameter, rank 2', dict(prior_per='parameter', fit_means=True, rank=2), False),
+        ('per layer, no means', dict(prior_per='layer'), False),
+        ('per layer, stationary means', dict(prior_per='layer'), True),
+    ]
+
+    for label, kwargs, extra_means in cases:
+        ckpt_path = saved_prior(os.path.join(tmp_dir, 'prior.ckpt'), extra_means=extra_means, **kwargs)
+        direct = OptimGaussianPrior(saved_path=ckpt_path, rbf=rbf)
+        for dtype, tol in tolerances.items():
+            tabled = OptimGaussianPrior(saved_path=ckpt_path, rbf=rbf).precompute(sites, dtype=dtype)
+            tables_path = os.path.join(tmp_dir, 'tables.pt')
+            tabled.save_tables(tables_path)
+            loaded = OptimGaussianPrior(saved_path=ckpt_path, rbf=rbf, tables_path=tables_path)
+
+            # Table rows against the direct evaluation, at every site and for every parameter tensor
+            mean_err, std_err, loaded_err = 0., 0., 0.
+            for site in sites:
+                for name in names:
+                    mu, std = direct._get_params_by_name(name, site)
+                    mu_t, std_t = tabled._get_params_by_name(name, site)
+                    mu_l, std_l = loaded._get_params_by_name(name, site)
+                    assert torch.as_tensor(mu_t).shape == torch.as_tensor(mu).shape and std_t.shape == std.shape, \
+                        '{}: table rows of {} do not have the shape of the direct evaluation'.format(label, name)
+                    mean_err = max(mean_err, rel_err(mu_t, mu))
+                    std_err = max(std_err, rel_err(std_t, std))
+                    loaded_err = max(loaded_err, rel_err(mu_l, mu_t), rel_err(std_l, std_t))
+
+            # Log priors with and without tables (batched over one network per site, and looped)
+            stacked = {name: torch.stack([param] * len(sites)) for name, param in net.named_parameters()}
+            logp = torch.stack([torch.as_tensor(direct.logp(net, site)) for site in sites])
+            logp_err = max(rel_err(tabled.logp_batched(stacked, sites), logp),
+                           rel_err(torch.stack([torch.as_tensor(tabled.logp(net, site)) for site in sites]), logp))
+
+            dtype_name = str(dtype).replace('torch.', '')
+            assert mean_err < tol and std_err < tol, '{} ({}): table rows differ from the direct evaluation ' \
+                '(mean err {:.2e}, std err {:.2e})'.format(label, dtype_name, mean_err, std_err)
+            assert loaded_err == 0., '{} ({}): tables changed by save_tables/tables_path'.format(label, dtype_name)
+            assert logp_err < 10 * tol, '{} ({}): log prior with tables differs from the direct evaluation ' \
+                '(max rel err {:.2e})'.format(label, dtype_name, logp_err)
+            print('{:>28} {:>8}: ok (mean err {:.2e}, std err {:.2e}, logp err {:.2e})'
+                  .format(label, dtype_name, mean_err, std_err, logp_err))
@@ -0,0 +1,66 @@
+"""
+Check that the sparse GP approximations (SparseGP) reproduce the exact GP when the inducing inputs are the training
+inputs, for which Q = K_fu K_uu^{-1} K_uf equals K_ff (up to the jitter added to K_uu)
+"""
+
+import torch
+import numpy as np
+import os, sys
+
+CWD = sys.path[0]  # directory containing script
+sys.path.append(os.path.dirname(os.path.dirname(CWD)))
+
+from bnn_spatial.gp.model import GP
+from bnn_spatial.gp.sparse import SparseGP
+from bnn_spatial.gp import kernels, base
+
+torch.manual_seed(1)
+n_train = 100  # training set size (and number of inducing inputs)
+n_test = 400  # test set size
+sn2 = 0.1  # measurement error variance
+tol = 1e-3  # max relative error, limited by the jitter added to K_uu
+
+def rel_err(a, b):
+    """
+    Relative difference (max norm) between a (sparse) and b (exact).
+    """
+    return ((a - b).abs().max() / b.abs().max()).item()
+
+# Noisy observations of a smooth function at random inputs in [-4, 4]^2, and test inputs on a grid
+X = 8 * torch.rand(n_train, 2, dtype=torch.float64) - 4
+Y = torch.sin(X[:, :1]) * torch.cos(X[:, 1:]) + np.sqrt(sn2) * torch.randn(n_train, 1, dtype=torch.float64)
+grid = np.linspace(-4, 4, int(np.sqrt(n_test)))
+X1, X2 = np.meshgrid(grid, grid)
+Xnew = torch.from_numpy(np.vstack((X1.flatten(), X2.flatten())).T)
+
+with torch.no_grad():
+    for cov in [kernels.RBF, kernels.Matern32]:
+        kern = base.Isotropic(cov=cov, ampl=1.0, leng=1.0)
+        exact = GP(kern=kern)
+        exact.assign_data(X, Y, sn2=sn2)
+        mean, var = exact.predict_f(Xnew, full_cov=False)
+        var_train = exact.predict_f(X, full_cov=False)[1]
+        loglik = exact.log_marginal_likelihood(torch.log(torch.tensor([1.0, 1.0, sn2], dtype=torch.float64)))
+
+        for approx in ['sor', 'dtc', 'fitc', 'vfe']:
+            sparse = SparseGP(kern=kern, Z=X.clone(), approx=approx)
+            sparse.assign_data(X, Y, sn2=sn2)
+            mean_s, var_s = sparse.predict_f(Xnew, full_cov=False)
+            mean_err = rel_err(mean_s, mean)
+
+            # SoR uses Q_** for the predictive variance, which equals K_** only at the inducing inputs
+            if approx == 'sor':
+                var_err = rel_err(sparse.predict_f(X, full_cov=False)[1], var_train)
+            else:
+                var_err = rel_err(var_s, var)
+            loglik_err = rel_err(sparse.log_marginal_likelihood(), loglik)
+
+            label = '{} ({})'.format(approx, cov.__name__)
+            assert mean_err < tol, '{}: predictive mean differs from the exact GP (rel err {:.2e})'.format(label,
+                                                                                                         mean_err)
+            assert var_err < tol, '{}: predictive variance differs from the exact GP (rel err {:.2e})'.format(label,
+                                                                                                            var_err)
+            assert loglik_err < tol, '{}: log marginal likelihood differs from the exact GP (rel err {:.2e})'\
+                .format(label, loglik_err)
+            print('{:>18}: ok (mean err {:.2e}, var err {:.2e}, loglik err {:.2e})'
+                  .format(label, mean_err, var_err, loglik_err))